@@ -6,8 +6,16 @@
 import forumdb
 
 # Other modules used to run a web server.
+import argparse
 import cgi
-from wsgiref.simple_server import make_server
+import email.utils
+import itertools
+import math
+import Queue
+import sys
+import threading
+import time
+from wsgiref.simple_server import make_server, WSGIServer
 from wsgiref import util
 
 # HTML template for the forum page
@@ -43,18 +51,130 @@ POST = '''\
     <div class=post><em class=date>%(time)s</em><br>%(content)s</div>
 '''
 
+# The page around the posts, streamed before and after them
+HEADER, FOOTER = (HTML_WRAP % '\0').split('\0')
+
+# HTML template for the link to the next page of older posts
+OLDER = '''\
+    <div class=post><a href="/?before=%(id)d">Older posts</a></div>
+'''
+
+# Rendered pages by ?before=<id>, as (etag, html), and posts by id. Pages
+# are good until the next post changes the etag; posts never change. Pages
+# longer than PAGE_BYTES are streamed every time instead.
+PAGES = {}
+FRAGMENTS = {}
+CACHE_SIZE = 10000
+PAGE_BYTES = 256 * 1024
+
+## Validators of the pages
+def Validators():
+    '''Return the ETag of the current posts and the time they last changed.
+
+    The ETag changes with every post, whichever process added it. The time
+    is rounded up to the whole second of Last-Modified, and is None until
+    that second is over: a post later in the same second would not change
+    it, so a copy sent before then cannot be validated by time.
+    '''
+    version, changed = forumdb.Changed()
+    changed = int(math.ceil(changed))
+    if changed > time.time():
+        changed = None
+    return '"%s"' % version, changed
+
+## Headers of the validators
+def ValidatorHeaders(etag, changed):
+    '''Return the ETag and, once it is settled, the Last-Modified header.'''
+    headers = [('ETag', etag)]
+    if changed is not None:
+        headers.append(('Last-Modified',
+                        email.utils.formatdate(changed, usegmt=True)))
+    return headers
+
+## Conditional GET check
+def Fresh(env, etag, changed):
+    '''Tell whether the client's copy of the page is still current.'''
+    match = env.get('HTTP_IF_NONE_MATCH')
+    if match is not None:
+        tags = [tag.strip() for tag in match.split(',')]
+        return etag in tags or '*' in tags
+    since = email.utils.parsedate_tz(env.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return (since is not None and changed is not None and
+            email.utils.mktime_tz(since) >= changed)
+
+## Render a post, once
+def Fragment(post):
+    '''Return the HTML of a post from the cache, rendering it on first use.'''
+    html = FRAGMENTS.get(post['id'])
+    if html is None:
+        if len(FRAGMENTS) >= CACHE_SIZE:
+            FRAGMENTS.clear()
+        html = FRAGMENTS[post['id']] = POST % post
+    return html
+
+## Stream a page
+def Render(before, etag):
+    '''Yield the page header, the posts batch by batch from forumdb.IterPosts
+    and then the footer, so the first bytes go out before the posts are read
+    and memory stays at one batch. One post more than a page is read, and
+    the link to the older posts is only shown if it exists. The page is kept
+    in PAGES if it is not longer than PAGE_BYTES.
+    '''
+    kept, size = [HEADER], len(HEADER)
+    yield HEADER
+    count, last, more = 0, None, False
+    posts = forumdb.IterPosts(forumdb.PAGE_SIZE + 1, before)
+    try:
+        while True:
+            batch = list(itertools.islice(posts, forumdb.BATCH_SIZE))
+            if count + len(batch) > forumdb.PAGE_SIZE:
+                # the extra post only tells that there are older ones
+                batch, more = batch[:forumdb.PAGE_SIZE - count], True
+            if not batch:
+                break
+            count, last = count + len(batch), batch[-1]
+            part = ''.join(Fragment(p) for p in batch)
+            size += len(part)
+            if kept is not None and size <= PAGE_BYTES:
+                kept.append(part)
+            else:
+                kept = None
+            yield part
+    finally:
+        posts.close()
+    part = FOOTER
+    if more:
+        part = OLDER % last + part
+    yield part
+    if kept is not None:
+        if len(PAGES) >= CACHE_SIZE:
+            PAGES.clear()
+        PAGES[before] = (etag, ''.join(kept) + part)
+
 ## Request handler for main page
 def View(env, resp):
     '''View is the 'main page' of the forum.
 
-    It displays the submission form and the previously posted messages.
+    It displays the submission form and one page of the previously posted
+    messages, the newest ones or the ones before ?before=<id>. Pages are
+    streamed by Render once per change of the posts and served from PAGES
+    after that. The validators come from Dispatcher, which already read them.
     '''
-    # get posts from database
-    posts = forumdb.GetAllPosts()
+    query = cgi.parse_qs(env.get('QUERY_STRING', ''))
+    try:
+        before = int(query['before'][0])
+    except (KeyError, ValueError):
+        before = None
+    etag, changed = env.get('forum.validators') or Validators()
     # send results
-    headers = [('Content-type', 'text/html')]
+    headers = ([('Content-type', 'text/html')] +
+               ValidatorHeaders(etag, changed) +
+               [('Cache-Control', 'no-cache')])
     resp('200 OK', headers)
-    return [HTML_WRAP % ''.join(POST % p for p in posts)]
+    cached = PAGES.get(before)
+    if cached is not None and cached[0] == etag:
+        return [cached[1]]
+    return Render(before, etag)
 
 ## Request handler for posting - inserts to database
 def Post(env, resp):
@@ -87,10 +207,23 @@ DISPATCH = {'': View,
             'post': Post,
 	    }
 
+## Pages that change only when a post is added; see Validators.
+VALIDATED = set([''])
+
 ## Dispatcher forwards requests according to the DISPATCH table.
 def Dispatcher(env, resp):
-    '''Send requests to handlers based on the first path component.'''
+    '''Send requests to handlers based on the first path component.
+
+    A GET of a validated page the client already has is answered with 304
+    Not Modified, without calling its handler; otherwise the handler gets
+    the validators in env['forum.validators'].
+    '''
     page = util.shift_path_info(env)
+    if page in VALIDATED and env.get('REQUEST_METHOD') in ('GET', 'HEAD'):
+        etag, changed = env['forum.validators'] = Validators()
+        if Fresh(env, etag, changed):
+            resp('304 Not Modified', ValidatorHeaders(etag, changed))
+            return []
     if page in DISPATCH:
         return DISPATCH[page](env, resp)
     else:
@@ -100,8 +233,60 @@ def Dispatcher(env, resp):
         return ['Not Found: ' + page]
 
 
+## A WSGI server with a pool of request threads
+class PooledWSGIServer(WSGIServer):
+    '''wsgiref's server, but requests are handled by a fixed pool of worker
+    threads, so one slow client only holds up its own worker. Accepted
+    connections wait in a bounded queue for a free worker.'''
+
+    workers = 8
+
+    def serve_forever(self, poll_interval=0.5):
+        self.requests = Queue.Queue(self.workers * 4)
+        for i in range(self.workers):
+            worker = threading.Thread(target=self.Work)
+            worker.daemon = True
+            worker.start()
+        WSGIServer.serve_forever(self, poll_interval)
+
+    def process_request(self, request, client_address):
+        self.requests.put((request, client_address))
+
+    def Work(self):
+        while True:
+            request, client_address = self.requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+## Start the server
+def main(argv):
+    '''Serve Dispatcher on --host and --port with --workers threads; one
+    worker serves one request at a time like plain wsgiref.'''
+    parser = argparse.ArgumentParser(description='Serve the forum.')
+    parser.add_argument('--host', default='',
+                        help='address to listen on, all of them by default')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=8,
+                        help='request threads')
+    args = parser.parse_args(argv)
+    if args.workers > 1:
+        # every worker may hold a database connection
+        forumdb.POOL_SIZE = max(forumdb.POOL_SIZE, args.workers)
+        httpd = make_server(args.host, args.port, Dispatcher,
+                            server_class=PooledWSGIServer)
+        httpd.workers = args.workers
+    else:
+        httpd = make_server(args.host, args.port, Dispatcher)
+    print "Serving HTTP on port %d with %d workers..." % (args.port,
+                                                          args.workers)
+    httpd.serve_forever()
+
+
 # Run this bad server only on localhost!
-httpd = make_server('', 8000, Dispatcher)
-print "Serving HTTP on port 8000..."
-httpd.serve_forever()
+if __name__ == '__main__':
+    main(sys.argv[1:])
 
@@ -1,5 +1,7 @@
-
 CREATE TABLE posts ( content TEXT,
                      time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                     id SERIAL );
+                     id SERIAL PRIMARY KEY );
 
+-- Pages of posts are read newest first from this index, see
+-- forumdb.GetPosts.
+CREATE INDEX posts_time_idx ON posts (time, id);
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+#
+# Benchmark of the forum's front page reads
+#
+# Fills a memory store of forumdb with every history size and times reading
+# the newest page and a page deep in the history. Both should take the same
+# time for any history size:
+#
+#   python forum_bench.py --sizes 1000,100000,1000000 --output bench.json
+
+import argparse
+import json
+import sys
+import time
+import forumdb
+
+
+def summary(samples):
+    """Returns min/median/max microseconds of a list of seconds."""
+    samples = sorted(samples)
+    return {'min_us': samples[0] * 1e6,
+            'median_us': samples[len(samples) // 2] * 1e6,
+            'max_us': samples[-1] * 1e6}
+
+
+def benchSize(size, views, limit):
+    """
+    Add size posts to a new memory store, then time views of the newest
+    page and of the page before the middle post.
+    """
+    store = forumdb.MemoryStore()
+    started = time.time()
+    for i in range(size):
+        store.AddPost("Post %d" % i)
+    add = time.time() - started
+    pages = {'newest': None, 'middle': size // 2}
+    result = {'posts': size, 'add_posts_per_s': size / max(add, 1e-9)}
+    for name, before in sorted(pages.items()):
+        samples = []
+        for i in range(views):
+            started = time.time()
+            store.GetPosts(limit, before)
+            samples.append(time.time() - started)
+        result[name] = summary(samples)
+    print "%8d posts: add %9.0f/s newest page %8.1fus middle page %8.1fus" % (
+        size, result['add_posts_per_s'], result['newest']['median_us'],
+        result['middle']['median_us'])
+    return result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the forum page reads.')
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000',
+                        help='comma separated history sizes')
+    parser.add_argument('--views', type=int, default=1000,
+                        help='page reads per history size')
+    parser.add_argument('--limit', type=int, default=forumdb.PAGE_SIZE,
+                        help='posts per page')
+    parser.add_argument('--output', default='forum_bench.json')
+    args = parser.parse_args(argv)
+    report = [benchSize(int(size), args.views, args.limit)
+              for size in args.sizes.split(',')]
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+    print "Results written to %s" % args.output
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+#
+# Test cases for forum.py and forumdb.py
+#
+# They run on the memory store, so no database is needed.
+
+import email.utils
+import math
+import os
+import threading
+import time
+import urllib2
+from wsgiref import util
+from wsgiref.simple_server import make_server, WSGIRequestHandler
+os.environ['FORUM_BACKEND'] = 'memory'
+
+import forum
+import forumdb
+
+def Reset(count=0):
+    """
+    Start over with an empty memory store holding count posts.
+    """
+    forumdb.DB = forumdb.MemoryStore()
+    forumdb.CHANGED = None
+    forumdb.CHANGED_TTL = 1.0
+    forum.PAGES.clear()
+    forum.FRAGMENTS.clear()
+    for i in range(count):
+        forumdb.AddPost('post %d' % (i + 1))
+
+def Request(path='/', query='', **headers):
+    """
+    GET path?query from forum.Dispatcher with the given HTTP_* headers.
+    Returns the status, the headers as a dictionary and the body.
+    """
+    env = {'PATH_INFO': path, 'QUERY_STRING': query, 'REQUEST_METHOD': 'GET'}
+    env.update(('HTTP_' + name, value) for name, value in headers.items())
+    util.setup_testing_defaults(env)
+    response = []
+    body = ''.join(forum.Dispatcher(env, lambda *args: response.extend(args)))
+    return response[0], dict(response[1]), body
+
+def testPages():
+    """
+    Test that pages walked with before= cover every post once, newest
+    first, and that the PAGE_SIZE+1 probe tells whether older posts exist.
+    """
+    size = forumdb.PAGE_SIZE
+    Reset(2 * size + 5)
+    ids, before = [], None
+    while True:
+        page = forumdb.GetPosts(before=before)
+        if not page:
+            break
+        if len(page) > size:
+            raise ValueError("A page should hold at most PAGE_SIZE posts.")
+        ids.extend(post['id'] for post in page)
+        before = page[-1]['id']
+    if ids != range(2 * size + 5, 0, -1):
+        raise ValueError("Pages should hold every post once, newest first.")
+    print "1. Pages walked with before= hold every post once, newest first."
+    if [len(forumdb.GetPosts(before=b)) for b in (None, size + 6, 6)] != \
+            [size, size, 5]:
+        raise ValueError("Only the last page should be short.")
+    if forumdb.GetPosts(before=1) or forumdb.GetPosts(before=0):
+        raise ValueError("There should be no page before the first post.")
+    print "2. Only the last page is short and nothing comes before it."
+    if len(forumdb.GetPosts(size + 1, size + 6)) != size + 1 or \
+            len(forumdb.GetPosts(size + 1, 6)) != 5:
+        raise ValueError("The probe should find older posts, or not.")
+    Reset(2 * size)
+    if len(forumdb.GetPosts(size + 1)) != size + 1 or \
+            len(forumdb.GetPosts(size + 1, size + 1)) != size:
+        raise ValueError("A full last page should have no older posts.")
+    print "3. The PAGE_SIZE+1 probe finds older posts only if there are any."
+
+def testIterPages():
+    """
+    Test that IterPosts streams the same pages as GetPosts for any batch.
+    """
+    size = forumdb.PAGE_SIZE
+    Reset(2 * size + 5)
+    for before in (None, 2 * size + 5, size + 6, size + 1, 6, 2, 1):
+        page = forumdb.GetPosts(size + 1, before)
+        for batch in (1, 7, size, forumdb.BATCH_SIZE):
+            if list(forumdb.IterPosts(size + 1, before, batch)) != page:
+                raise ValueError(
+                    "IterPosts should yield the page of GetPosts, "
+                    "before=%s batch=%d." % (before, batch))
+    print "4. IterPosts streams the pages of GetPosts in any batch size."
+
+def testValidators():
+    """
+    Test that a page the client has is answered with 304 Not Modified by
+    its ETag or, once its second is over, by its Last-Modified time.
+    """
+    Reset(3)
+    status, headers, body = Request()
+    etag = headers['ETag']
+    if status != '200 OK' or 'post 3' not in body:
+        raise ValueError("The first GET should send the page.")
+    for match in (etag, '"other", ' + etag, '*'):
+        status, headers, body = Request(IF_NONE_MATCH=match)
+        if status != '304 Not Modified' or body or headers['ETag'] != etag:
+            raise ValueError("A matching If-None-Match should get a 304.")
+    if Request(IF_NONE_MATCH='"other"')[0] != '200 OK':
+        raise ValueError("Another ETag should get the page.")
+    print "5. A matching If-None-Match is answered with 304 Not Modified."
+    # a post earlier in the current second
+    forumdb.DB.posts[-1].time = time.time()
+    forumdb.CHANGED = None
+    now = email.utils.formatdate(math.ceil(time.time()), usegmt=True)
+    status, headers, body = Request(IF_MODIFIED_SINCE=now)
+    if status != '200 OK' or 'Last-Modified' in headers:
+        raise ValueError("A post of this second should not be validated "
+                         "by time.")
+    # and one of a second that is over
+    changed = int(time.time()) - 10
+    forumdb.DB.posts[-1].time = changed - 0.5
+    forumdb.CHANGED = None
+    modified = email.utils.formatdate(changed, usegmt=True)
+    status, headers, body = Request()
+    if headers.get('Last-Modified') != modified:
+        raise ValueError("Last-Modified should round the post time up.")
+    if Request(IF_MODIFIED_SINCE=modified)[0] != '304 Not Modified':
+        raise ValueError("If-Modified-Since of the post should get a 304.")
+    earlier = email.utils.formatdate(changed - 1, usegmt=True)
+    if Request(IF_MODIFIED_SINCE=earlier)[0] != '200 OK' or \
+            Request(IF_MODIFIED_SINCE=modified,
+                    IF_NONE_MATCH='"other"')[0] != '200 OK':
+        raise ValueError("An older copy or ETag should get the page.")
+    print "6. If-Modified-Since is only trusted once the post's second is over."
+
+def testValidatorsChange():
+    """
+    Test that the ETag changes at once with a post of this process, and
+    within CHANGED_TTL with one added behind its back.
+    """
+    Reset(3)
+    forumdb.CHANGED_TTL = 3600
+    etag = Request()[1]['ETag']
+    forumdb.AddPost('post 4')
+    status, headers, body = Request(IF_NONE_MATCH=etag)
+    if status != '200 OK' or headers['ETag'] == etag or 'post 4' not in body:
+        raise ValueError("AddPost should change the ETag at once.")
+    print "7. The ETag changes as soon as a post is added."
+    etag = headers['ETag']
+    forumdb.DB.posts.append(forumdb.Post(5, time.time(), 'post 5'))
+    if Request(IF_NONE_MATCH=etag)[0] != '304 Not Modified':
+        raise ValueError("The ETag should be cached for CHANGED_TTL.")
+    forumdb.CHANGED_TTL = 0
+    status, headers, body = Request(IF_NONE_MATCH=etag)
+    if status != '200 OK' or headers['ETag'] == etag or 'post 5' not in body:
+        raise ValueError("Posts of other processes should change the ETag "
+                         "after CHANGED_TTL.")
+    print "8. Posts added elsewhere change the ETag after CHANGED_TTL."
+
+def testRender():
+    """
+    Test that a streamed page is the one kept in PAGES, with a link to the
+    older posts only if there are any.
+    """
+    size = forumdb.PAGE_SIZE
+    Reset(size + 5)
+    status, headers, body = Request()
+    if forum.PAGES.get(None) != (headers['ETag'], body):
+        raise ValueError("The streamed page should be the one kept.")
+    if Request() != (status, headers, body):
+        raise ValueError("The kept page should be sent as it was streamed.")
+    print "9. Streamed pages are kept byte for byte."
+    if body.count('Older posts') != 1 or '/?before=6"' not in body:
+        raise ValueError("The first page should link to the older posts.")
+    body = Request(query='before=6')[2]
+    if 'Older posts' in body or 'post 5' not in body:
+        raise ValueError("The last page should have no older posts link.")
+    for count, older in ((size, False), (size + 1, True)):
+        Reset(count)
+        if ('Older posts' in Request()[2]) != older:
+            raise ValueError("The older posts link should be shown only if "
+                             "there are older posts, %d posts." % count)
+    print "10. The older posts link is only shown if there are older posts."
+
+def testRenderClosed():
+    """
+    Test that the posts are closed when the client goes away mid-page.
+    """
+    Reset(forumdb.PAGE_SIZE + 5)
+    opened, closed = [], []
+    iterposts, batch = forumdb.IterPosts, forumdb.BATCH_SIZE
+    def Posts(*args):
+        try:
+            for post in iterposts(*args):
+                yield post
+        finally:
+            closed.append(True)
+    def IterPosts(*args):
+        # kept here, so only close() and not garbage collection ends them
+        opened.append(Posts(*args))
+        return opened[-1]
+    forumdb.IterPosts, forumdb.BATCH_SIZE = IterPosts, 10
+    try:
+        page = forum.Render(None, '"etag"')
+        next(page), next(page)
+        if closed:
+            raise ValueError("The posts should be open mid-page.")
+        page.close()
+    finally:
+        forumdb.IterPosts, forumdb.BATCH_SIZE = iterposts, batch
+    if closed != [True] or None in forum.PAGES:
+        raise ValueError("A page left mid-way should close the posts and "
+                         "not be kept.")
+    print "11. The posts are closed when the client goes away mid-page."
+
+class QuietHandler(WSGIRequestHandler):
+    """
+    Request handler that does not log every request to stderr.
+    """
+    def log_message(self, *args):
+        pass
+
+def testPooledServer():
+    """
+    Test that PooledWSGIServer serves requests on its workers at the same
+    time: every worker waits in a request until all of them are in one.
+    """
+    Reset(3)
+    workers = 4
+    httpd = make_server('127.0.0.1', 0, forum.Dispatcher,
+                        server_class=forum.PooledWSGIServer,
+                        handler_class=QuietHandler)
+    httpd.workers = workers
+    server = threading.Thread(target=httpd.serve_forever)
+    server.daemon = True
+    server.start()
+    waiting, everyone = [], threading.Event()
+    def Wait(env, resp):
+        waiting.append(True)
+        if len(waiting) == workers:
+            everyone.set()
+        everyone.wait(10)
+        resp('200 OK', [('Content-type', 'text/plain')])
+        return [str(everyone.is_set())]
+    url = 'http://127.0.0.1:%d/' % httpd.server_port
+    bodies = []
+    def Get(path, data=None):
+        bodies.append(urllib2.urlopen(url + path, data, timeout=30).read())
+    forum.DISPATCH['wait'] = Wait
+    try:
+        clients = [threading.Thread(target=Get, args=('wait', ))
+                   for i in range(workers)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        Get('post', 'content=pooled')
+    finally:
+        del forum.DISPATCH['wait']
+        httpd.shutdown()
+        httpd.server_close()
+    if bodies[:workers] != ['True'] * workers:
+        raise ValueError("The workers should serve requests at once.")
+    if len(bodies) != workers + 1 or 'pooled' not in bodies[-1]:
+        raise ValueError("A post through the pool should be shown.")
+    print "12. PooledWSGIServer serves requests on its workers at once."
+
+
+if __name__ == '__main__':
+    testPages()
+    testIterPages()
+    testValidators()
+    testValidatorsChange()
+    testRender()
+    testRenderClosed()
+    testPooledServer()
+    print "Success!  All tests pass!"
@@ -1,24 +1,277 @@
 #
 # Database access functions for the web forum.
-# 
+#
+# Posts are stored in the posts table of forum.sql. Set FORUM_BACKEND=memory
+# to keep them in this process instead, e.g. to try the forum without a
+# database; memory posts are lost on restart.
+#
 
+import os
+import threading
 import time
+from contextlib import contextmanager
+
+try:
+    import psycopg2
+    import psycopg2.pool
+except ImportError:
+    psycopg2 = None
+
+## Database connection, a pool shared by every request
+DSN = 'dbname=forum'
+POOL_SIZE = 10
+POOL = None
+POOL_LOCK = threading.Lock()
+
+## Posts shown on one page.
+PAGE_SIZE = 50
+
+## Start of this process, which tells memory posts of a restart apart.
+STARTED = time.time()
+
+## The last (version, time) of the posts and when it was read. It is read
+## again after CHANGED_TTL seconds, to see posts of other processes.
+CHANGED = None
+CHANGED_TTL = 1.0
+CHANGED_LOCK = threading.Lock()
+
+## Posts read per round trip by IterPosts.
+BATCH_SIZE = 100
+
+## Borrow a connection from the pool.
+@contextmanager
+def Connection(name=None):
+    '''Borrow a connection from the pool, opening the pool on first use.
+
+    The transaction is committed when the block ends and rolled back if it
+    raises; either way the connection goes back to the pool.
+
+    Args:
+      name: The name of a server-side cursor, None for a plain cursor.
+    '''
+    global POOL
+    with POOL_LOCK:
+        if POOL is None:
+            POOL = psycopg2.pool.ThreadedConnectionPool(1, POOL_SIZE, DSN)
+    connection = POOL.getconn()
+    try:
+        yield connection.cursor(name)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        POOL.putconn(connection)
+
+## Turn rows into posts.
+def Row(row):
+    '''Turn an (id, time, content) row into the dictionary of the pages.'''
+    return {'id': row[0], 'time': str(row[1]), 'content': str(row[2])}
+
+def Rows(rows):
+    '''Turn a list of rows into posts.'''
+    return [Row(row) for row in rows]
+
+## Posts in the posts table.
+class PostgresStore(object):
+    '''Posts in the posts table, read in pages from the (time, id) index.'''
+
+    def GetPosts(self, limit, before=None):
+        with Connection() as cursor:
+            if before is None:
+                cursor.execute('SELECT id, time, content FROM posts '
+                               'ORDER BY time DESC, id DESC LIMIT %s',
+                               (limit, ))
+            else:
+                cursor.execute('SELECT id, time, content FROM posts '
+                               'WHERE (time, id) < '
+                               '(SELECT time, id FROM posts WHERE id = %s) '
+                               'ORDER BY time DESC, id DESC LIMIT %s',
+                               (before, limit))
+            return Rows(cursor.fetchall())
+
+    def IterPosts(self, limit, before=None, batch=BATCH_SIZE):
+        with Connection('posts') as cursor:
+            cursor.itersize = batch
+            if before is None:
+                cursor.execute('SELECT id, time, content FROM posts '
+                               'ORDER BY time DESC, id DESC LIMIT %s',
+                               (limit, ))
+            else:
+                cursor.execute('SELECT id, time, content FROM posts '
+                               'WHERE (time, id) < '
+                               '(SELECT time, id FROM posts WHERE id = %s) '
+                               'ORDER BY time DESC, id DESC LIMIT %s',
+                               (before, limit))
+            for row in cursor:
+                yield Row(row)
+
+    def GetAllPosts(self):
+        with Connection() as cursor:
+            cursor.execute('SELECT id, time, content FROM posts '
+                           'ORDER BY time DESC, id DESC')
+            return Rows(cursor.fetchall())
+
+    def AddPost(self, content):
+        with Connection() as cursor:
+            cursor.execute('INSERT INTO posts (content) VALUES (%s) '
+                           'RETURNING id, '
+                           'extract(epoch FROM time::timestamptz)',
+                           (content, ))
+            return self.Version(*cursor.fetchone())
+
+    def Changed(self):
+        # both maxima are read from the end of an index
+        with Connection() as cursor:
+            cursor.execute('SELECT max(id), '
+                           'extract(epoch FROM max(time)::timestamptz) '
+                           'FROM posts')
+            return self.Version(*cursor.fetchone())
+
+    def Version(self, newest, changed):
+        if newest is None:
+            return '0', 0.0
+        changed = float(changed)
+        return '%x-%x' % (newest, int(changed * 1000000)), changed
+
+## A post kept in memory.
+class Post(object):
+    '''One post: its id, the seconds since the epoch it was posted at and
+    its content.'''
+    __slots__ = ('id', 'time', 'content')
+
+    def __init__(self, id, time, content):
+        self.id = id
+        self.time = time
+        self.content = content
+
+    def Row(self):
+        '''The dictionary of the pages, timed like the database does.'''
+        micros = int(self.time * 1000000) % 1000000
+        return {'id': self.id, 'content': self.content,
+                'time': '%s.%06d' % (time.strftime(
+                    '%Y-%m-%d %H:%M:%S', time.localtime(self.time)), micros)}
 
-## Database connection
-DB = []
+## Posts kept in memory.
+class MemoryStore(object):
+    '''Posts in a list in the order they were added, which is also their
+    time order. Post ids count up from 1, so a post's id is its position
+    plus one and a page is a slice of the list: nothing is ever sorted,
+    and a page costs the same however many posts there are.'''
+
+    def __init__(self):
+        self.posts = []
+        self.lock = threading.Lock()
+
+    def GetPosts(self, limit, before=None):
+        end = len(self.posts)
+        if before is not None:
+            end = min(max(before - 1, 0), end)
+        page = self.posts[max(end - limit, 0):end]
+        return [post.Row() for post in reversed(page)]
+
+    def IterPosts(self, limit, before=None, batch=BATCH_SIZE):
+        end = len(self.posts)
+        if before is not None:
+            end = min(max(before - 1, 0), end)
+        start = max(end - limit, 0)
+        while end > start:
+            page = self.posts[max(end - batch, start):end]
+            for post in reversed(page):
+                yield post.Row()
+            end -= len(page)
+
+    def GetAllPosts(self):
+        return self.GetPosts(len(self.posts))
+
+    def AddPost(self, content):
+        with self.lock:
+            now = time.time()
+            if self.posts and self.posts[-1].time > now:
+                # the clock went back, keep the list in time order
+                now = self.posts[-1].time
+            self.posts.append(Post(len(self.posts) + 1, now, content))
+            return self.Changed()
+
+    def Changed(self):
+        count = len(self.posts)
+        changed = self.posts[count - 1].time if count else STARTED
+        return '%x-%x' % (int(STARTED * 1000), count), changed
+
+## The store of the posts, picked by FORUM_BACKEND.
+if os.environ.get('FORUM_BACKEND') == 'memory':
+    DB = MemoryStore()
+else:
+    DB = PostgresStore()
+
+## Tell pages apart.
+def Changed():
+    '''Get a version of the posts and the time of the newest one. Pages stay
+    the same until the version changes, so they can be cached until then.
+
+    The Postgres store reads both from the posts table, so posts added by
+    another forum process or straight into the table change them too, at
+    most CHANGED_TTL seconds later: in between, the last ones read or
+    written by this process are returned without a round trip. The memory
+    store counts its posts, with the start of the process in the version so
+    a restart changes it.
+
+    Returns:
+      A (version, time) tuple, the version a string and the time in seconds
+      since the epoch.
+    '''
+    global CHANGED
+    now = time.time()
+    last = CHANGED
+    if last is not None and now - last[2] < CHANGED_TTL:
+        return last[:2]
+    version, changed = DB.Changed()
+    with CHANGED_LOCK:
+        if CHANGED is None or CHANGED[2] < now:
+            CHANGED = (version, changed, now)
+    return version, changed
+
+## Get a page of posts from database.
+def GetPosts(limit=PAGE_SIZE, before=None):
+    '''Get a page of posts, sorted with the newest first.
+
+    Pages are read with keyset pagination on the (time, id) index, or sliced
+    from the memory store, so a page costs the same however many posts there
+    are, or how far back it is.
+
+    Args:
+      limit: The number of posts on the page.
+      before: The id of the last post of the previous page, None for the
+        newest posts.
+
+    Returns:
+      A list of dictionaries, where each dictionary has a 'content' key
+      pointing to the post content, a 'time' key pointing to the time
+      it was posted and an 'id' key to ask for the page after it.
+    '''
+    return DB.GetPosts(limit, before)
+
+## Stream a page of posts from database.
+def IterPosts(limit=PAGE_SIZE, before=None, batch=BATCH_SIZE):
+    '''Yield the posts of GetPosts one by one, newest first, reading batch
+    of them at a time, so a page of any size takes a fixed amount of memory.
+    The Postgres store reads through a server-side cursor and holds a
+    connection until the iterator is exhausted or closed.
+
+    Args:
+      limit, before: As for GetPosts.
+      batch: The number of posts read at a time.
+    '''
+    return DB.IterPosts(limit, before, batch)
 
 ## Get posts from database.
 def GetAllPosts():
     '''Get all the posts from the database, sorted with the newest first.
 
     Returns:
-      A list of dictionaries, where each dictionary has a 'content' key
-      pointing to the post content, and 'time' key pointing to the time
-      it was posted.
+      A list of dictionaries like the ones of GetPosts.
     '''
-    posts = [{'content': str(row[1]), 'time': str(row[0])} for row in DB]
-    posts.sort(key=lambda row: row['time'], reverse=True)
-    return posts
+    return DB.GetAllPosts()
 
 ## Add a post to the database.
 def AddPost(content):
@@ -27,5 +280,7 @@ def AddPost(content):
     Args:
       content: The text content of the new post.
     '''
-    t = time.strftime('%c', time.localtime())
-    DB.append((t, content))
+    global CHANGED
+    version, changed = DB.AddPost(content)
+    with CHANGED_LOCK:
+        CHANGED = (version, changed, time.time())
@@ -0,0 +1,87 @@
+-- Migration 001: incremental standings.
+--
+-- Replaces the correlated subqueries of the standings view with the
+-- scores counter table maintained by triggers on players and matches,
+-- and indexes matches by winner and loser.
+--
+-- psql tournament --file=migrations/001_standings_counters.sql
+BEGIN;
+
+DROP VIEW IF EXISTS selection;
+DROP VIEW IF EXISTS standings;
+
+CREATE TABLE scores(
+   player INTEGER PRIMARY KEY REFERENCES players(ID) ON DELETE CASCADE,
+   wins INTEGER NOT NULL DEFAULT 0,
+   matches INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE INDEX matches_winner_idx ON matches (winner);
+CREATE INDEX matches_loser_idx ON matches (loser);
+CREATE INDEX scores_wins_idx ON scores (wins DESC, player);
+
+CREATE FUNCTION scores_add_player() RETURNS trigger AS $$
+BEGIN
+   INSERT INTO scores (player) VALUES (NEW.id);
+   RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION scores_add_match() RETURNS trigger AS $$
+BEGIN
+   UPDATE scores SET wins = wins + 1, matches = matches + 1
+      WHERE player = NEW.winner;
+   UPDATE scores SET matches = matches + 1 WHERE player = NEW.loser;
+   RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION scores_remove_match() RETURNS trigger AS $$
+BEGIN
+   UPDATE scores SET wins = wins - 1, matches = matches - 1
+      WHERE player = OLD.winner;
+   UPDATE scores SET matches = matches - 1 WHERE player = OLD.loser;
+   RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION scores_reset() RETURNS trigger AS $$
+BEGIN
+   UPDATE scores SET wins = 0, matches = 0;
+   RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Backfill the counters from the existing matches in one pass.
+LOCK TABLE players, matches IN SHARE MODE;
+INSERT INTO scores (player, wins, matches)
+   SELECT players.id, won.count, won.count + lost.count
+   FROM players,
+        LATERAL (SELECT COUNT(*) FROM matches
+                 WHERE matches.winner = players.id) AS won,
+        LATERAL (SELECT COUNT(*) FROM matches
+                 WHERE matches.loser = players.id) AS lost;
+
+CREATE TRIGGER players_scores AFTER INSERT ON players
+   FOR EACH ROW EXECUTE PROCEDURE scores_add_player();
+CREATE TRIGGER matches_scores_insert AFTER INSERT ON matches
+   FOR EACH ROW EXECUTE PROCEDURE scores_add_match();
+CREATE TRIGGER matches_scores_delete AFTER DELETE ON matches
+   FOR EACH ROW EXECUTE PROCEDURE scores_remove_match();
+CREATE TRIGGER matches_scores_truncate AFTER TRUNCATE ON matches
+   FOR EACH STATEMENT EXECUTE PROCEDURE scores_reset();
+
+CREATE VIEW standings AS
+   SELECT players.id,
+          players.name,
+          scores.wins,
+          scores.matches
+   FROM players JOIN scores ON scores.player = players.id
+   ORDER BY scores.wins DESC, players.id;
+
+CREATE VIEW selection AS
+   SELECT standings.id,
+          standings.name
+   FROM standings;
+
+COMMIT;
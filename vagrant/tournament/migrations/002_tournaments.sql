@@ -0,0 +1,63 @@
+-- Migration 002: multiple tournaments per database.
+--
+-- Adds the tournaments table and scopes players, matches and scores by
+-- tournament id. Existing data is moved into tournament 1, 'default'.
+--
+-- psql tournament --file=migrations/002_tournaments.sql
+BEGIN;
+
+DROP VIEW IF EXISTS selection;
+DROP VIEW IF EXISTS standings;
+DROP TRIGGER IF EXISTS matches_scores_delete ON matches;
+DROP FUNCTION IF EXISTS scores_remove_match();
+
+CREATE TABLE tournaments(
+   ID SERIAL PRIMARY KEY,
+   NAME    VARCHAR(80)    NOT NULL
+);
+INSERT INTO tournaments (NAME) VALUES ('default');
+
+ALTER TABLE players
+   ADD COLUMN tournament INTEGER NOT NULL DEFAULT 1
+      REFERENCES tournaments(ID) ON DELETE CASCADE,
+   ADD UNIQUE (tournament, ID);
+
+ALTER TABLE matches
+   DROP CONSTRAINT IF EXISTS matches_winner_fkey,
+   DROP CONSTRAINT IF EXISTS matches_loser_fkey,
+   ADD COLUMN tournament INTEGER NOT NULL DEFAULT 1,
+   ALTER COLUMN winner SET NOT NULL,
+   ADD FOREIGN KEY (tournament, winner)
+      REFERENCES players(tournament, ID) ON DELETE CASCADE,
+   ADD FOREIGN KEY (tournament, loser)
+      REFERENCES players(tournament, ID) ON DELETE CASCADE;
+
+ALTER TABLE scores ADD COLUMN tournament INTEGER NOT NULL DEFAULT 1;
+ALTER TABLE scores ALTER COLUMN tournament DROP DEFAULT;
+
+DROP INDEX scores_wins_idx;
+CREATE INDEX scores_wins_idx ON scores (tournament, wins DESC, player);
+CREATE INDEX matches_tournament_idx ON matches (tournament);
+
+CREATE OR REPLACE FUNCTION scores_add_player() RETURNS trigger AS $$
+BEGIN
+   INSERT INTO scores (player, tournament) VALUES (NEW.id, NEW.tournament);
+   RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE VIEW standings AS
+   SELECT scores.tournament,
+          players.id,
+          players.name,
+          scores.wins,
+          scores.matches
+   FROM scores JOIN players ON players.id = scores.player;
+
+CREATE VIEW selection AS
+   SELECT standings.tournament,
+          standings.id,
+          standings.name
+   FROM standings;
+
+COMMIT;
@@ -0,0 +1,40 @@
+-- Migration 003: tiebreaks.
+--
+-- Adds the tiebreaks view behind playerStandings(tiebreaks=True).
+--
+-- psql tournament --file=migrations/003_tiebreaks.sql
+BEGIN;
+
+-- Tiebreaks of every player, computed in one pass over the matches of a
+-- tournament: each match is seen once from either side, byes have no
+-- opponent and count for none of them.
+--   buchholz - sum of the opponents' wins
+--   sonneborn_berger - sum of the wins of the opponents beaten
+--   omw - average match-win ratio of the opponents, at least 1/3 each
+CREATE VIEW tiebreaks AS
+   SELECT scores.tournament,
+          players.id,
+          players.name,
+          scores.wins,
+          scores.matches,
+          COALESCE(sum(opponent.wins), 0)::integer AS buchholz,
+          COALESCE(sum(CASE WHEN games.won THEN opponent.wins END), 0)::integer
+             AS sonneborn_berger,
+          COALESCE(avg(GREATEST(
+             opponent.wins::float / opponent.matches, 1::float / 3)), 0) AS omw
+   FROM scores
+   JOIN players ON players.id = scores.player
+   LEFT JOIN (SELECT tournament, winner AS player, loser AS opponent,
+                     TRUE AS won
+              FROM matches WHERE loser IS NOT NULL
+              UNION ALL
+              SELECT tournament, loser, winner, FALSE
+              FROM matches WHERE loser IS NOT NULL) AS games
+      ON games.tournament = scores.tournament
+     AND games.player = scores.player
+   LEFT JOIN scores AS opponent
+      ON opponent.tournament = games.tournament
+     AND opponent.player = games.opponent
+   GROUP BY scores.player, players.id;
+
+COMMIT;
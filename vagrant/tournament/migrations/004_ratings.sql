@@ -0,0 +1,25 @@
+-- Migration 004: ratings.
+--
+-- Adds the ratings table written by the Elo and Glicko-2 engines. It
+-- starts empty; Game.recomputeRatings() rates the matches played so far.
+--
+-- psql tournament --file=migrations/004_ratings.sql
+BEGIN;
+
+-- Ratings of the players that played rated matches, written in bulk by
+-- tournament.db when a rating engine is configured. Players without a
+-- row still have the engine's initial rating.
+CREATE TABLE ratings(
+   player INTEGER PRIMARY KEY,
+   tournament INTEGER NOT NULL,
+   rating DOUBLE PRECISION NOT NULL,
+   deviation DOUBLE PRECISION NOT NULL,
+   volatility DOUBLE PRECISION NOT NULL,
+   games INTEGER NOT NULL,
+   FOREIGN KEY (tournament, player)
+      REFERENCES players(tournament, ID) ON DELETE CASCADE
+);
+
+CREATE INDEX ratings_rating_idx ON ratings (tournament, rating DESC, player);
+
+COMMIT;
@@ -0,0 +1,52 @@
+-- Migration 005: rounds and opponent history.
+--
+-- Adds the round and created columns to matches, numbers the existing
+-- matches by the order they were stored in, and replaces the single
+-- column winner/loser indexes with composite ones. Existing matches get
+-- the time of the migration as created.
+--
+-- psql tournament --file=migrations/005_rounds.sql
+BEGIN;
+
+ALTER TABLE matches
+   ADD COLUMN round INTEGER,
+   ADD COLUMN created TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now();
+
+-- A match is the n-th one of a player when n - 1 of the player's matches
+-- have a lower id; its round is the larger n of its two players.
+UPDATE matches SET round = numbered.round
+   FROM (SELECT id, max(number) AS round
+         FROM (SELECT id, row_number() OVER (
+                  PARTITION BY player ORDER BY id) AS number
+               FROM (SELECT id, winner AS player FROM matches
+                     UNION ALL
+                     SELECT id, loser FROM matches
+                     WHERE loser IS NOT NULL) AS sides) AS played
+         GROUP BY id) AS numbered
+   WHERE numbered.id = matches.id;
+
+ALTER TABLE matches ALTER COLUMN round SET NOT NULL;
+
+DROP INDEX IF EXISTS matches_winner_idx;
+DROP INDEX IF EXISTS matches_loser_idx;
+-- Opponent history: every match of a player, and whether two players
+-- met, is a range of one of these two indexes.
+CREATE INDEX matches_winner_loser_idx ON matches (winner, loser);
+CREATE INDEX matches_loser_winner_idx ON matches (loser, winner);
+CREATE INDEX matches_round_idx ON matches (tournament, round);
+
+-- The round of a match is one more than the matches either player
+-- already played, byes included.
+CREATE FUNCTION matches_set_round() RETURNS trigger AS $$
+BEGIN
+   SELECT max(matches) + 1 INTO NEW.round FROM scores
+      WHERE player IN (NEW.winner, NEW.loser);
+   RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER matches_round BEFORE INSERT ON matches
+   FOR EACH ROW WHEN (NEW.round IS NULL)
+   EXECUTE PROCEDURE matches_set_round();
+
+COMMIT;
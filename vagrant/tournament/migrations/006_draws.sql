@@ -0,0 +1,100 @@
+-- Migration 006: draws, game scores and match points.
+--
+-- Adds the draw and game columns to matches and the draw, point and game
+-- counters to scores. Existing matches have no draws, so every win is
+-- worth 3 points and the game counters start at 0. The standings index
+-- moves from wins to points, and the tiebreaks are computed from points;
+-- sonneborn_berger becomes a float for the half points of draws.
+--
+-- psql tournament --file=migrations/006_draws.sql
+BEGIN;
+
+ALTER TABLE matches
+   ADD COLUMN draw BOOLEAN NOT NULL DEFAULT FALSE,
+   ADD COLUMN winner_games SMALLINT,
+   ADD COLUMN loser_games SMALLINT,
+   ADD CHECK (NOT draw OR loser IS NOT NULL);
+
+ALTER TABLE scores
+   ADD COLUMN draws INTEGER NOT NULL DEFAULT 0,
+   ADD COLUMN points INTEGER NOT NULL DEFAULT 0,
+   ADD COLUMN games_won INTEGER NOT NULL DEFAULT 0,
+   ADD COLUMN games_played INTEGER NOT NULL DEFAULT 0;
+
+UPDATE scores SET points = 3 * wins;
+
+DROP INDEX IF EXISTS scores_wins_idx;
+CREATE INDEX scores_points_idx ON scores (tournament, points DESC, player);
+
+CREATE OR REPLACE FUNCTION scores_add_match() RETURNS trigger AS $$
+BEGIN
+   UPDATE scores SET wins = wins + (NOT NEW.draw)::integer,
+                     matches = matches + 1,
+                     draws = draws + NEW.draw::integer,
+                     points = points + CASE WHEN NEW.draw THEN 1 ELSE 3 END,
+                     games_won = games_won + COALESCE(NEW.winner_games, 0),
+                     games_played = games_played +
+                        COALESCE(NEW.winner_games + NEW.loser_games, 0)
+      WHERE player = NEW.winner;
+   UPDATE scores SET matches = matches + 1,
+                     draws = draws + NEW.draw::integer,
+                     points = points + NEW.draw::integer,
+                     games_won = games_won + COALESCE(NEW.loser_games, 0),
+                     games_played = games_played +
+                        COALESCE(NEW.winner_games + NEW.loser_games, 0)
+      WHERE player = NEW.loser;
+   RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION scores_reset() RETURNS trigger AS $$
+BEGIN
+   UPDATE scores SET wins = 0, matches = 0, draws = 0, points = 0,
+                     games_won = 0, games_played = 0;
+   RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE VIEW standings AS
+   SELECT scores.tournament,
+          players.id,
+          players.name,
+          scores.wins,
+          scores.matches,
+          scores.draws,
+          scores.points,
+          scores.games_won,
+          scores.games_played
+   FROM scores JOIN players ON players.id = scores.player;
+
+DROP VIEW tiebreaks;
+
+CREATE VIEW tiebreaks AS
+   SELECT scores.tournament,
+          players.id,
+          players.name,
+          scores.wins,
+          scores.matches,
+          COALESCE(sum(opponent.points), 0)::integer AS buchholz,
+          COALESCE(sum(games.score * opponent.points), 0)::float
+             AS sonneborn_berger,
+          COALESCE(avg(GREATEST(opponent.points::float /
+             (3 * opponent.matches), 1::float / 3)), 0) AS omw,
+          scores.points
+   FROM scores
+   JOIN players ON players.id = scores.player
+   LEFT JOIN (SELECT tournament, winner AS player, loser AS opponent,
+                     CASE WHEN draw THEN 0.5 ELSE 1 END AS score
+              FROM matches WHERE loser IS NOT NULL
+              UNION ALL
+              SELECT tournament, loser, winner,
+                     CASE WHEN draw THEN 0.5 ELSE 0 END
+              FROM matches WHERE loser IS NOT NULL) AS games
+      ON games.tournament = scores.tournament
+     AND games.player = scores.player
+   LEFT JOIN scores AS opponent
+      ON opponent.tournament = games.tournament
+     AND opponent.player = games.opponent
+   GROUP BY scores.player, players.id;
+
+COMMIT;
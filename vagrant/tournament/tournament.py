@@ -2,339 +2,168 @@
 #
 # tournament.py -- implementation of a Swiss-system tournament
 #
+# The public API: Tournaments, Players and Game over a store backend.
+# Everything else lives in the tournament_*.py modules and is imported
+# here, so tournament.<name> keeps working for all of it.
+#
 
-import psycopg2
-import random
-import logging
-import time
-
-
-class logger(object):
-
-    def __init__(self):
-        '''
-        References to a log file.
-        Sets log config
-
-        Args: self
-        Raises:
-        Returns: None
-        '''
-        log_file = 'tournament.log'
-        logging.basicConfig(
-            filename=log_file,
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s: %(message)s')
-
-    def info(self, message):
-        '''
-        Logs info message
-
-        Args: self, message
-        Raises:
-        Returns: None
-        '''
-        logging.info(message)
-
-    def exception(self, message):
-        '''
-        Logs exception message
-
-        Args: self, message
-        Raises:
-        Returns: None
-        '''
-        logging.exception(message)
-
-
-class db(object):
-
-    def __init__(self):
+import os
+from tournament_metrics import (logqueue, jsonformatter, logger, metrics,
+                                metrics_app, instrumented, shared,
+                                shared_lock, shared_log, shared_metrics)
+from tournament_swiss import BYE, swiss
+from tournament_ratings import (numpy, elo, glicko2, engines, schedule,
+                                replay)
+from tournament_snapshot import snapshot, read_snapshot
+from tournament_store import abstract, store
+from tournament_db import (psycopg2, PoolTimeout, pool, cache, shared_pool,
+                           shared_cache, copy_rows, db)
+from tournament_memory import (standings_arrays, memory, memory_state,
+                               shared_memory)
+
+
+def backend(tournament=1, rating=None):
+    '''
+    Returns the storage backend named by the TOURNAMENT_BACKEND
+    environment variable: 'postgres' (the default) or 'memory'. The
+    TOURNAMENT_RATING variable picks a rating engine, 'elo' or
+    'glicko2', when none is given.
+
+    Args: tournament - object of type integer
+          rating - elo or glicko2 class instance/None
+    Raises:
+            ValueError - for an unknown backend or engine name
+            ImportError - for a rating engine without numpy
+    Returns:
+            store class instance
+    '''
+    name = os.environ.get('TOURNAMENT_BACKEND', 'postgres')
+    engine = os.environ.get('TOURNAMENT_RATING')
+    if rating is None and engine:
+        if engine not in engines:
+            raise ValueError('Unknown rating engine %s' % engine)
+        rating = engines[engine]()
+    if name == 'postgres':
+        return db(tournament=tournament, rating=rating)
+    if name == 'memory':
+        return memory(tournament=tournament, rating=rating)
+    raise ValueError('Unknown tournament backend %s' % name)
+
+
+class Tournaments(object):
+
+    def __init__(self, dbapi=None):
         '''
-        Create references to statement objects
+        Instantiates objects
 
         Args: self
+              dbapi - store class instance, defaults to backend()
         Raises:
         Returns:
-            self.insert_name - object of type string
-            self.addmatch - object of type string
-            self.counter - object of type string
-            self.remove_players - object of type string
-            self.remove_matches - object of type string
-            self.standings - object of type string
-            self.pairings - object of type string
-            self.log - logger class instance
-            self.tiner - object of type integer
+                class instance object
+                class instance object
         '''
-        self.insert_name = 'INSERT INTO players (name) VALUES (%s);'
-        self.addmatch = 'INSERT INTO matches (winner, loser) VALUES (%s, %s);'
-        self.counter = 'SELECT * from players;'
-        self.remove_players = 'TRUNCATE players CASCADE;'
-        self.remove_matches = 'TRUNCATE matches;'
-        self.standings = 'SELECT * FROM standings;'
-        self.pairings = 'SELECT * FROM selection;'
+        self.dbapi = dbapi or backend()
         self.log = logger()
-        self.timer = 1
-
-    def open_connection(self):
-        '''
-        Connect to the PostgreSQL database.
-        Returns a database connection and a cursor.
 
-        Args: self
-        Raises: psycopg2.OperationalError
-        Returns:
-                object of type list(psycopg2 connection and cursor objects)
-        '''
-        while True:
-            try:
-                connection = psycopg2.connect(
-                    'dbname=tournament')
-                return [connection, connection.cursor()]
-            except psycopg2.OperationalError:
-                self.log.info('Cannot connect. Retrying...')
-                time.sleep(self.timer)
-
-    def deletePlayers(self):
-        '''
-        Truncates players table
-
-        Args: self
-        Raises:
-                pokemon catching exceptions for log purposes
-        Returns:
-                object of type string
-                object of type None
-        '''
-        new = self.open_connection()
-        connection = new[0]
-        cursor = new[1]
-        try:
-            cursor.execute(self.remove_players)
-            connection.commit()
-            cursor.execute(self.counter)
-            if cursor.fetchone() == 0:
-                return 'OK'
-        except Exception as e:
-            self.log.exception(e)
-            return None
+    def registerTournament(self, name):
+        '''Creates a new tournament.
 
-    def countPlayers(self):
-        '''
-        Counter entries in players table
+        Args:
+        name: the tournament's name.
 
-        Args: self
-        Raises:
-                pokemon catching exceptions for log purposes
         Returns:
-                object of type integer
-                object of type None
+        The new tournament's id, to be passed to Players and Game.
         '''
-        new = self.open_connection()
-        connection = new[0]
-        cursor = new[1]
-        try:
-            cursor.execute(self.counter)
-            return cursor.rowcount
-        except Exception as e:
-            self.log.exception(e)
-            return None
+        tournament = self.dbapi.registerTournament(str(name))
+        if tournament is not None:
+            self.log.info('Tournament %s is registered as %s', name,
+                          tournament)
+        return tournament
 
-    def registerPlayer(self, name):
-        '''
-        Insert player details into players table
+    def deleteTournament(self, tournament):
+        '''Removes a tournament with all of its players and matches.
 
-        Args: self
-              name - object of type string
-        Raises:
-                pokemon catching exceptions for log purposes
-        Returns:
-                object of type string
-                object of type None
+        Args:
+        tournament: the tournament's id.
         '''
-        new = self.open_connection()
-        connection = new[0]
-        cursor = new[1]
-        try:
-            cursor.execute(self.insert_name, (name, ))
-            connection.commit()
-            return 'OK'
-        except Exception as e:
-            self.log.exception(e)
-            return None
+        if self.dbapi.deleteTournament(tournament):
+            self.log.info('Tournament %s has been deleted', tournament)
 
-    def deleteMatches(self):
-        '''
-        Removes all matches entires
+    def listTournaments(self):
+        '''Returns a list of (id, name) tuples of all tournaments.'''
+        return self.dbapi.listTournaments()
 
-        Args: self
-        Raises:
-                pokemon catching exceptions for log purposes
-        Returns:
-                object of type string
-                object of type None
-        '''
-        new = self.open_connection()
-        connection = new[0]
-        cursor = new[1]
-        try:
-            cursor.execute(self.remove_matches)
-            connection.commit()
-            return 'OK'
-        except Exception as e:
-            self.log.exception(e)
-            return None
+    def exportTournament(self, tournament, path):
+        '''Saves a tournament with its players and matches to a file.
 
-    def playerStandings(self):
-        '''
-        Returns current standings from players table
+        Args:
+        tournament: the tournament's id.
+        path: the snapshot file to write.
 
-        Args: self
-        Raises:
-                pokemon catching exceptions for log purposes
         Returns:
-                object of type list
-                object of type None
+        'OK', or None if the tournament could not be read.
         '''
-        new = self.open_connection()
-        connection = new[0]
-        cursor = new[1]
-        try:
-            cursor.execute(self.standings)
-            return cursor.fetchall()
-        except Exception as e:
-            self.log.exception(e)
+        data = self.dbapi.exportTournament(tournament)
+        if data is None:
             return None
+        with open(path, 'wb') as stream:
+            data.write(stream)
+        self.log.info('Tournament %s exported to %s', tournament, path)
+        return 'OK'
 
-    def get_pairings(self):
-        '''
-        Returns formatted list with player pairings
+    def importTournament(self, path, name=None):
+        '''Loads a snapshot file as a new tournament.
 
-        Args: self
-        Raises:
-                pokemon catching exceptions for log purposes
-        Returns:
-                object of type list
-        '''
-        new = self.open_connection()
-        connection = new[0]
-        cursor = new[1]
-        try:
-            cursor.execute(self.pairings)
-            backlist = cursor.fetchall()
-            return self.pair_rawlist(backlist, 2)
-        except Exception as e:
-            self.log.exception(e)
-            return None
-
-    def pair_rawlist(self, player_list, step):
-        '''
-        Creates a list with user pairings
+        Players get new ids; standings and match history are the same as
+        in the exported tournament. Ratings are not part of a snapshot,
+        Game.recomputeRatings() rates the imported matches.
 
-        Args: self
-              player_list - object of type list
-              step - object of type integer
-        Raises:
-              IndexError - catch it if list indexes are uneven
-        Returns:
-                object of type list
-        '''
-        output = []
-        try:
-            for i in range(0, len(player_list), step):
-                pairs = player_list[i][0], player_list[i][
-                    1], player_list[i + 1][0], player_list[i + 1][1]
-                output.append(pairs)
-            return output
-        except IndexError:
-            return self.log.info('Players number is uneven')
-
-    def reportMatch(self, uid):
-        '''
-        Sets match score
+        Args:
+        path: a file written by exportTournament.
+        name: the new tournament's name, the exported one by default.
 
-        Args: self
-              uid - object of type list
-        Raises:
-                pokemon catching exceptions for log purposes
         Returns:
+        The new tournament's id, or None.
         '''
-        new = self.open_connection()
-        connection = new[0]
-        cursor = new[1]
-        try:
-            cursor.execute(self.addmatch, (str(uid[0]), str(uid[1])))
-            connection.commit()
-            self.log.info(
-                'Match between ' +
-                str(uid[0]) +
-                ' and ' +
-                str(uid[1]) +
-                ' was succefully stored')
-            return 'OK'
-        except Exception as e:
-            self.log.exception(e)
-
-    def query(self, **kwargs):
-        '''
-        Executes different queries base on keyed arguments
-
-        Args: self
-              key arguments
-        Raises:
-        Returns: (in descending order)
-                object of type String/None
-                object of type Integer/None
-                object of type String/None
-                object of type String/None
-                object of type List/None
-                object of type List/None
-        '''
-        for key, value in kwargs.iteritems():
-            if key is 'player':
-                return self.registerPlayer(value)
-            if key is 'count' and value is 'yes':
-                return self.countPlayers()
-            if key is 'deletePlayers' and value is 'yes':
-                return self.deletePlayers()
-            if key is 'deleteMatches' and value is 'yes':
-                return self.deleteMatches()
-            if key is 'standings' and value is 'yes':
-                return self.playerStandings()
-            if key is 'report_match':
-                self.reportMatch(value)
-            if key is 'pairings' and value is 'yes':
-                return self.get_pairings()
+        with open(path, 'rb') as stream:
+            data = read_snapshot(stream)
+        if name is not None:
+            data.name = str(name)
+        return self.dbapi.importTournament(data)
 
 
 class Players(object):
 
-    def __init__(self):
+    def __init__(self, dbapi=None, tournament=1):
         '''
         Instantiates objects
 
         Args: self
+              dbapi - store class instance, defaults to backend()
+              tournament - object of type integer, the tournament players
+                           are registered to
         Raises:
         Returns:
                 class instance object
                 class instance object
         '''
-        self.dbapi = db()
+        self.dbapi = dbapi or backend(tournament)
         self.log = logger()
 
     def deleteMatches(self):
         '''Remove all the match records from the database.'''
-        if self.dbapi.query(deleteMatches='yes'):
+        if self.dbapi.deleteMatches():
             self.log.info('All matches information is nulated')
 
     def deletePlayers(self):
         '''Remove all the player records from the database.'''
-        if self.dbapi.query(deletePlayers='yes'):
+        if self.dbapi.deletePlayers():
             self.log.info('All players have been deleted')
 
     def countPlayers(self):
         '''Returns the number of players currently registered.'''
-        return self.dbapi.query(count='yes')
+        return self.dbapi.countPlayers()
 
     def registerPlayer(self, name):
         '''Adds a player to the tournament database.
@@ -344,27 +173,41 @@ class Players(object):
         Args:
         name: the player's full name (need not be unique).
         '''
-        if self.dbapi.query(player=str(name)):
-            self.log.info(
-                '%s is registered succesfully' % (str(name)))
+        if self.dbapi.registerPlayer(str(name)):
+            self.log.info('%s is registered succesfully', name)
+
+    def registerPlayers(self, names):
+        '''Adds many players to the tournament database in one transaction.
+
+        Args:
+        names: iterable of the players' full names (need not be unique).
+
+        Returns:
+        A list with the new players' ids, in the same order as names,
+        or None if nothing was registered.
+        '''
+        return self.dbapi.registerPlayers(str(name) for name in names)
 
 
 class Game(object):
 
-    def __init__(self):
+    def __init__(self, dbapi=None, tournament=1):
         '''
         Creates instant object
 
         Args: self
+              dbapi - store class instance, defaults to backend()
+              tournament - object of type integer, the tournament games
+                           belong to
         Raises:
         Returns:
                 class instance object
         '''
-        self.dbapi = db()
+        self.dbapi = dbapi or backend(tournament)
 
-    def playerStandings(self):
+    def playerStandings(self, tiebreaks=False):
         '''Returns a list of the players and their win records,
-            sorted by wins.
+            sorted by match points (see pointStandings).
 
         The first entry in the list should be the player in first place,
         or a player tied for first place if there is currently a tie.
@@ -376,26 +219,144 @@ class Game(object):
              name: the player's full name (as registered)
              wins: the number of matches the player has won
              matches: the number of matches the player has played
+
+        Args:
+            tiebreaks: if true, each tuple also contains
+                (buchholz, sonneborn_berger, omw) and players with equal
+                points are ordered by them:
+             buchholz: the sum of the opponents' match points
+             sonneborn_berger: the points of the opponents beaten plus
+                half the points of the opponents drawn with
+             omw: the opponents' average share of the 3 points a match
+                is worth, each at least 1/3
+        '''
+        return self.dbapi.playerStandings(tiebreaks)
+
+    def iterStandings(self, batch=1000):
+        '''Yields the standings row by row, in playerStandings() order.
+
+        Rows are fetched batch at a time, so exports of very large fields
+        keep memory bounded. Exhaust or close() the generator to release
+        its database connection. A database error is raised from the
+        generator, so a stream that ends normally has every row.
+
+        Args:
+            batch: the number of rows fetched per round trip
+        '''
+        return self.dbapi.iterStandings(batch)
+
+    def standingsPage(self, limit, after=None):
+        '''Returns a page of the standings, in playerStandings() order.
+
+        Args:
+            limit: the number of rows of the page
+            after: the last row of the previous page, None for the top
+
+        Returns:
+            A list of up to limit (id, name, wins, matches) tuples
+        '''
+        return self.dbapi.standingsPage(limit, after)
+
+    def pointStandings(self):
+        '''Returns the players by match points, highest first.
+
+        A won match or a bye is worth 3 points, a draw 1 and a loss 0.
+        Without draws the order is the same as playerStandings().
+
+        Returns:
+        A list of tuples (id, name, points, wins, draws, matches,
+        games_won, games_played); the game counts only include the
+        matches reported with reportResult
         '''
-        return self.dbapi.query(standings='yes')
+        return self.dbapi.pointStandings()
 
-    def reportMatch(self, player1, player2):
+    def reportMatch(self, player1, player2, round=None):
         '''Records the outcome of a single match between two players.
 
         Args:
             player1: the id number of the first player
             player2: the id number of the player second player
+            round: the round of the match; by default one more than the
+                   most matches either player has played
         '''
-        self.dbapi.query(report_match=[player1, player2])
+        self.dbapi.reportMatch(player1, player2, round)
+
+    def reportBye(self, player, round=None):
+        '''Records a bye, which counts as a won match without an opponent.
+
+        Args:
+            player: the id number of the player who got the bye
+            round: the round of the bye, numbered like reportMatch
+        '''
+        self.dbapi.reportMatch(player, None, round)
+
+    def reportResult(self, player1, player2, games1, games2, round=None):
+        '''Records a match with the games each player won.
+
+        The player who won more games wins the match; equal games, or
+        None for both, record a draw.
+
+        Args:
+            player1, player2: the id numbers of the players
+            games1, games2: the games won by player1 and player2
+            round: the round of the match, numbered like reportMatch
+        Returns:
+            'OK' if the match was stored, None otherwise
+        '''
+        return self.dbapi.reportMatches(
+            [(player1, player2, games1, games2)], round)
+
+    def reportMatches(self, results, round=None):
+        '''Records the outcome of a whole round in one transaction.
+
+        Each player may appear only once in the round. If any pair is
+        invalid, none of the round is written.
+
+        Args:
+            results: a list of (winner, loser) id pairs, a None loser
+                     records a bye for the winner, or of (player1,
+                     player2, games1, games2) results as in
+                     reportResult; both kinds may be mixed
+            round: the round of all the matches, numbered like
+                   reportMatch by default
+
+        Returns:
+            'OK' if the round was stored, None otherwise
+        '''
+        return self.dbapi.reportMatches(list(results), round)
+
+    def opponentHistory(self, player):
+        '''Returns the matches a player has played, by round.
+
+        Each lookup reads only the player's own matches, through the
+        (winner, loser) and (loser, winner) indexes.
+
+        Returns:
+        A list of (round, opponent, won) tuples; opponent is None for a
+        bye and won is False for both players of a draw
+        '''
+        return self.dbapi.opponentHistory(player)
+
+    def havePlayed(self, player1, player2):
+        '''Returns True if the two players have already met.'''
+        return self.dbapi.havePlayed(player1, player2)
+
+    def roundResults(self, round):
+        '''Returns the (winner, loser) pairs of a round, as reported.
+
+        The players of a draw are in the order reportResult was given.
+        '''
+        return self.dbapi.roundResults(round)
 
     def swissPairings(self):
         '''Returns a list of pairs of players for the next round of a match.
 
-        Assuming that there are an even number of players registered,
-        each player appears exactly once in the pairings.
-        Each player is paired with another player with an equal
-        or nearly-equal win record, that is, a player adjacent to him or her
-        in the standings.
+        Each player appears exactly once in the pairings.
+        Each player is paired with the closest player in the standings
+        they have not played yet, so equal or nearly-equal win records
+        meet and rematches are avoided while possible. With an odd number
+        of players the lowest ranked player without a bye gets one, unless
+        only another bye avoids a rematch.
 
         Returns:
         A list of tuples, each of which contains (id1, name1, id2, name2)
@@ -403,5 +364,33 @@ class Game(object):
         name1: the first player's name
         id2: the second player's unique id
         name2: the second player's name
+        The bye, if any, comes last as (id, name, None, None).
+        '''
+        return self.dbapi.get_pairings()
+
+    def playerRatings(self):
+        '''Returns the players by rating, highest first.
+
+        Ratings are updated with every reported match when the backend
+        has a rating engine (see backend() and TOURNAMENT_RATING), and
+        are None otherwise. Byes are not rated, a draw counts as half a
+        win for both players.
+
+        Returns:
+        A list of tuples (id, name, rating, deviation, volatility, games)
+        rating: the player's rating, 1500 before any game
+        deviation, volatility: the Glicko-2 uncertainty, 0 with Elo
+        games: the number of rated games
+        '''
+        return self.dbapi.playerRatings()
+
+    def recomputeRatings(self):
+        '''Rates every match of the tournament again, in playing order.
+
+        Use it after changing the rating engine or its parameters, or to
+        rate the matches reported before ratings were enabled.
+
+        Returns:
+        The number of players with rated games
         '''
-        return self.dbapi.query(pairings='yes')
+        return self.dbapi.recomputeRatings()
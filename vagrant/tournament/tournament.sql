@@ -8,27 +8,195 @@
 DROP DATABASE IF EXISTS tournament;
 CREATE DATABASE tournament;
 \connect tournament
+-- Every player, match and score belongs to one tournament. All lookups
+-- lead with the tournament id, so one event never scans another.
+CREATE TABLE tournaments(
+   ID SERIAL PRIMARY KEY,
+   NAME    VARCHAR(80)    NOT NULL
+);
+
+-- Players and Game use tournament 1 unless told otherwise.
+INSERT INTO tournaments (NAME) VALUES ('default');
+
 CREATE TABLE players(
    ID SERIAL PRIMARY KEY,
-   NAME    VARCHAR(20)    NOT NULL
+   NAME    VARCHAR(20)    NOT NULL,
+   tournament INTEGER NOT NULL DEFAULT 1
+      REFERENCES tournaments(ID) ON DELETE CASCADE,
+   UNIQUE (tournament, ID)
 );
 
+-- The composite keys make sure both players of a match belong to the
+-- tournament of the match. A match without a round is numbered by the
+-- matches_round trigger below. In a draw winner and loser are just the
+-- two players; the games each won are NULL when not reported.
 CREATE TABLE matches(
    ID SERIAL PRIMARY KEY,
-   winner INTEGER REFERENCES players(ID),
-   loser INTEGER REFERENCES players(ID)
+   tournament INTEGER NOT NULL DEFAULT 1,
+   winner INTEGER NOT NULL,
+   loser INTEGER,
+   round INTEGER NOT NULL,
+   created TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+   draw BOOLEAN NOT NULL DEFAULT FALSE,
+   winner_games SMALLINT,
+   loser_games SMALLINT,
+   CHECK (NOT draw OR loser IS NOT NULL),
+   FOREIGN KEY (tournament, winner)
+      REFERENCES players(tournament, ID) ON DELETE CASCADE,
+   FOREIGN KEY (tournament, loser)
+      REFERENCES players(tournament, ID) ON DELETE CASCADE
+);
+
+
+-- Per player counters, kept up to date by the triggers below, so
+-- reading the standings never has to scan matches. Match points are
+-- 3 for a win or a bye, 1 for a draw and 0 for a loss.
+CREATE TABLE scores(
+   player INTEGER PRIMARY KEY REFERENCES players(ID) ON DELETE CASCADE,
+   tournament INTEGER NOT NULL,
+   wins INTEGER NOT NULL DEFAULT 0,
+   matches INTEGER NOT NULL DEFAULT 0,
+   draws INTEGER NOT NULL DEFAULT 0,
+   points INTEGER NOT NULL DEFAULT 0,
+   games_won INTEGER NOT NULL DEFAULT 0,
+   games_played INTEGER NOT NULL DEFAULT 0
+);
+
+-- Ratings of the players that played rated matches, written in bulk by
+-- tournament.db when a rating engine is configured. Players without a
+-- row still have the engine's initial rating.
+CREATE TABLE ratings(
+   player INTEGER PRIMARY KEY,
+   tournament INTEGER NOT NULL,
+   rating DOUBLE PRECISION NOT NULL,
+   deviation DOUBLE PRECISION NOT NULL,
+   volatility DOUBLE PRECISION NOT NULL,
+   games INTEGER NOT NULL,
+   FOREIGN KEY (tournament, player)
+      REFERENCES players(tournament, ID) ON DELETE CASCADE
 );
 
+CREATE INDEX ratings_rating_idx ON ratings (tournament, rating DESC, player);
+
+CREATE INDEX matches_tournament_idx ON matches (tournament);
+-- Opponent history: every match of a player, and whether two players
+-- met, is a range of one of these two indexes.
+CREATE INDEX matches_winner_loser_idx ON matches (winner, loser);
+CREATE INDEX matches_loser_winner_idx ON matches (loser, winner);
+CREATE INDEX matches_round_idx ON matches (tournament, round);
+CREATE INDEX scores_points_idx ON scores (tournament, points DESC, player);
+
+CREATE FUNCTION scores_add_player() RETURNS trigger AS $$
+BEGIN
+   INSERT INTO scores (player, tournament) VALUES (NEW.id, NEW.tournament);
+   RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION scores_add_match() RETURNS trigger AS $$
+BEGIN
+   UPDATE scores SET wins = wins + (NOT NEW.draw)::integer,
+                     matches = matches + 1,
+                     draws = draws + NEW.draw::integer,
+                     points = points + CASE WHEN NEW.draw THEN 1 ELSE 3 END,
+                     games_won = games_won + COALESCE(NEW.winner_games, 0),
+                     games_played = games_played +
+                        COALESCE(NEW.winner_games + NEW.loser_games, 0)
+      WHERE player = NEW.winner;
+   UPDATE scores SET matches = matches + 1,
+                     draws = draws + NEW.draw::integer,
+                     points = points + NEW.draw::integer,
+                     games_won = games_won + COALESCE(NEW.loser_games, 0),
+                     games_played = games_played +
+                        COALESCE(NEW.winner_games + NEW.loser_games, 0)
+      WHERE player = NEW.loser;
+   RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- The round of a match is one more than the matches either player
+-- already played, byes included.
+CREATE FUNCTION matches_set_round() RETURNS trigger AS $$
+BEGIN
+   SELECT max(matches) + 1 INTO NEW.round FROM scores
+      WHERE player IN (NEW.winner, NEW.loser);
+   RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION scores_reset() RETURNS trigger AS $$
+BEGIN
+   UPDATE scores SET wins = 0, matches = 0, draws = 0, points = 0,
+                     games_won = 0, games_played = 0;
+   RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Matches of a tournament are deleted in bulk together with a reset of
+-- its counters (see tournament.db.deleteMatches), so deletes have no
+-- per row trigger.
+CREATE TRIGGER players_scores AFTER INSERT ON players
+   FOR EACH ROW EXECUTE PROCEDURE scores_add_player();
+CREATE TRIGGER matches_round BEFORE INSERT ON matches
+   FOR EACH ROW WHEN (NEW.round IS NULL)
+   EXECUTE PROCEDURE matches_set_round();
+CREATE TRIGGER matches_scores_insert AFTER INSERT ON matches
+   FOR EACH ROW EXECUTE PROCEDURE scores_add_match();
+CREATE TRIGGER matches_scores_truncate AFTER TRUNCATE ON matches
+   FOR EACH STATEMENT EXECUTE PROCEDURE scores_reset();
 
 CREATE VIEW standings AS
-   SELECT players.id, 
-          players.name, 
-          (SELECT COUNT(matches.winner) FROM matches WHERE players.id = matches.winner) as wins, 
-          (SELECT COUNT(matches.id) FROM matches WHERE players.id = matches.winner OR players.id = matches.loser) as matches
-   FROM players
-   ORDER BY wins DESC;
+   SELECT scores.tournament,
+          players.id,
+          players.name,
+          scores.wins,
+          scores.matches,
+          scores.draws,
+          scores.points,
+          scores.games_won,
+          scores.games_played
+   FROM scores JOIN players ON players.id = scores.player;
 
 CREATE VIEW selection AS
-   SELECT standings.id,
+   SELECT standings.tournament,
+          standings.id,
           standings.name
    FROM standings;
+
+-- Tiebreaks of every player, computed in one pass over the matches of a
+-- tournament: each match is seen once from either side, byes have no
+-- opponent and count for none of them. Unlike the points they are not
+-- kept in scores by the trigger, since a match would have to update every
+-- earlier opponent of both players; the result is cached per round instead.
+--   buchholz - sum of the opponents' match points
+--   sonneborn_berger - sum of the points of the opponents beaten and half
+--                      the points of the opponents drawn with
+--   omw - average match-point ratio of the opponents, points over the 3
+--         per match they could have scored, at least 1/3 each
+CREATE VIEW tiebreaks AS
+   SELECT scores.tournament,
+          players.id,
+          players.name,
+          scores.wins,
+          scores.matches,
+          COALESCE(sum(opponent.points), 0)::integer AS buchholz,
+          COALESCE(sum(games.score * opponent.points), 0)::float
+             AS sonneborn_berger,
+          COALESCE(avg(GREATEST(opponent.points::float /
+             (3 * opponent.matches), 1::float / 3)), 0) AS omw,
+          scores.points
+   FROM scores
+   JOIN players ON players.id = scores.player
+   LEFT JOIN (SELECT tournament, winner AS player, loser AS opponent,
+                     CASE WHEN draw THEN 0.5 ELSE 1 END AS score
+              FROM matches WHERE loser IS NOT NULL
+              UNION ALL
+              SELECT tournament, loser, winner,
+                     CASE WHEN draw THEN 0.5 ELSE 0 END
+              FROM matches WHERE loser IS NOT NULL) AS games
+      ON games.tournament = scores.tournament
+     AND games.player = scores.player
+   LEFT JOIN scores AS opponent
+      ON opponent.tournament = games.tournament
+     AND opponent.player = games.opponent
+   GROUP BY scores.player, players.id;
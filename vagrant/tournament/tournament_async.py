@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+#
+# tournament_async.py -- asyncio variant of the tournament API
+#
+# Needs Python 3.7+ and asyncpg. Runs against the same schema as
+# tournament.py and shares its swiss pairing engine. Reports take the same
+# per tournament lock as tournament.db, so they wait for a ratings replay,
+# but are not rated themselves: run Game.recomputeRatings() afterwards if
+# the tournament is rated.
+#
+
+import asyncio
+import logging
+import random
+
+import asyncpg
+
+from tournament import shared_log, swiss
+
+
+log = logging.getLogger('tournament')
+
+
+async def open_pool(dsn='postgresql:///tournament', min_size=1, max_size=10,
+                    retries=5, backoff=0.5, max_backoff=8.0, **kwargs):
+    '''
+    Creates an asyncpg pool, retrying a bounded number of times with
+    exponential backoff and jitter while PostgreSQL is unreachable.
+    Cancelling the calling task interrupts the wait.
+
+    Args: dsn - object of type string
+          min_size - object of type integer
+          max_size - object of type integer
+          retries - object of type integer, attempts after the first one
+          backoff - object of type float, first delay in seconds
+          max_backoff - object of type float, longest delay in seconds
+          kwargs - passed to asyncpg.create_pool
+    Raises:
+            OSError, asyncpg.PostgresError - when the last retry fails
+            asyncio.CancelledError - when the caller is cancelled
+    Returns:
+            object of type asyncpg.Pool
+    '''
+    attempt = 0
+    while True:
+        try:
+            return await asyncpg.create_pool(
+                dsn, min_size=min_size, max_size=max_size, **kwargs)
+        except (OSError, asyncpg.PostgresError,
+                asyncpg.InterfaceError) as e:
+            if attempt >= retries:
+                raise
+            delay = min(max_backoff, backoff * 2 ** attempt)
+            delay *= random.uniform(0.5, 1.0)
+            attempt += 1
+            log.info('Cannot connect (%s). Retry %d/%d in %.2fs',
+                     e, attempt, retries, delay)
+            await asyncio.sleep(delay)
+
+
+shared = {'pool': None, 'lock': None}
+
+
+async def shared_pool(**kwargs):
+    '''
+    Returns the pool shared by every asyncdb instance, creating it on
+    first use. Keyword arguments are passed to open_pool() and only
+    apply on creation.
+
+    Args: key arguments
+    Raises:
+    Returns:
+            object of type asyncpg.Pool
+    '''
+    if shared['lock'] is None:
+        shared['lock'] = asyncio.Lock()
+    async with shared['lock']:
+        if shared['pool'] is None:
+            shared['pool'] = await open_pool(**kwargs)
+        return shared['pool']
+
+
+async def close_shared_pool():
+    '''
+    Closes the shared pool, if any
+
+    Args:
+    Raises:
+    Returns: None
+    '''
+    if shared['pool'] is not None:
+        pool, shared['pool'] = shared['pool'], None
+        await pool.close()
+
+
+class asyncdb(object):
+
+    def __init__(self, connections=None, tournament=1):
+        '''
+        Create references to statement objects. Log records go through
+        the queue of tournament.shared_log(), so the event loop never
+        waits for the log file.
+
+        Args: self
+              connections - object of type asyncpg.Pool, defaults to
+                            shared_pool()
+              tournament - object of type integer
+        Raises:
+        Returns:
+            self.tournament - object of type integer
+            self.connections - object of type asyncpg.Pool/None
+        '''
+        shared_log()
+        self.connections = connections
+        self.tournament = tournament
+        self.insert_name = ('INSERT INTO players (name, tournament) '
+                            'VALUES ($1, $2);')
+        self.insert_names = ('INSERT INTO players (id, name, tournament) '
+                             'SELECT id, name, $3 '
+                             'FROM unnest($1::int[], $2::text[]) '
+                             'AS batch (id, name);')
+        self.reserve_ids = ('SELECT nextval(\'players_id_seq\') '
+                            'FROM generate_series(1, $1);')
+        self.addmatch = ('INSERT INTO matches (tournament, winner, loser) '
+                         'VALUES ($1, $2, $3);')
+        self.addmatches = ('INSERT INTO matches (tournament, winner, loser) '
+                           'SELECT $1, winner, loser '
+                           'FROM unnest($2::int[], $3::int[]) '
+                           'AS round (winner, loser);')
+        self.known = ('SELECT count(*) FROM players '
+                      'WHERE tournament = $1 AND id = ANY($2::int[]);')
+        self.counter = 'SELECT count(*) FROM players WHERE tournament = $1;'
+        self.remove_players = 'DELETE FROM players WHERE tournament = $1;'
+        self.remove_matches = 'DELETE FROM matches WHERE tournament = $1;'
+        self.clear_ratings = 'DELETE FROM ratings WHERE tournament = $1;'
+        self.report_lock = ('SELECT pg_advisory_xact_lock_shared('
+                            '\'matches\'::regclass::integer, $1);')
+        self.reset_scores = ('UPDATE scores SET wins = 0, matches = 0, '
+                             'draws = 0, points = 0, games_won = 0, '
+                             'games_played = 0 WHERE tournament = $1;')
+        self.standings = ('SELECT id, name, wins, matches FROM standings '
+                          'WHERE tournament = $1 ORDER BY points DESC, id;')
+        self.history = ('SELECT winner, loser FROM matches '
+                        'WHERE tournament = $1;')
+
+    async def pool(self):
+        '''
+        Returns the pool, opening the shared one on first use
+
+        Args: self
+        Raises:
+        Returns:
+                object of type asyncpg.Pool
+        '''
+        if self.connections is None:
+            self.connections = await shared_pool()
+        return self.connections
+
+    async def countPlayers(self):
+        '''
+        Counter entries in players table
+
+        Args: self
+        Raises:
+                pokemon catching exceptions for log purposes
+                asyncio.CancelledError - when the caller is cancelled
+        Returns:
+                object of type integer
+                object of type None
+        '''
+        try:
+            pool = await self.pool()
+            return await pool.fetchval(self.counter, self.tournament)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception(e)
+            return None
+
+    async def registerPlayer(self, name):
+        '''
+        Insert player details into players table
+
+        Args: self
+              name - object of type string
+        Raises:
+                pokemon catching exceptions for log purposes
+                asyncio.CancelledError - when the caller is cancelled
+        Returns:
+                object of type string
+                object of type None
+        '''
+        try:
+            pool = await self.pool()
+            await pool.execute(self.insert_name, name, self.tournament)
+            return 'OK'
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception(e)
+            return None
+
+    async def registerPlayers(self, names):
+        '''
+        Insert many players in one transaction, ids in input order
+
+        Args: self
+              names - object of type iterable(string)
+        Raises:
+                pokemon catching exceptions for log purposes
+                asyncio.CancelledError - when the caller is cancelled
+        Returns:
+                object of type list(integer)
+                object of type None
+        '''
+        names = list(names)
+        try:
+            pool = await self.pool()
+            async with pool.acquire() as connection:
+                async with connection.transaction():
+                    rows = await connection.fetch(self.reserve_ids,
+                                                  len(names))
+                    ids = [row[0] for row in rows]
+                    await connection.execute(self.insert_names, ids, names,
+                                             self.tournament)
+            return ids
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception(e)
+            return None
+
+    async def deletePlayers(self):
+        '''
+        Deletes the players of the tournament
+
+        Args: self
+        Raises:
+                pokemon catching exceptions for log purposes
+                asyncio.CancelledError - when the caller is cancelled
+        Returns:
+                object of type string
+                object of type None
+        '''
+        try:
+            pool = await self.pool()
+            await pool.execute(self.remove_players, self.tournament)
+            return 'OK'
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception(e)
+            return None
+
+    async def deleteMatches(self):
+        '''
+        Removes the matches of the tournament and resets its scores and
+        ratings
+
+        Args: self
+        Raises:
+                pokemon catching exceptions for log purposes
+                asyncio.CancelledError - when the caller is cancelled
+        Returns:
+                object of type string
+                object of type None
+        '''
+        try:
+            pool = await self.pool()
+            async with pool.acquire() as connection:
+                async with connection.transaction():
+                    await connection.execute(self.remove_matches,
+                                             self.tournament)
+                    await connection.execute(self.reset_scores,
+                                             self.tournament)
+                    await connection.execute(self.clear_ratings,
+                                             self.tournament)
+            return 'OK'
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception(e)
+            return None
+
+    async def playerStandings(self):
+        '''
+        Returns current standings of the tournament
+
+        Args: self
+        Raises:
+                pokemon catching exceptions for log purposes
+                asyncio.CancelledError - when the caller is cancelled
+        Returns:
+                object of type list
+                object of type None
+        '''
+        try:
+            pool = await self.pool()
+            rows = await pool.fetch(self.standings, self.tournament)
+            return [tuple(row) for row in rows]
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception(e)
+            return None
+
+    async def reportMatch(self, winner, loser):
+        '''
+        Sets match score, a None loser records a bye
+
+        Args: self
+              winner - object of type integer
+              loser - object of type integer/None
+        Raises:
+                pokemon catching exceptions for log purposes
+                asyncio.CancelledError - when the caller is cancelled
+        Returns:
+                object of type string
+                object of type None
+        '''
+        try:
+            pool = await self.pool()
+            async with pool.acquire() as connection:
+                async with connection.transaction():
+                    await connection.execute(self.report_lock,
+                                             self.tournament)
+                    await connection.execute(self.addmatch, self.tournament,
+                                             winner, loser)
+            log.info('Match between %s and %s was succefully stored',
+                     winner, loser)
+            return 'OK'
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception(e)
+            return None
+
+    async def reportMatches(self, results):
+        '''
+        Stores a whole round atomically, nothing if any pair is invalid
+
+        Args: self
+              results - object of type list((winner, loser))
+        Raises:
+                pokemon catching exceptions for log purposes
+                asyncio.CancelledError - when the caller is cancelled
+        Returns:
+                object of type string
+                object of type None
+        '''
+        seen = set()
+        winners, losers = [], []
+        for winner, loser in results:
+            if winner == loser or winner in seen or loser in seen:
+                log.info('Invalid round, %s and %s rejected', winner, loser)
+                return None
+            seen.add(winner)
+            if loser is not None:
+                seen.add(loser)
+            winners.append(winner)
+            losers.append(loser)
+        if not winners:
+            return 'OK'
+        try:
+            pool = await self.pool()
+            async with pool.acquire() as connection:
+                async with connection.transaction():
+                    known = await connection.fetchval(
+                        self.known, self.tournament, list(seen))
+                    if known != len(seen):
+                        log.info('Invalid round, unknown players')
+                        return None
+                    await connection.execute(self.report_lock,
+                                             self.tournament)
+                    await connection.execute(self.addmatches,
+                                             self.tournament, winners,
+                                             losers)
+            return 'OK'
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception(e)
+            return None
+
+    async def swissPairings(self):
+        '''
+        Pairs the current standings with the swiss engine
+
+        Args: self
+        Raises:
+                pokemon catching exceptions for log purposes
+                asyncio.CancelledError - when the caller is cancelled
+        Returns:
+                object of type list
+                object of type None
+        '''
+        try:
+            pool = await self.pool()
+            async with pool.acquire() as connection:
+                async with connection.transaction(isolation='repeatable_read',
+                                                  readonly=True):
+                    standings = await connection.fetch(self.standings,
+                                                       self.tournament)
+                    history = await connection.fetch(self.history,
+                                                     self.tournament)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception(e)
+            return None
+        return swiss([tuple(row) for row in standings],
+                     [tuple(row) for row in history]).pair()
+
+
+class AsyncPlayers(object):
+
+    def __init__(self, dbapi=None, tournament=1):
+        '''
+        Instantiates objects
+
+        Args: self
+              dbapi - asyncdb class instance, defaults to one on the
+                      shared pool
+              tournament - object of type integer
+        Raises:
+        Returns:
+                class instance object
+        '''
+        self.dbapi = dbapi or asyncdb(tournament=tournament)
+
+    async def deleteMatches(self):
+        '''Remove all the match records of the tournament.'''
+        if await self.dbapi.deleteMatches():
+            log.info('All matches information is nulated')
+
+    async def deletePlayers(self):
+        '''Remove all the player records of the tournament.'''
+        if await self.dbapi.deletePlayers():
+            log.info('All players have been deleted')
+
+    async def countPlayers(self):
+        '''Returns the number of players currently registered.'''
+        return await self.dbapi.countPlayers()
+
+    async def registerPlayer(self, name):
+        '''Adds a player to the tournament database.
+
+        Args:
+        name: the player's full name (need not be unique).
+        '''
+        if await self.dbapi.registerPlayer(str(name)):
+            log.info('%s is registered succesfully', name)
+
+    async def registerPlayers(self, names):
+        '''Adds many players in one transaction.
+
+        Returns:
+        A list with the new players' ids, in the same order as names.
+        '''
+        return await self.dbapi.registerPlayers(str(name) for name in names)
+
+
+class AsyncGame(object):
+
+    def __init__(self, dbapi=None, tournament=1):
+        '''
+        Creates instant object
+
+        Args: self
+              dbapi - asyncdb class instance, defaults to one on the
+                      shared pool
+              tournament - object of type integer
+        Raises:
+        Returns:
+                class instance object
+        '''
+        self.dbapi = dbapi or asyncdb(tournament=tournament)
+
+    async def playerStandings(self):
+        '''Returns a list of (id, name, wins, matches) tuples, by points.'''
+        return await self.dbapi.playerStandings()
+
+    async def reportMatch(self, player1, player2):
+        '''Records the outcome of a single match between two players.
+
+        Args:
+            player1: the id number of the winner
+            player2: the id number of the loser
+        '''
+        await self.dbapi.reportMatch(player1, player2)
+
+    async def reportBye(self, player):
+        '''Records a bye for player.'''
+        await self.dbapi.reportMatch(player, None)
+
+    async def reportMatches(self, results):
+        '''Records a whole round of (winner, loser) pairs atomically.'''
+        return await self.dbapi.reportMatches(list(results))
+
+    async def swissPairings(self):
+        '''Returns (id1, name1, id2, name2) tuples for the next round.
+
+        A bye, if any, comes last as (id, name, None, None).
+        '''
+        return await self.dbapi.swissPairings()
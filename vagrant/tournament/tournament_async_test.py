@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+#
+# Test cases for tournament_async.py
+# Needs Python 3.7+, asyncpg and a database created from tournament.sql.
+
+import asyncio
+import time
+
+import tournament_async
+
+players = tournament_async.AsyncPlayers()
+game = tournament_async.AsyncGame()
+
+
+async def testRegisterAndStandings():
+    """
+    Test registration, counting and standings through the async API.
+    """
+    await players.deleteMatches()
+    await players.deletePlayers()
+    if await players.countPlayers() != 0:
+        raise ValueError("After deletion, countPlayers should return zero.")
+    await players.registerPlayer("Chandra Nalaar")
+    ids = await players.registerPlayers(["Jace Beleren", "Liliana Vess"])
+    if len(ids) != 2 or await players.countPlayers() != 3:
+        raise ValueError("All registered players should be counted.")
+    standings = await game.playerStandings()
+    if len(standings) != 3 or len(standings[0]) != 4:
+        raise ValueError("Standings should list four columns per player.")
+    print("1. Players are registered and listed in the standings.")
+
+
+async def testRoundsAndPairings():
+    """
+    Test reporting rounds and pairing the next one concurrently.
+    """
+    await players.deleteMatches()
+    await players.deletePlayers()
+    [id1, id2, id3, id4] = await players.registerPlayers(
+        ["Ajani", "Nissa", "Sorin", "Gideon"])
+    if await game.reportMatches([(id1, id2), (id1, id3)]) is not None:
+        raise ValueError("A player can play only once per round.")
+    await asyncio.gather(game.reportMatch(id1, id2),
+                         game.reportMatch(id3, id4))
+    await game.reportMatches([(id1, id3), (id2, id4)])
+    pairings, standings = await asyncio.gather(game.swissPairings(),
+                                               game.playerStandings())
+    if [row[2] for row in standings] != [2, 1, 1, 0]:
+        raise ValueError("Standings should reflect both rounds.")
+    actual_pairs = set(frozenset([row[0], row[2]]) for row in pairings)
+    if actual_pairs != set([frozenset([id1, id4]), frozenset([id2, id3])]):
+        raise ValueError("Players should not be paired for a rematch.")
+    print("2. Rounds are reported and paired without rematches.")
+
+
+async def testBoundedRetry():
+    """
+    Test that connecting gives up after the retries and can be cancelled.
+    """
+    started = time.time()
+    try:
+        await tournament_async.open_pool(
+            'postgresql://localhost:1/tournament', retries=2, backoff=0.01)
+    except OSError:
+        pass
+    else:
+        raise ValueError("open_pool should give up after its retries.")
+    if time.time() - started > 5:
+        raise ValueError("Retries should be bounded.")
+    task = asyncio.ensure_future(tournament_async.open_pool(
+        'postgresql://localhost:1/tournament', retries=100, backoff=1))
+    await asyncio.sleep(0.1)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    else:
+        raise ValueError("open_pool should stop when cancelled.")
+    print("3. Connecting retries a bounded number of times and can be "
+          "cancelled.")
+
+
+async def testCancel():
+    """
+    Test that cancelling a call cancels it rather than returning None.
+    """
+    await players.countPlayers()
+    task = asyncio.ensure_future(players.countPlayers())
+    await asyncio.sleep(0)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    else:
+        raise ValueError("A cancelled call should raise CancelledError.")
+    print("4. Cancelled calls are not swallowed.")
+
+
+async def testSharedState():
+    """
+    Test that async reports wait for a ratings replay of their tournament
+    and that deleting matches drops the tournament's ratings.
+    """
+    await players.deleteMatches()
+    await players.deletePlayers()
+    [id1, id2] = await players.registerPlayers(["Karn", "Teferi"])
+    pool = await game.dbapi.pool()
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            await connection.execute(
+                "SELECT pg_advisory_xact_lock('matches'::regclass::integer, "
+                "$1)", game.dbapi.tournament)
+            report = asyncio.ensure_future(game.reportMatch(id1, id2))
+            await asyncio.sleep(0.2)
+            if report.done():
+                raise ValueError("Reports should wait for a replay.")
+        await report
+        await connection.execute(
+            'INSERT INTO ratings VALUES ($1, $2, 1500, 350, 0.06, 1)',
+            id1, game.dbapi.tournament)
+        await players.deleteMatches()
+        if await connection.fetchval('SELECT count(*) FROM ratings '
+                                     'WHERE player = $1', id1):
+            raise ValueError("deleteMatches should drop the ratings.")
+    await players.deletePlayers()
+    print("5. Reports and deletions keep the ratings consistent.")
+
+
+async def main():
+    await testRegisterAndStandings()
+    await testRoundsAndPairings()
+    await testBoundedRetry()
+    await testCancel()
+    await testSharedState()
+    await tournament_async.close_shared_pool()
+    print("Success!  All tests pass!")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+#
+# Benchmarks for tournament.py
+#
+# Run against a database created from tournament.sql, or set
+# TOURNAMENT_BACKEND=memory. Every field size runs in a tournament of its
+# own that is deleted afterwards. Set TOURNAMENT_RATING=elo or glicko2
+# to rate every round and time a full recompute of the ratings. Results
+# are written as JSON so runs of different commits can be compared:
+#
+#   python tournament_bench.py --output new.json --baseline old.json
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tournament
+
+
+def timed(function, *args):
+    """Returns the seconds it took to call function(*args)."""
+    started = time.time()
+    function(*args)
+    return time.time() - started
+
+
+def summary(samples):
+    """Returns min/median/max milliseconds of a list of seconds."""
+    samples = sorted(samples)
+    return {'min_ms': samples[0] * 1000,
+            'median_ms': samples[len(samples) // 2] * 1000,
+            'max_ms': samples[-1] * 1000}
+
+
+def uncached(game):
+    """Drops cached reads so the storage is actually measured."""
+    if isinstance(game.dbapi, tournament.db):
+        game.dbapi.cache.invalidate(game.dbapi.tournament)
+
+
+def benchHistory(game, ids, rounds, count, rng):
+    """
+    Per call cost of the opponent history lookups on a played field.
+    """
+    players = [rng.choice(ids) for i in range(count)]
+    others = [rng.choice(ids) for i in range(count)]
+    game.opponentHistory(players[0])
+    history = [timed(game.opponentHistory, player) for player in players]
+    played = [timed(game.havePlayed, player, other)
+              for player, other in zip(players, others)]
+    results = [timed(game.roundResults, rng.randint(1, max(rounds, 1)))
+               for i in range(min(count, 20))]
+    return summary(history), summary(played), summary(results)
+
+
+def benchField(size, rounds, seed, lookups=1000):
+    """
+    Register size players in bulk, then play rounds of swiss rounds
+    with random winners, timing standings with and without tiebreaks,
+    pairings and reporting. Then time opponent history lookups of
+    random players, and export and import the event as a snapshot.
+    """
+    tournaments = tournament.Tournaments()
+    event = tournaments.registerTournament("Benchmark %d" % size)
+    players = tournament.Players(tournament=event)
+    game = tournament.Game(tournament=event)
+    rng = random.Random(seed)
+    names = ["Player %d" % i for i in range(size)]
+    started = time.time()
+    ids = players.registerPlayers(names)
+    register = time.time() - started
+    standings, tiebreaks, pairings, reports = [], [], [], []
+    reported = 0
+    for played in range(rounds):
+        uncached(game)
+        standings.append(timed(game.playerStandings))
+        uncached(game)
+        tiebreaks.append(timed(game.playerStandings, True))
+        uncached(game)
+        started = time.time()
+        pairs = game.swissPairings()
+        pairings.append(time.time() - started)
+        results = []
+        for (id1, name1, id2, name2) in pairs:
+            if id2 is not None and rng.random() < 0.5:
+                id1, id2 = id2, id1
+            results.append((id1, id2))
+        reports.append(timed(game.reportMatches, results))
+        reported += len(results)
+    uncached(game)
+    standings.append(timed(game.playerStandings))
+    uncached(game)
+    tiebreaks.append(timed(game.playerStandings, True))
+    history, played, results = benchHistory(game, ids, rounds, lookups, rng)
+    recompute = None
+    if getattr(game.dbapi, 'rating', None) is not None:
+        recompute = timed(game.recomputeRatings)
+    path = tempfile.mktemp()
+    export = timed(tournaments.exportTournament, event, path)
+    started = time.time()
+    clone = tournaments.importTournament(path)
+    reload = time.time() - started
+    os.remove(path)
+    tournaments.deleteTournament(clone)
+    tournaments.deleteTournament(event)
+    result = {
+        'players': size,
+        'rounds': rounds,
+        'register_players_per_s': size / max(register, 1e-9),
+        'report_matches_per_s': reported / max(sum(reports), 1e-9),
+        'standings': summary(standings),
+        'tiebreaks': summary(tiebreaks),
+        'pairings': summary(pairings),
+        'opponent_history': history,
+        'have_played': played,
+        'round_results': results,
+        'export_s': export,
+        'import_s': reload}
+    if recompute is not None:
+        result['recompute_matches_per_s'] = reported / max(recompute, 1e-9)
+    print "%7d players %2d rounds: register %9.0f/s report %9.0f/s " \
+        "standings %8.2fms tiebreaks %8.2fms pairings %8.2fms" % (
+            size, rounds, result['register_players_per_s'],
+            result['report_matches_per_s'],
+            result['standings']['median_ms'],
+            result['tiebreaks']['median_ms'],
+            result['pairings']['median_ms'])
+    print "%7d players %2d rounds: history %8.3fms havePlayed %8.3fms " \
+        "round results %8.2fms" % (
+            size, rounds, history['median_ms'], played['median_ms'],
+            results['median_ms'])
+    print "%7d players %2d rounds: export %8.2fs import %8.2fs" % (
+        size, rounds, export, reload)
+    if recompute is not None:
+        print "%7d players %2d rounds: recompute ratings %9.0f/s" % (
+            size, rounds, result['recompute_matches_per_s'])
+    return result
+
+
+def benchSingleCalls(count):
+    """
+    Compare registering and reporting one by one with the bulk calls.
+    """
+    tournaments = tournament.Tournaments()
+    results = {}
+    for bulk in (False, True):
+        event = tournaments.registerTournament("Single calls")
+        players = tournament.Players(tournament=event)
+        game = tournament.Game(tournament=event)
+        names = ["Player %d" % i for i in range(count)]
+        if bulk:
+            register = timed(players.registerPlayers, names)
+        else:
+            register = timed(
+                lambda: [players.registerPlayer(n) for n in names])
+        ids = [row[0] for row in game.playerStandings()]
+        pairs = list(zip(ids[0::2], ids[1::2]))
+        if bulk:
+            report = timed(game.reportMatches, pairs)
+        else:
+            report = timed(lambda: [game.reportMatch(*p) for p in pairs])
+        tournaments.deleteTournament(event)
+        kind = 'bulk' if bulk else 'single'
+        results[kind] = {
+            'register_players_per_s': count / max(register, 1e-9),
+            'report_matches_per_s': len(pairs) / max(report, 1e-9)}
+        print "%-6s x %6d: register %9.0f/s report %9.0f/s" % (
+            kind, count, results[kind]['register_players_per_s'],
+            results[kind]['report_matches_per_s'])
+    return results
+
+
+def benchDispatch(count):
+    """
+    Per call cost of the command layer: the keyword dispatcher against
+    direct calls, and plain SQL against prepared statements. The result
+    cache is bypassed, so every call reaches the backend. Statements are
+    timed from a one-row count, where planning costs next to nothing, up
+    to the tiebreaks view, where planning is most of the work.
+    """
+    dbapi = tournament.backend()
+    results = {}
+    calls = [('query', lambda: dbapi.query(standings='yes')),
+             ('direct', dbapi.playerStandings)]
+    if isinstance(dbapi, tournament.db):
+        dbapi.cache = tournament.cache(ttl=0)
+        params = {'counter': (dbapi.tournament, ),
+                  'standings': (dbapi.tournament, ),
+                  'tiebreaks': (dbapi.tournament, )}
+        with dbapi.pool.connection() as connection:
+            cursor = connection.cursor()
+            for name in sorted(params):
+                plain = re.sub(r'\$(\d+)', r'%(\1)s',
+                               dbapi.statements[name][1])
+                named = dict((str(i + 1), value)
+                             for i, value in enumerate(params[name]))
+                for kind, execute in (
+                        ('unprepared', lambda: cursor.execute(plain, named)),
+                        ('prepared', lambda: dbapi.execute(
+                            cursor, name, params[name]))):
+                    execute()
+                    samples = [timed(execute) for i in range(count)]
+                    results['%s %s' % (name, kind)] = summary(samples)
+    for kind, call in calls:
+        call()
+        results[kind] = summary([timed(call) for i in range(count)])
+    for kind in sorted(results):
+        print "%-20s x %6d: %8.1fus median" % (
+            kind, count, results[kind]['median_ms'] * 1000)
+    return results
+
+
+def metadata():
+    """Describes the run, so result files can be told apart."""
+    try:
+        with open(os.devnull, 'w') as devnull:
+            commit = subprocess.check_output(
+                ['git', 'rev-parse', 'HEAD'], stderr=devnull,
+                cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+        commit = commit.decode('ascii') if bytes is not str else commit
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'backend': os.environ.get('TOURNAMENT_BACKEND', 'postgres'),
+            'python': platform.python_version(),
+            'host': platform.node()}
+
+
+def compare(baseline, current):
+    """Prints the change of every metric against a baseline run."""
+    old = dict((row['players'], row) for row in baseline['fields'])
+    for row in current['fields']:
+        if row['players'] not in old:
+            continue
+        before = old[row['players']]
+        for key in ('register_players_per_s', 'report_matches_per_s'):
+            print "%7d players %-24s %+7.1f%%" % (
+                row['players'], key,
+                100.0 * (row[key] / before[key] - 1))
+        for key in ('standings', 'tiebreaks', 'pairings',
+                    'opponent_history', 'have_played', 'round_results'):
+            if key not in before:
+                continue
+            print "%7d players %-24s %+7.1f%%" % (
+                row['players'], key + ' median',
+                100.0 * (row[key]['median_ms'] /
+                         max(before[key]['median_ms'], 1e-9) - 1))
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the tournament module.')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='comma separated field sizes')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--lookups', type=int, default=1000,
+                        help='opponent history lookups per field')
+    parser.add_argument('--seed', type=int, default=2016)
+    parser.add_argument('--single', type=int, default=2000,
+                        help='players for the single call comparison, '
+                             '0 to skip it')
+    parser.add_argument('--calls', type=int, default=5000,
+                        help='calls per dispatch microbenchmark, '
+                             '0 to skip it')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--metrics',
+                        help='file for the metrics exposition of the run')
+    parser.add_argument('--baseline', help='earlier result file')
+    args = parser.parse_args(argv)
+    report = {'meta': metadata(), 'fields': [], 'single_calls': None,
+              'dispatch': None}
+    for size in [int(size) for size in args.sizes.split(',')]:
+        report['fields'].append(benchField(size, args.rounds, args.seed,
+                                           args.lookups))
+    if args.single:
+        report['single_calls'] = benchSingleCalls(args.single)
+    if args.calls:
+        report['dispatch'] = benchDispatch(args.calls)
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+    print "Results written to %s" % args.output
+    if args.metrics:
+        with open(args.metrics, 'w') as output:
+            output.write(tournament.shared_metrics().exposition())
+        print "Metrics written to %s" % args.metrics
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            compare(json.load(baseline), report)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
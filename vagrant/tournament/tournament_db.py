@@ -0,0 +1,1549 @@
+#!/usr/bin/env python
+#
+# tournament_db.py -- PostgreSQL backend of tournament.py
+#
+
+import time
+import threading
+import contextlib
+import io
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+from tournament_metrics import (instrumented, logger, shared, shared_lock,
+                                shared_metrics)
+from tournament_swiss import swiss
+from tournament_ratings import numpy, replay
+from tournament_snapshot import snapshot
+from tournament_store import store
+
+
+class PoolTimeout(Exception):
+    '''Raised when no pooled connection frees up within the timeout.'''
+
+
+class pool(object):
+
+    def __init__(self, dsn='dbname=tournament', minconn=1, maxconn=10,
+                 timeout=None, check_interval=30, retries=None,
+                 registry=None):
+        '''
+        Creates a bounded pool of PostgreSQL connections
+
+        Args: self
+              dsn - object of type string
+              minconn - object of type integer, connections opened upfront
+              maxconn - object of type integer, hard limit of connections
+              timeout - object of type float/None, seconds to wait for
+                        a free connection (None waits forever)
+              check_interval - object of type float, idle seconds after
+                               which a connection is pinged on checkout
+              retries - object of type integer/None, failed connection
+                        attempts before giving up (None retries forever)
+              registry - metrics class instance, defaults to
+                         shared_metrics()
+        Raises:
+                ValueError - if minconn/maxconn are out of range
+        Returns:
+            self.idle - object of type list((connection, idle since))
+            self.size - object of type integer, open connections
+            self.statements - object of type dictionary(connection,
+                              set(name)), statements prepared on each
+                              open connection
+            self.log - logger class instance
+            self.timer - object of type integer
+        '''
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError('Invalid pool size %s/%s' % (minconn, maxconn))
+        self.dsn = dsn
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.retries = retries
+        self.metrics = registry or shared_metrics()
+        self.idle = []
+        self.size = 0
+        self.statements = {}
+        self.lock = threading.Condition()
+        self.log = logger()
+        self.timer = 1
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self.discarded = 0
+        self.peak = 0
+        for i in range(minconn):
+            self.size += 1
+            self.idle.append((self.open_connection(), time.time()))
+
+    def open_connection(self):
+        '''
+        Connect to the PostgreSQL database.
+        Returns a new database connection.
+
+        Args: self
+        Raises: psycopg2.OperationalError - once retries are exhausted
+        Returns:
+                object of type psycopg2 connection
+        '''
+        attempt = 0
+        while True:
+            started = time.time()
+            try:
+                connection = psycopg2.connect(self.dsn)
+                self.metrics.observe('tournament_connect_seconds',
+                                     time.time() - started)
+                return connection
+            except psycopg2.OperationalError as e:
+                self.metrics.count('tournament_errors_total',
+                                   error=type(e).__name__)
+                if self.retries is not None and attempt >= self.retries:
+                    raise
+                attempt += 1
+                self.metrics.count('tournament_connect_retries_total')
+                self.log.info('Cannot connect (%s). Retry %d in %ss',
+                              str(e).strip(), attempt, self.timer)
+                time.sleep(self.timer)
+
+    def healthy(self, connection, idle_since):
+        '''
+        Checks that an idle connection can still be used.
+        Connections idle for longer than check_interval get a round trip.
+
+        Args: self
+              connection - object of type psycopg2 connection
+              idle_since - object of type float
+        Raises:
+        Returns:
+                object of type boolean
+        '''
+        if connection.closed:
+            return False
+        if time.time() - idle_since < self.check_interval:
+            return True
+        try:
+            cursor = connection.cursor()
+            cursor.execute('SELECT 1;')
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        '''
+        Checks out a connection, waiting while the pool is saturated.
+        An idle connection is taken off the pool under the lock and
+        checked outside it, so a slow ping only holds up its own caller.
+
+        Args: self
+        Raises:
+                PoolTimeout - if timeout elapses without a free connection
+        Returns:
+                object of type psycopg2 connection
+        '''
+        started = time.time()
+        waited = False
+        while True:
+            connection = None
+            with self.lock:
+                while True:
+                    if self.idle:
+                        connection, idle_since = self.idle.pop()
+                        break
+                    if self.size < self.maxconn:
+                        self.size += 1
+                        self.checkedout(started, waited)
+                        break
+                    remaining = None
+                    if self.timeout is not None:
+                        remaining = self.timeout - (time.time() - started)
+                        if remaining <= 0:
+                            self.timeouts += 1
+                            raise PoolTimeout(
+                                'No free connection after %ss' %
+                                self.timeout)
+                    waited = True
+                    self.lock.wait(remaining)
+            if connection is None:
+                break
+            healthy = self.healthy(connection, idle_since)
+            with self.lock:
+                if healthy:
+                    self.checkedout(started, waited)
+                    return connection
+                self.discard(connection)
+        try:
+            return self.open_connection()
+        except Exception:
+            with self.lock:
+                self.size -= 1
+                self.lock.notify()
+            raise
+
+    def checkedout(self, started, waited):
+        '''
+        Updates checkout metrics. Must be called with the lock held.
+
+        Args: self
+              started - object of type float
+              waited - object of type boolean
+        Raises:
+        Returns: None
+        '''
+        elapsed = time.time() - started
+        self.checkouts += 1
+        if waited:
+            self.waits += 1
+        self.wait_time += elapsed
+        self.max_wait = max(self.max_wait, elapsed)
+        self.peak = max(self.peak, self.size - len(self.idle))
+
+    def discard(self, connection):
+        '''
+        Closes a broken connection and frees its slot.
+        Must be called with the lock held.
+
+        Args: self
+              connection - object of type psycopg2 connection
+        Raises:
+        Returns: None
+        '''
+        self.size -= 1
+        self.discarded += 1
+        self.statements.pop(connection, None)
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+        self.lock.notify()
+
+    def putconn(self, connection):
+        '''
+        Returns a connection to the pool, rolling back any open transaction
+
+        Args: self
+              connection - object of type psycopg2 connection
+        Raises:
+        Returns: None
+        '''
+        broken = bool(connection.closed)
+        if not broken:
+            status = connection.get_transaction_status()
+            if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    connection.rollback()
+                except psycopg2.Error:
+                    broken = True
+        with self.lock:
+            if broken:
+                self.discard(connection)
+            else:
+                self.idle.append((connection, time.time()))
+                self.lock.notify()
+
+    def prepared(self, connection):
+        '''
+        Returns the names of the statements prepared on a connection.
+        Prepared statements live as long as the server session, so the
+        set is only dropped when the connection is closed.
+
+        Args: self
+              connection - object of type psycopg2 connection
+        Raises:
+        Returns:
+                object of type set(string)
+        '''
+        with self.lock:
+            return self.statements.setdefault(connection, set())
+
+    @contextlib.contextmanager
+    def connection(self):
+        '''
+        Context manager for an explicit checkout/return of a connection
+
+        Args: self
+        Raises:
+                PoolTimeout - if timeout elapses without a free connection
+        Returns:
+                object of type psycopg2 connection
+        '''
+        connection = self.getconn()
+        try:
+            yield connection
+        finally:
+            self.putconn(connection)
+
+    def stats(self):
+        '''
+        Returns pool metrics
+
+        Args: self
+        Raises:
+        Returns:
+                object of type dictionary
+        '''
+        with self.lock:
+            in_use = self.size - len(self.idle)
+            return {
+                'size': self.size,
+                'idle': len(self.idle),
+                'in_use': in_use,
+                'maxconn': self.maxconn,
+                'saturation': float(in_use) / self.maxconn,
+                'peak': self.peak,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_time': self.wait_time,
+                'max_wait': self.max_wait,
+                'timeouts': self.timeouts,
+                'discarded': self.discarded}
+
+    def closeall(self):
+        '''
+        Closes all idle connections
+
+        Args: self
+        Raises:
+        Returns: None
+        '''
+        with self.lock:
+            while self.idle:
+                connection, idle_since = self.idle.pop()
+                self.size -= 1
+                self.statements.pop(connection, None)
+                connection.close()
+
+
+class cache(object):
+
+    def __init__(self, ttl=None):
+        '''
+        Creates an in-process read-through cache for query results.
+        Entries are keyed by (namespace, name), one namespace per
+        tournament. A write bumps the version of its namespace, which
+        drops the cached entries of that tournament only.
+
+        Args: self
+              ttl - object of type float/None, seconds an entry stays
+                    fresh (None keeps it until the next write)
+        Raises:
+        Returns:
+            self.entries - object of type dictionary
+            self.version - object of type integer, invalidations so far
+            self.versions - object of type dictionary, per namespace
+            self.resets - object of type integer, full invalidations
+            self.hits - object of type integer
+            self.misses - object of type integer
+        '''
+        self.ttl = ttl
+        self.entries = {}
+        self.version = 0
+        self.versions = {}
+        self.resets = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, loader, *args):
+        '''
+        Returns the cached value for key or loads and stores it.
+        None results are not cached, and a value loaded while a write
+        invalidated the cache is returned but not stored.
+
+        Args: self
+              key - object of type tuple(namespace, name)
+              loader - callable returning the value
+              args - arguments for loader
+        Raises:
+        Returns:
+                object of any type
+        '''
+        with self.lock:
+            entry = self.entries.get(key)
+            version = (self.resets, self.versions.get(key[0], 0))
+            if entry is not None and (
+                    entry[0] is None or entry[0] > time.time()):
+                self.hits += 1
+                return self.copy(entry[1])
+            self.misses += 1
+        value = loader(*args)
+        if value is not None:
+            expires = None
+            if self.ttl is not None:
+                expires = time.time() + self.ttl
+            with self.lock:
+                if version == (self.resets,
+                               self.versions.get(key[0], 0)):
+                    self.entries[key] = (expires, value)
+        return self.copy(value)
+
+    def copy(self, value):
+        '''
+        Returns a shallow copy of lists so callers cannot alter the cache
+
+        Args: self
+              value - object of any type
+        Raises:
+        Returns:
+                object of any type
+        '''
+        if isinstance(value, list):
+            return list(value)
+        return value
+
+    def invalidate(self, namespace=None):
+        '''
+        Drops the entries of a namespace, called by all write paths
+
+        Args: self
+              namespace - object of any type, None drops every entry
+        Raises:
+        Returns: None
+        '''
+        with self.lock:
+            self.version += 1
+            if namespace is None:
+                self.resets += 1
+                self.entries = {}
+                return
+            self.versions[namespace] = self.versions.get(namespace, 0) + 1
+            for key in list(self.entries):
+                if key[0] == namespace:
+                    del self.entries[key]
+
+    def stats(self):
+        '''
+        Returns cache metrics
+
+        Args: self
+        Raises:
+        Returns:
+                object of type dictionary
+        '''
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'version': self.version,
+                'hits': self.hits,
+                'misses': self.misses}
+
+
+def shared_pool(**kwargs):
+    '''
+    Returns the pool shared by every db instance, creating it on first use.
+    Keyword arguments are passed to pool() and only apply on creation.
+
+    Args: key arguments
+    Raises:
+    Returns:
+            pool class instance
+    '''
+    with shared_lock:
+        if shared['pool'] is None:
+            shared['pool'] = pool(**kwargs)
+            shared_metrics().collect('tournament_pool',
+                                     shared['pool'].stats)
+        return shared['pool']
+
+
+def shared_cache(**kwargs):
+    '''
+    Returns the cache shared by every db instance, creating it on first use.
+    Keyword arguments are passed to cache() and only apply on creation.
+
+    Args: key arguments
+    Raises:
+    Returns:
+            cache class instance
+    '''
+    with shared_lock:
+        if shared['cache'] is None:
+            shared['cache'] = cache(**kwargs)
+            shared_metrics().collect('tournament_cache',
+                                     shared['cache'].stats)
+        return shared['cache']
+
+
+def copy_rows(rows):
+    '''
+    Encodes rows in the text format of COPY FROM STDIN
+
+    Args: rows - object of type iterable(tuple), None is NULL, or
+                 object of type list(string), lines already encoded
+    Raises:
+    Returns:
+            object of type io.BytesIO
+    '''
+    def field(value):
+        if value is None:
+            return '\\N'
+        if not hasattr(value, 'replace'):
+            return str(value)
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace(
+            '\n', '\\n').replace('\r', '\\r')
+    if isinstance(rows, list):
+        text = '\n'.join(rows) + '\n' if rows else ''
+    else:
+        text = ''.join('\t'.join(field(value) for value in row) + '\n'
+                       for row in rows)
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return io.BytesIO(text)
+
+
+class db(store):
+
+    def __init__(self, connections=None, results=None, tournament=1,
+                 registry=None, rating=None):
+        '''
+        Declares the statements of the backend. Each one is prepared on
+        the server the first time it runs on a pooled connection and
+        executed by name from then on.
+
+        Args: self
+              connections - pool class instance, defaults to shared_pool()
+              results - cache class instance, defaults to shared_cache()
+              tournament - object of type integer, the tournament all
+                           statements are scoped to
+              registry - metrics class instance, defaults to
+                         shared_metrics()
+              rating - elo or glicko2 class instance/None, rates every
+                       reported match when given
+        Raises:
+        Returns:
+            self.tournament - object of type integer
+            self.rating - elo or glicko2 class instance/None
+            self.statements - object of type dictionary(name,
+                              (parameter types, statement))
+            self.executes - object of type dictionary(name, string)
+            self.analyze_rows - object of type integer, bulk writes of
+                                at least that many rows refresh the
+                                planner statistics
+            self.streams - object of type dictionary(name, string),
+                           statements read through server-side cursors,
+                           which cannot run prepared statements
+            self.copies - object of type dictionary(name, string), COPY
+                          statements of snapshot exports and imports
+            self.log - logger class instance
+            self.pool - pool class instance
+            self.cache - cache class instance
+        '''
+        self.tournament = tournament
+        self.rating = rating
+        self.statements = {
+            'insert_tournament': (
+                ('text', ),
+                'INSERT INTO tournaments (name) VALUES ($1) RETURNING id'),
+            'remove_tournament': (
+                ('integer', ),
+                'DELETE FROM tournaments WHERE id = $1'),
+            'tournaments': (
+                (),
+                'SELECT id, name FROM tournaments ORDER BY id'),
+            'tournament_name': (
+                ('integer', ),
+                'SELECT name FROM tournaments WHERE id = $1'),
+            'clear_scores': (
+                ('integer', ),
+                'DELETE FROM scores WHERE tournament = $1'),
+            'rebuild_scores': (
+                ('integer', ),
+                'INSERT INTO scores (player, tournament, wins, matches, '
+                'draws, points, games_won, games_played) '
+                'SELECT players.id, players.tournament, '
+                'COALESCE(games.wins, 0), COALESCE(games.matches, 0), '
+                'COALESCE(games.draws, 0), COALESCE(games.points, 0), '
+                'COALESCE(games.won, 0), COALESCE(games.played, 0) '
+                'FROM players LEFT JOIN (SELECT player, '
+                'sum(won)::integer AS wins, count(*)::integer AS matches, '
+                'sum(drawn)::integer AS draws, '
+                'sum(points)::integer AS points, '
+                'sum(games_won)::integer AS won, '
+                'sum(games_played)::integer AS played '
+                'FROM (SELECT winner AS player, (NOT draw)::integer AS won, '
+                'draw::integer AS drawn, '
+                'CASE WHEN draw THEN 1 ELSE 3 END AS points, '
+                'COALESCE(winner_games, 0) AS games_won, '
+                'COALESCE(winner_games + loser_games, 0) AS games_played '
+                'FROM matches WHERE tournament = $1 UNION ALL '
+                'SELECT loser, 0, draw::integer, draw::integer, '
+                'COALESCE(loser_games, 0), '
+                'COALESCE(winner_games + loser_games, 0) '
+                'FROM matches WHERE tournament = $1 AND loser IS NOT NULL) '
+                'AS sides GROUP BY player) AS games '
+                'ON games.player = players.id WHERE players.tournament = $1'),
+            'insert_name': (
+                ('text', 'integer'),
+                'INSERT INTO players (name, tournament) VALUES ($1, $2)'),
+            'reserve_ids': (
+                ('integer', ),
+                'SELECT nextval(\'players_id_seq\') '
+                'FROM generate_series(1, $1)'),
+            'insert_names': (
+                ('integer[]', 'text[]', 'integer'),
+                'INSERT INTO players (id, name, tournament) '
+                'SELECT unnest($1), unnest($2), $3'),
+            'addmatch': (
+                ('integer', 'integer', 'integer', 'integer', 'boolean',
+                 'smallint', 'smallint'),
+                'INSERT INTO matches (tournament, winner, loser, round, '
+                'draw, winner_games, loser_games) '
+                'VALUES ($1, $2, $3, $4, $5, $6, $7)'),
+            'addmatches': (
+                ('integer', 'integer[]', 'integer[]', 'integer',
+                 'boolean[]', 'smallint[]', 'smallint[]'),
+                'INSERT INTO matches (tournament, winner, loser, round, '
+                'draw, winner_games, loser_games) '
+                'SELECT $1, pairs.winner, pairs.loser, '
+                'COALESCE($4, GREATEST(won.matches, lost.matches) + 1), '
+                'pairs.draw, pairs.winner_games, pairs.loser_games '
+                'FROM (SELECT unnest($2) AS winner, unnest($3) AS loser, '
+                'unnest($5) AS draw, unnest($6) AS winner_games, '
+                'unnest($7) AS loser_games) AS pairs '
+                'JOIN scores AS won ON won.player = pairs.winner '
+                'LEFT JOIN scores AS lost ON lost.player = pairs.loser'),
+            'known': (
+                ('integer', 'integer[]'),
+                'SELECT count(*) FROM players '
+                'WHERE tournament = $1 AND id = ANY($2)'),
+            'counter': (
+                ('integer', ),
+                'SELECT count(*) FROM players WHERE tournament = $1'),
+            'remove_players': (
+                ('integer', ),
+                'DELETE FROM players WHERE tournament = $1'),
+            'remove_matches': (
+                ('integer', ),
+                'DELETE FROM matches WHERE tournament = $1'),
+            'reset_scores': (
+                ('integer', ),
+                'UPDATE scores SET wins = 0, matches = 0, draws = 0, '
+                'points = 0, games_won = 0, games_played = 0 '
+                'WHERE tournament = $1'),
+            'standings': (
+                ('integer', ),
+                'SELECT id, name, wins, matches FROM standings '
+                'WHERE tournament = $1 ORDER BY points DESC, id'),
+            'points': (
+                ('integer', ),
+                'SELECT id, name, points, wins, draws, matches, games_won, '
+                'games_played FROM standings WHERE tournament = $1 '
+                'ORDER BY points DESC, id'),
+            'tiebreaks': (
+                ('integer', ),
+                'SELECT id, name, wins, matches, buchholz, '
+                'sonneborn_berger, omw FROM tiebreaks WHERE tournament = $1 '
+                'ORDER BY points DESC, buchholz DESC, '
+                'sonneborn_berger DESC, omw DESC, id'),
+            'standings_top': (
+                ('integer', 'integer'),
+                'SELECT id, name, wins, matches FROM standings '
+                'WHERE tournament = $1 ORDER BY points DESC, id LIMIT $2'),
+            'standings_after': (
+                ('integer', 'integer', 'integer'),
+                'SELECT players.id, players.name, page.wins, page.matches '
+                'FROM ((SELECT player, points, wins, matches FROM scores '
+                'WHERE tournament = $1 AND points = (SELECT points '
+                'FROM scores WHERE player = $2) AND player > $2 '
+                'ORDER BY player LIMIT $3) UNION ALL '
+                '(SELECT player, points, wins, matches FROM scores '
+                'WHERE tournament = $1 AND points < (SELECT points '
+                'FROM scores WHERE player = $2) '
+                'ORDER BY points DESC, player LIMIT $3)) AS page '
+                'JOIN players ON players.id = page.player '
+                'ORDER BY page.points DESC, page.player LIMIT $3'),
+            'history': (
+                ('integer', ),
+                'SELECT winner, loser FROM matches WHERE tournament = $1'),
+            'opponents': (
+                ('integer', 'integer'),
+                'SELECT round, loser, NOT draw FROM matches '
+                'WHERE winner = $1 AND tournament = $2 UNION ALL '
+                'SELECT round, winner, FALSE FROM matches '
+                'WHERE loser = $1 AND tournament = $2 ORDER BY 1, 2'),
+            'met': (
+                ('integer', 'integer'),
+                'SELECT EXISTS (SELECT 1 FROM matches '
+                'WHERE winner = $1 AND loser = $2) OR EXISTS (SELECT 1 '
+                'FROM matches WHERE winner = $2 AND loser = $1)'),
+            'round_results': (
+                ('integer', 'integer'),
+                'SELECT winner, loser FROM matches '
+                'WHERE tournament = $1 AND round = $2 ORDER BY id'),
+            'ratings_of': (
+                ('integer', 'integer[]'),
+                'SELECT player, rating, deviation, volatility, games '
+                'FROM ratings WHERE tournament = $1 AND player = ANY($2) '
+                'FOR UPDATE'),
+            'remove_ratings': (
+                ('integer[]', ),
+                'DELETE FROM ratings WHERE player = ANY($1)'),
+            'insert_ratings': (
+                ('integer', 'integer[]', 'double precision[]',
+                 'double precision[]', 'double precision[]', 'integer[]'),
+                'INSERT INTO ratings (tournament, player, rating, '
+                'deviation, volatility, games) SELECT $1, unnest($2), '
+                'unnest($3), unnest($4), unnest($5), unnest($6)'),
+            'clear_ratings': (
+                ('integer', ),
+                'DELETE FROM ratings WHERE tournament = $1'),
+            'report_lock': (
+                ('integer', ),
+                "SELECT pg_advisory_xact_lock_shared("
+                "'matches'::regclass::integer, $1)"),
+            'replay_lock': (
+                ('integer', ),
+                "SELECT pg_advisory_xact_lock("
+                "'matches'::regclass::integer, $1)"),
+            'ratings': (
+                ('integer', 'double precision', 'double precision',
+                 'double precision'),
+                'SELECT players.id, players.name, '
+                'COALESCE(ratings.rating, $2) AS rating, '
+                'COALESCE(ratings.deviation, $3), '
+                'COALESCE(ratings.volatility, $4), '
+                'COALESCE(ratings.games, 0) FROM players '
+                'LEFT JOIN ratings ON ratings.player = players.id '
+                'WHERE players.tournament = $1 '
+                'ORDER BY rating DESC, players.id')}
+        self.streams = {
+            'standings': ('SELECT id, name, wins, matches FROM standings '
+                          'WHERE tournament = %s ORDER BY points DESC, id;'),
+            'history': ('SELECT winner, loser FROM matches '
+                        'WHERE tournament = %s;'),
+            'replay': ('SELECT winner, loser, draw FROM matches '
+                       'WHERE tournament = %s ORDER BY id;'),
+            'export_players': ('SELECT players.id, players.name, '
+                               'scores.wins, scores.matches FROM players '
+                               'JOIN scores ON scores.player = players.id '
+                               'WHERE players.tournament = %s '
+                               'ORDER BY players.id;')}
+        self.copies = {
+            'export_matches': ('COPY (SELECT winner, COALESCE(loser, 0), '
+                               'round, extract(epoch FROM created), '
+                               'draw::integer, '
+                               'COALESCE(winner_games, -1), '
+                               'COALESCE(loser_games, -1) '
+                               'FROM matches WHERE tournament = %s '
+                               'ORDER BY id) TO STDOUT;'),
+            'import_players': ('COPY players (id, name, tournament) '
+                               'FROM STDIN;'),
+            'import_matches': ('COPY matches (tournament, winner, loser, '
+                               'round, created, draw, winner_games, '
+                               'loser_games) FROM STDIN;')}
+        self.executes = {}
+        for name, (types, statement) in self.statements.items():
+            casts = ', '.join('%%s::%s' % kind for kind in types)
+            self.executes[name] = 'EXECUTE tournament_%s%s;' % (
+                name, casts and ' (%s)' % casts)
+        self.analyze_rows = 10000
+        self.log = logger()
+        self.pool = connections or shared_pool()
+        self.cache = results or shared_cache()
+        self.metrics = registry or shared_metrics()
+
+    def execute(self, cursor, name, params=None):
+        '''
+        Executes a statement by name, preparing it first if the
+        connection of cursor has not seen it yet
+
+        Args: self
+              cursor - object of type psycopg2 cursor
+              name - object of type string, a key of self.statements
+              params - object of type tuple/None
+        Raises: psycopg2.Error
+        Returns: None
+        '''
+        prepared = self.pool.prepared(cursor.connection)
+        if name not in prepared:
+            types, statement = self.statements[name]
+            types = ', '.join(types)
+            cursor.execute('PREPARE tournament_%s%s AS %s;' % (
+                name, types and ' (%s)' % types, statement))
+            prepared.add(name)
+        started = time.time()
+        cursor.execute(self.executes[name], params)
+        self.metrics.observe('tournament_query_seconds',
+                             time.time() - started, statement=name)
+        if cursor.rowcount > 0:
+            self.metrics.count('tournament_query_rows_total',
+                               cursor.rowcount, statement=name)
+
+    def failed(self, error):
+        '''
+        Logs and counts an error that is reported to the caller as None
+
+        Args: self
+              error - object of type Exception
+        Raises:
+        Returns: None
+        '''
+        self.metrics.count('tournament_errors_total',
+                           error=type(error).__name__)
+        self.log.exception(error)
+
+    @instrumented
+    def registerTournament(self, name):
+        '''
+        Insert a new tournament into tournaments table
+
+        Args: self
+              name - object of type string
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type integer
+                object of type None
+        '''
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                self.execute(cursor, 'insert_tournament', (name, ))
+                tournament = cursor.fetchone()[0]
+                connection.commit()
+                return tournament
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    @instrumented
+    def deleteTournament(self, tournament):
+        '''
+        Removes a tournament with its players and matches
+
+        Args: self
+              tournament - object of type integer
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type string
+                object of type None
+        '''
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                self.execute(cursor, 'remove_tournament', (tournament, ))
+                connection.commit()
+                self.cache.invalidate(tournament)
+                return 'OK'
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    @instrumented
+    def listTournaments(self):
+        '''
+        Returns all tournaments
+
+        Args: self
+        Raises:
+        Returns:
+                object of type list((id, name))
+                object of type None
+        '''
+        return self.select('tournaments')
+
+    @instrumented
+    def exportTournament(self, tournament, batch=10000):
+        '''
+        Reads a tournament from one snapshot of the database: players
+        through a server-side cursor, matches through COPY
+
+        Args: self
+              tournament - object of type integer
+              batch - object of type integer, rows per round trip
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                snapshot class instance
+                object of type None
+        '''
+        params = (tournament, )
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL '
+                               'REPEATABLE READ READ ONLY;')
+                self.execute(cursor, 'tournament_name', params)
+                row = cursor.fetchone()
+                if row is None:
+                    connection.rollback()
+                    self.log.info('Unknown tournament %s', tournament)
+                    return None
+                players = list(self.stream(connection, 'export_players',
+                                           params, batch))
+                matches = io.BytesIO()
+                cursor.copy_expert(cursor.mogrify(
+                    self.copies['export_matches'], params), matches)
+                connection.commit()
+        except Exception as e:
+            self.failed(e)
+            return None
+        values = matches.getvalue().split()
+        return snapshot(row[0], [player[0] for player in players],
+                        [player[1] for player in players],
+                        [player[2] for player in players],
+                        [player[3] for player in players],
+                        [int(value) for value in values[0::7]],
+                        [int(value) for value in values[1::7]],
+                        [int(value) for value in values[2::7]],
+                        [float(value) for value in values[3::7]],
+                        [int(value) for value in values[4::7]],
+                        [int(value) for value in values[5::7]],
+                        [int(value) for value in values[6::7]])
+
+    @instrumented
+    def importTournament(self, data):
+        '''
+        Stores a snapshot as a new tournament with new player ids in one
+        transaction. Players and matches are bulk loaded with COPY, with
+        every trigger and foreign key of the shared tables left on, so
+        other tournaments are not locked. The new players' scores rows
+        are deleted before the matches are loaded, which turns the per
+        match score updates into index probes that find nothing, and
+        then rebuilt from the tournament's matches with one statement.
+
+        Args: self
+              data - snapshot class instance
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type integer
+                object of type None
+        '''
+        started = time.time()
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                self.execute(cursor, 'insert_tournament', (data.name, ))
+                tournament = cursor.fetchone()[0]
+                self.execute(cursor, 'reserve_ids', (len(data.ids), ))
+                ids = [row[0] for row in cursor.fetchall()]
+                cursor.copy_expert(self.copies['import_players'], copy_rows(
+                    (uid, name, tournament)
+                    for uid, name in zip(ids, data.names)))
+                self.execute(cursor, 'clear_scores', (tournament, ))
+                renamed = dict(zip(data.ids, [str(uid) for uid in ids]))
+                renamed[0] = '\\N'
+                prefix = '%d\t' % tournament
+                times = {0.0: 'now'}
+                for created in set(data.created):
+                    if created not in times:
+                        seconds, micros = divmod(int(round(created * 1e6)),
+                                                 1000000)
+                        times[created] = '%s.%06d+00' % (time.strftime(
+                            '%Y-%m-%d %H:%M:%S', time.gmtime(seconds)), micros)
+                games = dict((count, str(count)) for count in set(
+                    data.winner_games).union(data.loser_games))
+                games[-1] = '\\N'
+                lines = ['%s%s\t%s\t%d\t%s\t%s\t%s\t%s' % (
+                    prefix, renamed[winner], renamed[loser], number,
+                    times[created], 't' if draw else 'f',
+                    games[winner_games], games[loser_games])
+                    for winner, loser, number, created, draw, winner_games,
+                    loser_games in zip(
+                        data.winners, data.losers, data.rounds,
+                        data.created, data.draws, data.winner_games,
+                        data.loser_games)]
+                cursor.copy_expert(self.copies['import_matches'],
+                                   copy_rows(lines))
+                self.execute(cursor, 'rebuild_scores', (tournament, ))
+                connection.commit()
+        except Exception as e:
+            self.failed(e)
+            return None
+        self.log.info('Tournament %s imported as %s in %.3fs', data.name,
+                      tournament, time.time() - started)
+        if len(data.winners) + len(ids) >= self.analyze_rows:
+            self.analyze('players', 'matches', 'scores')
+        return tournament
+
+    @instrumented
+    def deletePlayers(self):
+        '''
+        Deletes the players of the tournament, their matches and scores
+        go with them. Other tournaments are not locked.
+
+        Args: self
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type string
+                object of type None
+        '''
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                self.execute(cursor, 'remove_players', (self.tournament, ))
+                connection.commit()
+                self.cache.invalidate(self.tournament)
+                self.execute(cursor, 'counter', (self.tournament, ))
+                if cursor.fetchone()[0] == 0:
+                    return 'OK'
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    @instrumented
+    def countPlayers(self):
+        '''
+        Counter entries in players table, served from the cache
+
+        Args: self
+        Raises:
+        Returns:
+                object of type integer
+                object of type None
+        '''
+        return self.cache.get((self.tournament, 'count'), self.count_rows)
+
+    def count_rows(self):
+        '''
+        Counter entries in players table
+
+        Args: self
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type integer
+                object of type None
+        '''
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                self.execute(cursor, 'counter', (self.tournament, ))
+                return cursor.fetchone()[0]
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    @instrumented
+    def registerPlayer(self, name):
+        '''
+        Insert player details into players table
+
+        Args: self
+              name - object of type string
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type string
+                object of type None
+        '''
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                self.execute(cursor, 'insert_name', (name, self.tournament))
+                connection.commit()
+                self.cache.invalidate(self.tournament)
+                return 'OK'
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    @instrumented
+    def registerPlayers(self, names, batch=1000):
+        '''
+        Insert many players into players table in a single transaction.
+        Ids are reserved from the sequence per batch, so they come back
+        in input order, and each batch is one multi-row INSERT.
+
+        Args: self
+              names - object of type iterable(string)
+              batch - object of type integer, rows per INSERT statement
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type list(integer)
+                object of type None
+        '''
+        started = time.time()
+        ids = []
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                chunk = []
+                for name in names:
+                    chunk.append(name)
+                    if len(chunk) == batch:
+                        ids.extend(self.insert_batch(cursor, chunk))
+                        chunk = []
+                if chunk:
+                    ids.extend(self.insert_batch(cursor, chunk))
+                connection.commit()
+                self.cache.invalidate(self.tournament)
+        except Exception as e:
+            self.failed(e)
+            return None
+        elapsed = max(time.time() - started, 1e-9)
+        self.log.info('%d players registered in %.3fs (%.0f players/s)',
+                      len(ids), elapsed, len(ids) / elapsed)
+        if len(ids) >= self.analyze_rows:
+            self.analyze('players', 'scores')
+        return ids
+
+    def analyze(self, *tables):
+        '''
+        Refreshes the planner statistics of tables after a bulk write.
+        Until autovacuum catches up, a new tournament looks empty to the
+        planner, and the plans it picks for 100k players take minutes.
+
+        Args: self
+              tables - object of type string, table names
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns: None
+        '''
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute('ANALYZE %s;' % ', '.join(tables))
+                connection.commit()
+        except Exception as e:
+            self.failed(e)
+
+    def insert_batch(self, cursor, names):
+        '''
+        Reserves ids for names and inserts them with one statement
+
+        Args: self
+              cursor - object of type psycopg2 cursor
+              names - object of type list(string)
+        Raises: psycopg2.Error
+        Returns:
+                object of type list(integer)
+        '''
+        self.execute(cursor, 'reserve_ids', (len(names), ))
+        ids = [row[0] for row in cursor.fetchall()]
+        self.execute(cursor, 'insert_names', (ids, names, self.tournament))
+        return ids
+
+    @instrumented
+    def deleteMatches(self):
+        '''
+        Removes all matches entires of the tournament and resets its
+        scores in one transaction
+
+        Args: self
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type string
+                object of type None
+        '''
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                self.execute(cursor, 'remove_matches', (self.tournament, ))
+                self.execute(cursor, 'reset_scores', (self.tournament, ))
+                self.execute(cursor, 'clear_ratings', (self.tournament, ))
+                connection.commit()
+                self.cache.invalidate(self.tournament)
+                return 'OK'
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    @instrumented
+    def playerStandings(self, tiebreaks=False):
+        '''
+        Returns current standings, served from the cache. Tiebreaks are
+        computed by the tiebreaks view in one pass over the matches and
+        cached until the next report.
+
+        Args: self
+              tiebreaks - object of type boolean, adds the buchholz,
+                          sonneborn_berger and omw columns
+        Raises:
+        Returns:
+                object of type list
+                object of type None
+        '''
+        name = 'tiebreaks' if tiebreaks else 'standings'
+        return self.cache.get((self.tournament, name), self.select,
+                              name, (self.tournament, ))
+
+    @instrumented
+    def pointStandings(self):
+        '''
+        Returns the match points and game counts of every player, read
+        from the counters the score trigger keeps and served from the
+        cache
+
+        Args: self
+        Raises:
+        Returns:
+                object of type list((id, name, points, wins, draws,
+                                     matches, games_won, games_played))
+                object of type None
+        '''
+        return self.cache.get((self.tournament, 'points'), self.select,
+                              'points', (self.tournament, ))
+
+    def select(self, name, params=None):
+        '''
+        Returns all rows of a prepared statement
+
+        Args: self
+              name - object of type string, a key of self.statements
+              params - object of type tuple/None
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type list
+                object of type None
+        '''
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                self.execute(cursor, name, params)
+                return cursor.fetchall()
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    def iterStandings(self, batch=1000):
+        '''
+        Yields the standings through a named server-side cursor, so only
+        batch rows are held in memory at a time. The connection is
+        checked out until the generator is exhausted or closed.
+
+        Args: self
+              batch - object of type integer, rows per round trip
+        Raises:
+                psycopg2.Error - logged and raised again, so standings
+                                 cut short by an error never look complete
+        Returns:
+                object of type generator((id, name, wins, matches))
+        '''
+        try:
+            with self.pool.connection() as connection:
+                for row in self.stream(connection, 'standings',
+                                       (self.tournament, ), batch):
+                    yield row
+        except Exception as e:
+            self.failed(e)
+            raise
+
+    def stream(self, connection, name, params, batch):
+        '''
+        Yields the rows of a statement through a named cursor
+
+        Args: self
+              connection - object of type psycopg2 connection
+              name - object of type string, a key of self.streams
+              params - object of type tuple
+              batch - object of type integer, rows per round trip
+        Raises: psycopg2.Error
+        Returns:
+                object of type generator(tuple)
+        '''
+        cursor = connection.cursor(name='tournament_%s' % name)
+        cursor.itersize = batch
+        cursor.execute(self.streams[name], params)
+        rows = 0
+        for row in cursor:
+            rows += 1
+            yield row
+        cursor.close()
+        self.metrics.count('tournament_query_rows_total', rows,
+                           statement='stream_%s' % name)
+
+    @instrumented
+    def standingsPage(self, limit, after=None):
+        '''
+        Returns one page of the standings with keyset pagination. The
+        rest of the row's score group and the lower score groups are two
+        ranges of scores_points_idx, so deep pages cost the same as the
+        first one. The score group is the one after's player is in.
+
+        Args: self
+              limit - object of type integer, rows per page
+              after - object of type tuple(id, name, wins, matches)/None,
+                      the last row of the previous page
+        Raises:
+        Returns:
+                object of type list((id, name, wins, matches))
+                object of type None
+        '''
+        if after is None:
+            return self.select('standings_top', (self.tournament, limit))
+        return self.select('standings_after', (
+            self.tournament, after[0], limit))
+
+    @instrumented
+    def get_pairings(self):
+        '''
+        Returns formatted list with player pairings, served from the cache
+
+        Args: self
+        Raises:
+        Returns:
+                object of type list
+                object of type None
+        '''
+        return self.cache.get((self.tournament, 'pairings'),
+                              self.load_pairings)
+
+    def load_pairings(self, batch=1000):
+        '''
+        Pairs the current standings with the swiss engine. Standings and
+        history are streamed from one snapshot, so the engine only keeps
+        what it needs instead of two fetched result lists.
+
+        Args: self
+              batch - object of type integer, rows per round trip
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type list
+                object of type None
+        '''
+        params = (self.tournament, )
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL '
+                               'REPEATABLE READ READ ONLY;')
+                return swiss(
+                    self.stream(connection, 'standings', params, batch),
+                    self.stream(connection, 'history', params, batch)).pair()
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    @instrumented
+    def reportMatch(self, winner, loser=None, round=None):
+        '''
+        Sets match score
+
+        Args: self
+              winner - object of type integer
+              loser - object of type integer/None, None records a bye
+              round - object of type integer/None, None numbers the
+                      match after the players' previous matches
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type string
+                object of type None
+        '''
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                self.execute(cursor, 'report_lock', (self.tournament, ))
+                self.execute(cursor, 'addmatch', (
+                    self.tournament, winner, loser, round, False, None,
+                    None))
+                self.rate(cursor, [(winner, loser)])
+                connection.commit()
+                self.cache.invalidate(self.tournament)
+            self.log.info('Match between %s and %s was succefully stored',
+                          winner, loser)
+            return 'OK'
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    @instrumented
+    def reportMatches(self, uids, round=None):
+        '''
+        Stores a whole round of match results atomically.
+        Every pair is validated first; one invalid pair or unknown
+        player means nothing is written. Draws and game scores go into
+        the same statement as the winners and losers, and the score
+        trigger adds up the match points.
+
+        Args: self
+              uids - object of type list(list(winner, loser)), a None
+                     loser is a bye, or list(list(player1, player2,
+                     games1, games2)), see validate_round
+              round - object of type integer/None, None numbers each
+                      match after its players' previous matches
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type string
+                object of type None
+        '''
+        pairs, seen = self.validate_round(uids)
+        if pairs is None:
+            return None
+        if not pairs:
+            return 'OK'
+        winners, losers, winner_games, loser_games, draws = [
+            list(column) for column in zip(*pairs)]
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                self.execute(cursor, 'known', (self.tournament, list(seen)))
+                if cursor.fetchone()[0] != len(seen):
+                    self.log.info('Invalid round, unknown players')
+                    return None
+                self.execute(cursor, 'report_lock', (self.tournament, ))
+                self.execute(cursor, 'addmatches', (
+                    self.tournament, winners, losers, round, draws,
+                    winner_games, loser_games))
+                self.rate(cursor, zip(winners, losers, draws))
+                connection.commit()
+                self.cache.invalidate(self.tournament)
+            self.log.info('%d matches were succefully stored', len(pairs))
+            if len(pairs) >= self.analyze_rows:
+                self.analyze('matches', 'scores', 'ratings')
+            return 'OK'
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    @instrumented
+    def opponentHistory(self, player):
+        '''
+        Returns the matches of a player from the two composite indexes
+        of matches, without reading any other player's matches
+
+        Args: self
+              player - object of type integer
+        Raises:
+        Returns:
+                object of type list((round, opponent, won))
+                object of type None
+        '''
+        return self.select('opponents', (player, self.tournament))
+
+    @instrumented
+    def havePlayed(self, player1, player2):
+        '''
+        Tells whether two players already met, with two index lookups
+
+        Args: self
+              player1 - object of type integer
+              player2 - object of type integer
+        Raises:
+        Returns:
+                object of type boolean
+                object of type None
+        '''
+        rows = self.select('met', (player1, player2))
+        return None if rows is None else rows[0][0]
+
+    @instrumented
+    def roundResults(self, round):
+        '''
+        Returns the matches of one round, in the order they were stored
+
+        Args: self
+              round - object of type integer
+        Raises:
+        Returns:
+                object of type list((winner, loser))
+                object of type None
+        '''
+        return self.select('round_results', (self.tournament, round))
+
+    def rate(self, cursor, pairs):
+        '''
+        Updates the ratings of the players of pairs in the transaction
+        of cursor: their rows are locked and read in one statement, the
+        engine rates the whole round on arrays and the new rows replace
+        the old ones in bulk. Does nothing without a rating engine.
+
+        Args: self
+              cursor - object of type psycopg2 cursor
+              pairs - object of type iterable((winner, loser[, draw])),
+                      a None loser is a bye and is not rated
+        Raises: psycopg2.Error
+        Returns: None
+        '''
+        if self.rating is None:
+            return
+
+        def start(ids):
+            state = self.rating.initial_state(len(ids))
+            self.execute(cursor, 'ratings_of',
+                         (self.tournament, ids.tolist()))
+            for row in cursor.fetchall():
+                state[numpy.searchsorted(ids, row[0])] = row[1:]
+            return state
+        ids, state = replay(self.rating, pairs, start)
+        if len(ids):
+            self.execute(cursor, 'remove_ratings', (ids.tolist(), ))
+            self.store_ratings(cursor, ids, state)
+
+    def store_ratings(self, cursor, ids, state):
+        '''
+        Inserts the ratings of ids in one statement
+
+        Args: self
+              cursor - object of type psycopg2 cursor
+              ids - object of type numpy.ndarray(id)
+              state - object of type numpy.ndarray(n, 4)
+        Raises: psycopg2.Error
+        Returns: None
+        '''
+        self.execute(cursor, 'insert_ratings', (
+            self.tournament, ids.tolist(), state[:, 0].tolist(),
+            state[:, 1].tolist(), state[:, 2].tolist(),
+            state[:, 3].astype(int).tolist()))
+
+    @instrumented
+    def playerRatings(self):
+        '''
+        Returns the ratings of every player, served from the cache
+
+        Args: self
+        Raises:
+        Returns:
+                object of type list
+                object of type None
+        '''
+        if self.rating is None:
+            self.log.info('No rating engine configured')
+            return None
+        initial = self.rating.initial_state(1)[0]
+        return self.cache.get(
+            (self.tournament, 'ratings'), self.select, 'ratings',
+            (self.tournament, ) + tuple(initial[:3].tolist()))
+
+    @instrumented
+    def recomputeRatings(self, batch=10000):
+        '''
+        Replays every match of the tournament in playing order and
+        replaces all of its ratings. The matches are streamed under a
+        transaction level advisory lock on the tournament, which
+        reportMatch and reportMatches take shared, so new reports of
+        this tournament wait and the other tournaments are not held up.
+
+        Args: self
+              batch - object of type integer, rows per round trip
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type integer, number of rated players
+                object of type None
+        '''
+        if self.rating is None:
+            self.log.info('No rating engine configured')
+            return None
+        params = (self.tournament, )
+        try:
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                self.execute(cursor, 'replay_lock', params)
+                ids, state = replay(self.rating, self.stream(
+                    connection, 'replay', params, batch))
+                self.execute(cursor, 'clear_ratings', params)
+                if len(ids):
+                    self.store_ratings(cursor, ids, state)
+                connection.commit()
+                self.cache.invalidate(self.tournament)
+            self.log.info('Ratings of %d players recomputed', len(ids))
+            if len(ids) >= self.analyze_rows:
+                self.analyze('ratings')
+            return len(ids)
+        except Exception as e:
+            self.failed(e)
+            return None
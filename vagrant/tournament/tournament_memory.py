@@ -0,0 +1,872 @@
+#!/usr/bin/env python
+#
+# tournament_memory.py -- in-memory backend of tournament.py
+#
+
+import time
+import threading
+import array
+import heapq
+from tournament_metrics import logger, shared, shared_lock
+from tournament_swiss import swiss
+from tournament_ratings import numpy, replay
+from tournament_snapshot import snapshot
+from tournament_store import store
+
+
+class standings_arrays(object):
+
+    def __init__(self):
+        '''
+        Compact state of one tournament: parallel arrays indexed by the
+        player's position plus a set of the pairs that already met
+
+        Args: self
+        Raises:
+        Returns:
+            self.ids - object of type array(integer)
+            self.names - object of type list(string)
+            self.wins - object of type array(integer)
+            self.played - object of type array(integer)
+            self.draws - object of type array(integer)
+            self.points - object of type array(integer), 3 for a win or
+                          a bye, 1 for a draw
+            self.games_won - object of type array(integer)
+            self.games_played - object of type array(integer)
+            self.position - object of type dictionary(id, position)
+            self.matches - object of type list((winner, loser))
+            self.rounds - object of type array(integer), round of each
+                          match
+            self.created - object of type array(float), time of each
+                           match
+            self.drawn - object of type array(integer), 1 for each
+                         drawn match
+            self.winner_games, self.loser_games - object of type
+                                                  array(integer), games
+                                                  won in each match, -1
+                                                  if unknown
+            self.games - object of type dictionary(id, list(match)),
+                         positions in self.matches of a player's matches
+            self.met - object of type set((id, id))
+            self.version - object of type integer, bumped on every change
+            self.computed - object of type tuple(version, tiebreaks)/None
+            self.ratings - object of type numpy.ndarray(n, 4)/None,
+                           indexed by position, None before the first
+                           rated match
+        '''
+        self.ids = array.array('l')
+        self.names = []
+        self.wins = array.array('l')
+        self.played = array.array('l')
+        self.draws = array.array('l')
+        self.points = array.array('l')
+        self.games_won = array.array('l')
+        self.games_played = array.array('l')
+        self.position = {}
+        self.matches = []
+        self.rounds = array.array('l')
+        self.created = array.array('d')
+        self.drawn = array.array('l')
+        self.winner_games = array.array('l')
+        self.loser_games = array.array('l')
+        self.games = {}
+        self.met = set()
+        self.version = 0
+        self.computed = None
+        self.ratings = None
+
+    def add(self, uid, name):
+        '''
+        Appends a player
+
+        Args: self
+              uid - object of type integer
+              name - object of type string
+        Raises:
+        Returns: None
+        '''
+        self.version += 1
+        self.position[uid] = len(self.ids)
+        self.ids.append(uid)
+        self.names.append(name)
+        self.wins.append(0)
+        self.played.append(0)
+        self.draws.append(0)
+        self.points.append(0)
+        self.games_won.append(0)
+        self.games_played.append(0)
+
+    def record(self, winner, loser, round=None, created=None, draw=False,
+               winner_games=None, loser_games=None):
+        '''
+        Counts a match, a None loser is a bye
+
+        Args: self
+              winner - object of type integer
+              loser - object of type integer/None
+              round - object of type integer/None, defaults to one more
+                      than the most matches either player played
+              created - object of type float/None, defaults to now
+              draw - object of type boolean
+              winner_games, loser_games - object of type integer/None
+        Raises:
+        Returns: None
+        '''
+        self.version += 1
+        position = self.position[winner]
+        if round is None:
+            round = self.played[position] + 1
+            if loser is not None:
+                round = max(round, self.played[self.position[loser]] + 1)
+        games = 0
+        if winner_games is not None and loser_games is not None:
+            games = winner_games + loser_games
+        self.wins[position] += not draw
+        self.played[position] += 1
+        self.draws[position] += draw
+        self.points[position] += 1 if draw else 3
+        self.games_won[position] += winner_games or 0
+        self.games_played[position] += games
+        self.games.setdefault(winner, []).append(len(self.matches))
+        if loser is not None:
+            other = self.position[loser]
+            self.played[other] += 1
+            self.draws[other] += draw
+            self.points[other] += draw
+            self.games_won[other] += loser_games or 0
+            self.games_played[other] += games
+            self.games.setdefault(loser, []).append(len(self.matches))
+            self.met.add((min(winner, loser), max(winner, loser)))
+        self.matches.append((winner, loser))
+        self.rounds.append(round)
+        self.created.append(time.time() if created is None else created)
+        self.drawn.append(draw)
+        self.winner_games.append(-1 if winner_games is None
+                                 else winner_games)
+        self.loser_games.append(-1 if loser_games is None else loser_games)
+
+    def reset(self):
+        '''
+        Forgets every match, keeping the players
+
+        Args: self
+        Raises:
+        Returns: None
+        '''
+        self.version += 1
+        for column in (self.wins, self.played, self.draws, self.points,
+                       self.games_won, self.games_played):
+            for position in range(len(self.ids)):
+                column[position] = 0
+        self.matches = []
+        self.rounds = array.array('l')
+        self.created = array.array('d')
+        self.drawn = array.array('l')
+        self.winner_games = array.array('l')
+        self.loser_games = array.array('l')
+        self.games = {}
+        self.met = set()
+        self.ratings = None
+
+    def rated(self, engine):
+        '''
+        Returns the ratings of every player, adding the initial ratings
+        of players registered since the last call
+
+        Args: self
+              engine - elo or glicko2 class instance
+        Raises:
+        Returns:
+                object of type numpy.ndarray(n, 4)
+        '''
+        if self.ratings is None:
+            self.ratings = engine.initial_state(0)
+        missing = len(self.ids) - len(self.ratings)
+        if missing:
+            self.ratings = numpy.concatenate(
+                (self.ratings, engine.initial_state(missing)))
+        return self.ratings
+
+    def tiebreaks(self):
+        '''
+        Returns the tiebreaks of every player, indexed by position. The
+        opponents' ratios are computed once per player, then a single
+        pass over the matches sums them up from both sides. The result
+        is kept until the next change.
+
+        Args: self
+        Raises:
+        Returns:
+                object of type tuple(array(buchholz),
+                                     array(sonneborn_berger), array(omw))
+        '''
+        if self.computed is not None and self.computed[0] == self.version:
+            return self.computed[1]
+        count = len(self.ids)
+        points, played, position = self.points, self.played, self.position
+        floor = 1.0 / 3
+        ratio = array.array('d', [
+            max(scored / (3.0 * matches), floor) if matches else floor
+            for scored, matches in zip(points, played)])
+        buchholz = array.array('l', [0]) * count
+        berger = array.array('d', [0.0]) * count
+        ratios = array.array('d', [0.0]) * count
+        opponents = array.array('l', [0]) * count
+        for (winner, loser), draw in zip(self.matches, self.drawn):
+            if loser is None:
+                continue
+            first, second = position[winner], position[loser]
+            buchholz[first] += points[second]
+            buchholz[second] += points[first]
+            if draw:
+                berger[first] += points[second] / 2.0
+                berger[second] += points[first] / 2.0
+            else:
+                berger[first] += points[second]
+            ratios[first] += ratio[second]
+            ratios[second] += ratio[first]
+            opponents[first] += 1
+            opponents[second] += 1
+        omw = array.array('d', [
+            total / met if met else 0.0
+            for total, met in zip(ratios, opponents)])
+        self.computed = (self.version, (buchholz, berger, omw))
+        return self.computed[1]
+
+
+class memory(store):
+
+    def __init__(self, tournament=1, state=None, rating=None):
+        '''
+        In-memory storage backend. All memory instances share one state
+        unless given their own, like db instances share one pool.
+
+        Args: self
+              tournament - object of type integer
+              state - object of type dictionary, defaults to the shared
+                      memory state
+              rating - elo or glicko2 class instance/None, rates every
+                       reported match when given
+        Raises:
+        Returns:
+            self.tournament - object of type integer
+            self.rating - elo or glicko2 class instance/None
+            self.state - object of type dictionary
+            self.log - logger class instance
+        '''
+        self.tournament = tournament
+        self.rating = rating
+        self.state = state if state is not None else shared_memory()
+        self.log = logger()
+
+    def arrays(self):
+        '''
+        Returns the state of the tournament. Call with the lock held.
+
+        Args: self
+        Raises:
+                KeyError - if the tournament does not exist
+        Returns:
+                standings_arrays class instance
+        '''
+        return self.state['tournaments'][self.tournament][1]
+
+    def failed(self, error):
+        '''
+        Logs an error that is reported to the caller as None, like
+        db.failed
+
+        Args: self
+              error - object of type Exception
+        Raises:
+        Returns: None
+        '''
+        self.log.exception(error)
+
+    def registerTournament(self, name):
+        '''
+        Stores a new tournament
+
+        Args: self
+              name - object of type string
+        Raises:
+        Returns:
+                object of type integer
+        '''
+        with self.state['lock']:
+            tournament = self.state['next_tournament']
+            self.state['next_tournament'] += 1
+            self.state['tournaments'][tournament] = (
+                name, standings_arrays())
+            return tournament
+
+    def deleteTournament(self, tournament):
+        '''
+        Removes a tournament with its players and matches
+
+        Args: self
+              tournament - object of type integer
+        Raises:
+        Returns:
+                object of type string
+        '''
+        with self.state['lock']:
+            self.state['tournaments'].pop(tournament, None)
+            return 'OK'
+
+    def listTournaments(self):
+        '''
+        Returns all tournaments
+
+        Args: self
+        Raises:
+        Returns:
+                object of type list((id, name))
+        '''
+        with self.state['lock']:
+            return sorted((tournament, entry[0]) for tournament, entry
+                          in self.state['tournaments'].items())
+
+    def exportTournament(self, tournament):
+        '''
+        Returns a snapshot of a tournament
+
+        Args: self
+              tournament - object of type integer
+        Raises:
+        Returns:
+                snapshot class instance
+                object of type None
+        '''
+        with self.state['lock']:
+            if tournament not in self.state['tournaments']:
+                self.log.info('Unknown tournament %s', tournament)
+                return None
+            name, arrays = self.state['tournaments'][tournament]
+            return snapshot(name, arrays.ids, arrays.names, arrays.wins,
+                            arrays.played,
+                            [winner for winner, loser in arrays.matches],
+                            [loser or 0 for winner, loser in arrays.matches],
+                            arrays.rounds, arrays.created, arrays.drawn,
+                            arrays.winner_games, arrays.loser_games)
+
+    def importTournament(self, data):
+        '''
+        Stores a snapshot as a new tournament with new player ids
+
+        Args: self
+              data - snapshot class instance
+        Raises:
+        Returns:
+                object of type integer
+        '''
+        arrays = standings_arrays()
+        with self.state['lock']:
+            first = self.state['next_player']
+            self.state['next_player'] += len(data.ids)
+            ids = list(range(first, first + len(data.ids)))
+            renamed = dict(zip(data.ids, ids))
+            renamed[0] = None
+            for uid, name in zip(ids, data.names):
+                arrays.add(uid, name)
+            for (winner, loser, number, created, draw, winner_games,
+                 loser_games) in zip(data.winners, data.losers, data.rounds,
+                                     data.created, data.draws,
+                                     data.winner_games, data.loser_games):
+                arrays.record(renamed[winner], renamed[loser], number,
+                              created or None, bool(draw),
+                              None if winner_games < 0 else winner_games,
+                              None if loser_games < 0 else loser_games)
+            tournament = self.state['next_tournament']
+            self.state['next_tournament'] += 1
+            self.state['tournaments'][tournament] = (data.name, arrays)
+            return tournament
+
+    def deletePlayers(self):
+        '''
+        Removes the players of the tournament and their matches
+
+        Args: self
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type string
+                object of type None
+        '''
+        try:
+            with self.state['lock']:
+                name = self.state['tournaments'][self.tournament][0]
+                self.state['tournaments'][self.tournament] = (
+                    name, standings_arrays())
+                return 'OK'
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    def countPlayers(self):
+        '''
+        Returns the number of players of the tournament
+
+        Args: self
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type integer
+                object of type None
+        '''
+        try:
+            with self.state['lock']:
+                return len(self.arrays().ids)
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    def registerPlayer(self, name):
+        '''
+        Stores a player
+
+        Args: self
+              name - object of type string
+        Raises:
+        Returns:
+                object of type string
+                object of type None
+        '''
+        if self.registerPlayers([name]) is None:
+            return None
+        return 'OK'
+
+    def registerPlayers(self, names):
+        '''
+        Stores many players
+
+        Args: self
+              names - object of type iterable(string)
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type list(integer)
+                object of type None
+        '''
+        try:
+            names = list(names)
+            with self.state['lock']:
+                arrays = self.arrays()
+                first = self.state['next_player']
+                self.state['next_player'] += len(names)
+                ids = list(range(first, first + len(names)))
+                for uid, name in zip(ids, names):
+                    arrays.add(uid, name)
+                return ids
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    def deleteMatches(self):
+        '''
+        Removes the matches of the tournament
+
+        Args: self
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type string
+                object of type None
+        '''
+        try:
+            with self.state['lock']:
+                self.arrays().reset()
+                return 'OK'
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    def playerStandings(self, tiebreaks=False):
+        '''
+        Returns the standings, by points and then id
+
+        Args: self
+              tiebreaks - object of type boolean, adds the buchholz,
+                          sonneborn_berger and omw columns and breaks
+                          ties by them
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type list((id, name, wins, matches))
+                object of type list((id, name, wins, matches, buchholz,
+                                     sonneborn_berger, omw))
+                object of type None
+        '''
+        try:
+            with self.state['lock']:
+                rows = self.columns(self.arrays(), tiebreaks)
+            return self.ranked(rows, tiebreaks)
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    def columns(self, arrays, tiebreaks=False):
+        '''
+        Returns the unsorted standings rows, led by the points. Call with
+        the lock held.
+
+        Args: self
+              arrays - standings_arrays class instance
+              tiebreaks - object of type boolean
+        Raises:
+        Returns:
+                object of type list(tuple)
+        '''
+        columns = [arrays.points, arrays.ids, arrays.names, arrays.wins,
+                   arrays.played]
+        if tiebreaks:
+            columns.extend(arrays.tiebreaks())
+        return list(zip(*columns))
+
+    def ranked(self, rows, tiebreaks=False):
+        '''
+        Sorts the rows of columns() into standings
+
+        Args: self
+              rows - object of type list(tuple)
+              tiebreaks - object of type boolean
+        Raises:
+        Returns:
+                object of type list(tuple)
+        '''
+        if tiebreaks:
+            rows.sort(key=lambda row: (-row[0], -row[5], -row[6], -row[7],
+                                       row[1]))
+        else:
+            rows.sort(key=lambda row: (-row[0], row[1]))
+        return [row[1:] for row in rows]
+
+    def pointStandings(self):
+        '''
+        Returns the match points and game counts, by points and then id
+
+        Args: self
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type list((id, name, points, wins, draws,
+                                     matches, games_won, games_played))
+                object of type None
+        '''
+        try:
+            with self.state['lock']:
+                arrays = self.arrays()
+                rows = list(zip(arrays.ids, arrays.names, arrays.points,
+                                arrays.wins, arrays.draws, arrays.played,
+                                arrays.games_won, arrays.games_played))
+            rows.sort(key=lambda row: (-row[2], row[0]))
+            return rows
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    def iterStandings(self, batch=1000):
+        '''
+        Yields the standings. The rows are in memory already, so batch
+        is accepted for compatibility only.
+
+        Args: self
+              batch - object of type integer
+        Raises:
+                KeyError - logged and raised again for an unknown
+                           tournament, like db.iterStandings
+        Returns:
+                object of type generator((id, name, wins, matches))
+        '''
+        try:
+            with self.state['lock']:
+                rows = self.columns(self.arrays())
+        except Exception as e:
+            self.failed(e)
+            raise
+        for row in self.ranked(rows):
+            yield row
+
+    def standingsPage(self, limit, after=None):
+        '''
+        Returns one page of the standings without sorting the whole
+        field, rows ranked below after are selected with a heap
+
+        Args: self
+              limit - object of type integer, rows per page
+              after - object of type tuple(id, name, wins, matches)/None,
+                      the last row of the previous page
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type list((id, name, wins, matches))
+                object of type None
+        '''
+        try:
+            with self.state['lock']:
+                arrays = self.arrays()
+                points, position = arrays.points, arrays.position
+
+                def rank(row):
+                    return (-points[position[row[0]]], row[0])
+                rows = zip(arrays.ids, arrays.names, arrays.wins,
+                           arrays.played)
+                if after is not None:
+                    last = rank(after)
+                    rows = [row for row in rows if rank(row) > last]
+                return heapq.nsmallest(limit, rows, key=rank)
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    def get_pairings(self):
+        '''
+        Pairs the current standings with the swiss engine. Standings
+        and history are read under one lock, so a concurrent report
+        cannot fall between them.
+
+        Args: self
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type list
+                object of type None
+        '''
+        try:
+            with self.state['lock']:
+                arrays = self.arrays()
+                rows = self.columns(arrays)
+                history = list(arrays.matches)
+            return swiss(self.ranked(rows), history).pair()
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    def reportMatch(self, winner, loser=None, round=None):
+        '''
+        Stores a match
+
+        Args: self
+              winner - object of type integer
+              loser - object of type integer/None, None is a bye
+              round - object of type integer/None
+        Raises:
+        Returns:
+                object of type string
+                object of type None
+        '''
+        return self.reportMatches([(winner, loser)], round)
+
+    def reportMatches(self, uids, round=None):
+        '''
+        Stores a round atomically, nothing if a pair is invalid
+
+        Args: self
+              uids - object of type list(list(winner, loser)) or
+                     list(list(player1, player2, games1, games2))
+              round - object of type integer/None
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type string
+                object of type None
+        '''
+        try:
+            pairs, seen = self.validate_round(uids)
+            if pairs is None:
+                return None
+            with self.state['lock']:
+                arrays = self.arrays()
+                for uid in seen:
+                    if uid not in arrays.position:
+                        self.log.info('Invalid round, unknown players')
+                        return None
+                created = time.time()
+                for winner, loser, winner_games, loser_games, draw in pairs:
+                    arrays.record(winner, loser, round, created, draw,
+                                  winner_games, loser_games)
+                if self.rating is not None:
+                    ratings = arrays.rated(self.rating)
+
+                    def start(ids):
+                        return ratings[self.positions(arrays, ids)]
+                    ids, state = replay(self.rating, [
+                        (winner, loser, draw) for winner, loser, winner_games,
+                        loser_games, draw in pairs], start)
+                    ratings[self.positions(arrays, ids)] = state
+            return 'OK'
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    def opponentHistory(self, player):
+        '''
+        Returns the matches of a player, by round
+
+        Args: self
+              player - object of type integer
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type list((round, opponent, won))
+                object of type None
+        '''
+        try:
+            with self.state['lock']:
+                arrays = self.arrays()
+                rows = []
+                for match in arrays.games.get(player, ()):
+                    winner, loser = arrays.matches[match]
+                    if winner == player:
+                        rows.append((arrays.rounds[match], loser,
+                                     not arrays.drawn[match]))
+                    else:
+                        rows.append((arrays.rounds[match], winner, False))
+            rows.sort(key=lambda row: (row[0], row[1] is None, row[1]))
+            return rows
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    def havePlayed(self, player1, player2):
+        '''
+        Tells whether two players already met
+
+        Args: self
+              player1 - object of type integer
+              player2 - object of type integer
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type boolean
+                object of type None
+        '''
+        try:
+            with self.state['lock']:
+                return (min(player1, player2),
+                        max(player1, player2)) in self.arrays().met
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    def roundResults(self, round):
+        '''
+        Returns the matches of one round, in the order they were stored
+
+        Args: self
+              round - object of type integer
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type list((winner, loser))
+                object of type None
+        '''
+        try:
+            with self.state['lock']:
+                arrays = self.arrays()
+                return [match for match, number in zip(arrays.matches,
+                                                       arrays.rounds)
+                        if number == round]
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    def positions(self, arrays, ids):
+        '''
+        Returns the positions of ids in arrays
+
+        Args: self
+              arrays - standings_arrays class instance
+              ids - object of type numpy.ndarray(id)
+        Raises:
+        Returns:
+                object of type list(integer)
+        '''
+        return [arrays.position[uid] for uid in ids.tolist()]
+
+    def playerRatings(self):
+        '''
+        Returns the ratings of every player, by rating and then id
+
+        Args: self
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type list
+                object of type None
+        '''
+        try:
+            if self.rating is None:
+                self.log.info('No rating engine configured')
+                return None
+            with self.state['lock']:
+                arrays = self.arrays()
+                ratings = arrays.rated(self.rating)
+                rows = [(uid, name) + tuple(row[:3]) + (int(row[3]), )
+                        for uid, name, row in zip(arrays.ids, arrays.names,
+                                                  ratings.tolist())]
+            rows.sort(key=lambda row: (-row[2], row[0]))
+            return rows
+        except Exception as e:
+            self.failed(e)
+            return None
+
+    def recomputeRatings(self):
+        '''
+        Replays every match of the tournament and replaces its ratings
+
+        Args: self
+        Raises:
+                pokemon catching exceptions for log purposes
+        Returns:
+                object of type integer, number of rated players
+                object of type None
+        '''
+        try:
+            if self.rating is None:
+                self.log.info('No rating engine configured')
+                return None
+            with self.state['lock']:
+                arrays = self.arrays()
+                ids, state = replay(self.rating, [
+                    match + (draw, ) for match, draw in zip(arrays.matches,
+                                                            arrays.drawn)])
+                arrays.ratings = None
+                ratings = arrays.rated(self.rating)
+                ratings[self.positions(arrays, ids)] = state
+            return len(ids)
+        except Exception as e:
+            self.failed(e)
+            return None
+
+
+def memory_state():
+    '''
+    Returns a new empty memory state with the default tournament 1, for
+    memory instances that must not share the module's state
+
+    Args:
+    Raises:
+    Returns:
+            object of type dictionary
+    '''
+    return {'lock': threading.Lock(),
+            'tournaments': {1: ('default', standings_arrays())},
+            'next_tournament': 2,
+            'next_player': 1}
+
+
+def shared_memory():
+    '''
+    Returns the state shared by every memory instance, creating it on
+    first use
+
+    Args:
+    Raises:
+    Returns:
+            object of type dictionary
+    '''
+    with shared_lock:
+        if shared['memory'] is None:
+            shared['memory'] = memory_state()
+        return shared['memory']
@@ -0,0 +1,530 @@
+#!/usr/bin/env python
+#
+# tournament_metrics.py -- logging and metrics of the tournament backends
+#
+
+import random
+import logging
+import time
+import threading
+import contextlib
+import bisect
+import collections
+import cProfile
+import functools
+import json
+import os
+import pstats
+
+
+class logqueue(logging.Handler):
+
+    def __init__(self, filename='tournament.log', level=logging.INFO,
+                 structured=False, capacity=10000, interval=0.1):
+        '''
+        Log handler that only queues records. A background thread wakes
+        up every interval, then formats and writes what was queued in
+        one batch, so callers never wait for the file. When the queue is
+        full new records are dropped and counted.
+
+        Args: self
+              filename - object of type string
+              level - object of type integer, lowest level written
+              structured - object of type boolean, JSON lines instead
+                           of plain text
+              capacity - object of type integer, records held in memory
+              interval - object of type float, seconds between writes
+        Raises:
+        Returns:
+            self.records - object of type deque(logging.LogRecord)
+            self.target - object of type logging.FileHandler
+            self.dropped - object of type integer
+        '''
+        logging.Handler.__init__(self, level)
+        self.records = collections.deque()
+        self.capacity = capacity
+        self.interval = interval
+        self.wakeup = threading.Event()
+        self.target = logging.FileHandler(filename)
+        if structured:
+            self.target.setFormatter(jsonformatter())
+        else:
+            self.target.setFormatter(logging.Formatter(
+                '%(asctime)s - %(levelname)s: %(message)s'))
+        self.dropped = 0
+        self.pid = None
+        self.thread = None
+        self.start()
+
+    def start(self):
+        '''
+        Starts the writer thread, again in a forked child process
+
+        Args: self
+        Raises:
+        Returns: None
+        '''
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self.drain,
+                                       name='tournament-log')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def handle(self, record):
+        '''
+        Queues a record. Appending to a deque is thread-safe, so unlike
+        logging.Handler.handle() no lock is taken.
+
+        Args: self
+              record - object of type logging.LogRecord
+        Raises:
+        Returns: None
+        '''
+        if self.filter(record):
+            self.emit(record)
+
+    def emit(self, record):
+        '''
+        Queues a record without formatting it
+
+        Args: self
+              record - object of type logging.LogRecord
+        Raises:
+        Returns: None
+        '''
+        if self.pid != os.getpid():
+            self.records.clear()
+            self.start()
+        if len(self.records) >= self.capacity:
+            self.dropped += 1
+        else:
+            self.records.append(record)
+
+    def drain(self):
+        '''
+        Writes queued records in batches until a None arrives, calls any
+        other queued callable
+
+        Args: self
+        Raises:
+        Returns: None
+        '''
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            while self.records:
+                record = self.records.popleft()
+                if record is None:
+                    return
+                if isinstance(record, logging.LogRecord):
+                    self.target.handle(record)
+                else:
+                    record()
+
+    def flush(self, timeout=5.0):
+        '''
+        Waits until the records queued so far are written
+
+        Args: self
+              timeout - object of type float, seconds
+        Raises:
+        Returns: None
+        '''
+        if self.pid != os.getpid() or not self.thread.is_alive():
+            return
+        done = threading.Event()
+        self.records.append(done.set)
+        self.wakeup.set()
+        done.wait(timeout)
+
+    def close(self):
+        '''
+        Writes what is queued and stops the thread. Called for every
+        handler by logging at exit.
+
+        Args: self
+        Raises:
+        Returns: None
+        '''
+        if self.pid == os.getpid() and self.thread.is_alive():
+            self.records.append(None)
+            self.wakeup.set()
+            self.thread.join(5.0)
+        self.target.close()
+        logging.Handler.close(self)
+
+
+class jsonformatter(logging.Formatter):
+
+    def format(self, record):
+        '''
+        Formats a record as one JSON object per line
+
+        Args: self
+              record - object of type logging.LogRecord
+        Raises:
+        Returns:
+                object of type string
+        '''
+        entry = {'time': self.formatTime(record),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, sort_keys=True)
+
+
+class logger(object):
+
+    def __init__(self, name='tournament'):
+        '''
+        References to the tournament log, set up by shared_log().
+        Messages take %-style arguments that are only formatted by the
+        log thread, and only if their level is enabled.
+
+        Args: self
+              name - object of type string
+        Raises:
+        Returns: None
+        '''
+        shared_log()
+        self.logger = logging.getLogger(name)
+
+    def debug(self, message, *args):
+        '''
+        Logs debug message
+
+        Args: self, message, args
+        Raises:
+        Returns: None
+        '''
+        self.logger.debug(message, *args)
+
+    def info(self, message, *args):
+        '''
+        Logs info message
+
+        Args: self, message, args
+        Raises:
+        Returns: None
+        '''
+        self.logger.info(message, *args)
+
+    def exception(self, message, *args):
+        '''
+        Logs exception message
+
+        Args: self, message, args
+        Raises:
+        Returns: None
+        '''
+        self.logger.exception(message, *args)
+
+
+class metrics(object):
+
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+               0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, profile_rate=0.0, profile_dir=None):
+        '''
+        In-process registry of counters and latency histograms, exported
+        in the Prometheus text format by exposition(). A sampled
+        fraction of the operations can be run under cProfile.
+
+        Args: self
+              profile_rate - object of type float, fraction of the
+                             operations that are profiled
+              profile_dir - object of type string/None, directory for
+                            .prof files, None logs the top functions
+        Raises:
+        Returns:
+            self.counters - object of type dictionary((name, labels),
+                            number)
+            self.histograms - object of type dictionary((name, labels),
+                              [bucket counts, sum, count])
+            self.collectors - object of type list((prefix, callable)),
+                              sources of gauges read on exposition
+        '''
+        self.profile_rate = profile_rate
+        self.profile_dir = profile_dir
+        self.profiles = 0
+        self.counters = {}
+        self.histograms = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+        self.log = logger()
+
+    def count(self, name, value=1, **labels):
+        '''
+        Adds value to a counter
+
+        Args: self
+              name - object of type string
+              value - object of type number
+              labels - key arguments, label values
+        Raises:
+        Returns: None
+        '''
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        '''
+        Records a duration in a histogram
+
+        Args: self
+              name - object of type string
+              seconds - object of type float
+              labels - key arguments, label values
+        Raises:
+        Returns: None
+        '''
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [
+                    [0] * (len(self.buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        '''
+        Context manager observing the time spent in its block
+
+        Args: self
+              name - object of type string
+              labels - key arguments, label values
+        Raises:
+        Returns: None
+        '''
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - started, **labels)
+
+    def call(self, operation, function, *args, **kwargs):
+        '''
+        Calls function as a timed operation, under cProfile for a
+        profile_rate fraction of the calls
+
+        Args: self
+              operation - object of type string
+              function - callable
+              args, kwargs - arguments of function
+        Raises:
+        Returns:
+                the result of function
+        '''
+        started = time.time()
+        try:
+            if self.profile_rate and random.random() < self.profile_rate:
+                return self.profile(operation, function, *args, **kwargs)
+            return function(*args, **kwargs)
+        finally:
+            self.observe('tournament_operation_seconds',
+                         time.time() - started, operation=operation)
+
+    def profile(self, operation, function, *args, **kwargs):
+        '''
+        Runs function under cProfile and keeps the statistics
+
+        Args: self
+              operation - object of type string
+              function - callable
+              args, kwargs - arguments of function
+        Raises:
+        Returns:
+                the result of function
+        '''
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(function, *args, **kwargs)
+        finally:
+            with self.lock:
+                self.profiles += 1
+                number = self.profiles
+            self.count('tournament_profiles_total', operation=operation)
+            if self.profile_dir is not None:
+                profiler.dump_stats(os.path.join(
+                    self.profile_dir, '%s-%d-%d.prof' % (
+                        operation, os.getpid(), number)))
+            else:
+                try:
+                    from cStringIO import StringIO
+                except ImportError:
+                    from io import StringIO
+                output = StringIO()
+                stats = pstats.Stats(profiler, stream=output)
+                stats.sort_stats('cumulative').print_stats(15)
+                self.log.info('Profile of %s:\n%s', operation,
+                              output.getvalue())
+
+    def collect(self, prefix, source):
+        '''
+        Registers a callable returning a dictionary of numbers, exported
+        as prefix_key gauges
+
+        Args: self
+              prefix - object of type string
+              source - callable
+        Raises:
+        Returns: None
+        '''
+        with self.lock:
+            self.collectors.append((prefix, source))
+
+    def value(self, name, **labels):
+        '''
+        Returns a counter value or the number of observations of a
+        histogram
+
+        Args: self
+              name - object of type string
+              labels - key arguments, label values
+        Raises:
+        Returns:
+                object of type number
+        '''
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            if key in self.histograms:
+                return self.histograms[key][2]
+            return self.counters.get(key, 0)
+
+    def exposition(self):
+        '''
+        Returns every metric in the Prometheus text exposition format
+
+        Args: self
+        Raises:
+        Returns:
+                object of type string
+        '''
+        def series(name, labels, extra=()):
+            pairs = ['%s="%s"' % (label, str(value).replace('"', '\\"'))
+                     for label, value in tuple(labels) + tuple(extra)]
+            return '%s{%s}' % (name, ','.join(pairs)) if pairs else name
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(value[0]), value[1], value[2]))
+                                for key, value in self.histograms.items())
+            collectors = list(self.collectors)
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE %s counter' % name)
+            lines.append('%s %s' % (series(name, labels), value))
+        for (name, labels), (counts, total, observed) in histograms:
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE %s histogram' % name)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf', ), counts):
+                cumulative += count
+                lines.append('%s %d' % (series(
+                    name + '_bucket', labels, (('le', bound), )), cumulative))
+            lines.append('%s %r' % (series(name + '_sum', labels), total))
+            lines.append('%s %d' % (series(name + '_count', labels),
+                                    observed))
+        for prefix, source in collectors:
+            for key, value in sorted(source().items()):
+                lines.append('# TYPE %s_%s gauge' % (prefix, key))
+                lines.append('%s_%s %s' % (prefix, key, value))
+        return '\n'.join(lines) + '\n'
+
+
+def metrics_app(environ, start_response):
+    '''
+    WSGI application serving shared_metrics().exposition(), to be mounted
+    on a /metrics path or served with wsgiref.simple_server
+
+    Args: environ - object of type dictionary
+          start_response - callable
+    Raises:
+    Returns:
+            object of type list(bytes)
+    '''
+    body = shared_metrics().exposition()
+    if not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    start_response('200 OK', [
+        ('Content-Type', 'text/plain; version=0.0.4'),
+        ('Content-Length', str(len(body)))])
+    return [body]
+
+
+def instrumented(method):
+    '''
+    Decorates a db method so every call is timed, and sampled for
+    profiling, by the metrics registry of the instance
+
+    Args: method - function
+    Raises:
+    Returns:
+            function
+    '''
+    @functools.wraps(method)
+    def operation(self, *args, **kwargs):
+        return self.metrics.call(method.__name__, method, self, *args,
+                                 **kwargs)
+    return operation
+
+
+shared = {'pool': None, 'cache': None, 'memory': None, 'log': None,
+          'metrics': None}
+shared_lock = threading.RLock()
+
+
+def shared_log(**kwargs):
+    '''
+    Returns the queue handler of the tournament log, creating it on
+    first use. Keyword arguments are passed to logqueue() and only
+    apply on creation. The TOURNAMENT_LOG_LEVEL (a level name) and
+    TOURNAMENT_LOG_FORMAT ('text' or 'json') environment variables
+    set the defaults.
+
+    Args: key arguments
+    Raises:
+    Returns:
+            logqueue class instance
+    '''
+    with shared_lock:
+        if shared['log'] is None:
+            level = os.environ.get('TOURNAMENT_LOG_LEVEL', 'INFO')
+            kwargs.setdefault('level', getattr(logging, level.upper()))
+            kwargs.setdefault('structured', os.environ.get(
+                'TOURNAMENT_LOG_FORMAT', 'text') == 'json')
+            handler = logqueue(**kwargs)
+            log = logging.getLogger('tournament')
+            log.addHandler(handler)
+            log.setLevel(handler.level)
+            log.propagate = False
+            shared['log'] = handler
+        return shared['log']
+
+
+def shared_metrics(**kwargs):
+    '''
+    Returns the metrics registry shared by every pool and db instance,
+    creating it on first use. Keyword arguments are passed to metrics()
+    and only apply on creation.
+
+    Args: key arguments
+    Raises:
+    Returns:
+            metrics class instance
+    '''
+    with shared_lock:
+        if shared['metrics'] is None:
+            shared['metrics'] = metrics(**kwargs)
+        return shared['metrics']
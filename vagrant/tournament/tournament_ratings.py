@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+#
+# tournament_ratings.py -- Elo and Glicko-2 rating engines of tournament.py
+#
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class elo(object):
+
+    def __init__(self, k=32.0, initial=1500.0):
+        '''
+        Elo rating engine. Ratings are numpy arrays of shape (n, 4):
+        rating, deviation, volatility and games. Elo only uses the
+        first and last columns.
+
+        Args: self
+              k - object of type float, largest change of one game
+              initial - object of type float, rating of new players
+        Raises:
+                ImportError - if numpy is not installed
+        Returns: None
+        '''
+        if numpy is None:
+            raise ImportError('The rating engines need numpy')
+        self.k = k
+        self.initial = initial
+
+    def initial_state(self, count):
+        '''
+        Returns the ratings of count new players
+
+        Args: self
+              count - object of type integer
+        Raises:
+        Returns:
+                object of type numpy.ndarray(count, 4)
+        '''
+        state = numpy.zeros((count, 4))
+        state[:, 0] = self.initial
+        return state
+
+    def update(self, state, winners, losers, scores=None):
+        '''
+        Applies a batch of games in place. No player may appear twice
+        in a batch, so all games are rated simultaneously.
+
+        Args: self
+              state - object of type numpy.ndarray(n, 4)
+              winners - object of type numpy.ndarray(integer), rows
+              losers - object of type numpy.ndarray(integer), rows
+              scores - object of type numpy.ndarray(float)/None, the
+                       winners' scores, 0.5 for a draw, 1 by default
+        Raises:
+        Returns: None
+        '''
+        if scores is None:
+            scores = numpy.ones(len(winners))
+        first = state[winners, 0]
+        second = state[losers, 0]
+        expected = 1.0 / (1.0 + 10.0 ** ((second - first) / 400.0))
+        change = self.k * (scores - expected)
+        state[winners, 0] = first + change
+        state[losers, 0] = second - change
+        state[winners, 3] += 1
+        state[losers, 3] += 1
+
+
+class glicko2(elo):
+
+    scale = 173.7178
+
+    def __init__(self, tau=0.5, initial=1500.0, deviation=350.0,
+                 volatility=0.06, epsilon=1e-6):
+        '''
+        Glicko-2 rating engine, one rating period per batch. Players
+        who sit out a batch keep their deviation.
+
+        Args: self
+              tau - object of type float, constrains volatility changes
+              initial - object of type float, rating of new players
+              deviation - object of type float, deviation of new players
+              volatility - object of type float, volatility of new players
+              epsilon - object of type float, volatility convergence
+        Raises:
+                ImportError - if numpy is not installed
+        Returns: None
+        '''
+        elo.__init__(self, initial=initial)
+        self.tau = tau
+        self.deviation = deviation
+        self.volatility = volatility
+        self.epsilon = epsilon
+
+    def initial_state(self, count):
+        '''
+        Returns the ratings of count new players
+
+        Args: self
+              count - object of type integer
+        Raises:
+        Returns:
+                object of type numpy.ndarray(count, 4)
+        '''
+        state = elo.initial_state(self, count)
+        state[:, 1] = self.deviation
+        state[:, 2] = self.volatility
+        return state
+
+    def update(self, state, winners, losers, scores=None):
+        '''
+        Applies a batch of games in place, every step of the algorithm
+        runs on whole arrays. No player may appear twice in a batch.
+
+        Args: self
+              state - object of type numpy.ndarray(n, 4)
+              winners - object of type numpy.ndarray(integer), rows
+              losers - object of type numpy.ndarray(integer), rows
+              scores - object of type numpy.ndarray(float)/None, the
+                       winners' scores, 0.5 for a draw, 1 by default
+        Raises:
+        Returns: None
+        '''
+        if scores is None:
+            scores = numpy.ones(len(winners))
+        players = numpy.concatenate((winners, losers))
+        opponents = numpy.concatenate((losers, winners))
+        score = numpy.concatenate((scores, 1.0 - scores))
+        mu = (state[players, 0] - 1500.0) / self.scale
+        phi = state[players, 1] / self.scale
+        sigma = state[players, 2]
+        other = (state[opponents, 0] - 1500.0) / self.scale
+        spread = state[opponents, 1] / self.scale
+        g = 1.0 / numpy.sqrt(1.0 + 3.0 * spread ** 2 / numpy.pi ** 2)
+        expected = 1.0 / (1.0 + numpy.exp(-g * (mu - other)))
+        v = 1.0 / (g ** 2 * expected * (1.0 - expected))
+        delta = v * g * (score - expected)
+        sigma = self.volatilities(delta, phi, v, sigma)
+        phi = 1.0 / numpy.sqrt(1.0 / (phi ** 2 + sigma ** 2) + 1.0 / v)
+        mu = mu + phi ** 2 * g * (score - expected)
+        state[players, 0] = self.scale * mu + 1500.0
+        state[players, 1] = self.scale * phi
+        state[players, 2] = sigma
+        state[players, 3] += 1
+
+    def volatilities(self, delta, phi, v, sigma):
+        '''
+        Solves the new volatilities with the Illinois algorithm of the
+        Glicko-2 paper, iterating on all players that did not converge
+
+        Args: self
+              delta, phi, v, sigma - object of type numpy.ndarray(float)
+        Raises:
+        Returns:
+                object of type numpy.ndarray(float)
+        '''
+        a = numpy.log(sigma ** 2)
+        tau = self.tau ** 2
+
+        def f(x):
+            ex = numpy.exp(x)
+            return (ex * (delta ** 2 - phi ** 2 - v - ex) /
+                    (2.0 * (phi ** 2 + v + ex) ** 2) - (x - a) / tau)
+        low = a.copy()
+        gap = delta ** 2 - phi ** 2 - v
+        high = numpy.log(numpy.where(gap > 0, gap, 1.0))
+        below = gap <= 0
+        k = 1
+        while below.any():
+            high[below] = a[below] - k * self.tau
+            below &= f(high) < 0
+            k += 1
+        f_low, f_high = f(low), f(high)
+        active = numpy.abs(high - low) > self.epsilon
+        while active.any():
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                middle = low + (low - high) * f_low / (f_high - f_low)
+            middle = numpy.where(active, middle, high)
+            f_middle = f(middle)
+            swap = active & (f_middle * f_high <= 0)
+            halve = active & ~swap
+            low = numpy.where(swap, high, low)
+            f_low = numpy.where(swap, f_high, numpy.where(
+                halve, f_low / 2.0, f_low))
+            high = numpy.where(active, middle, high)
+            f_high = numpy.where(active, f_middle, f_high)
+            active &= numpy.abs(high - low) > self.epsilon
+        return numpy.exp(low / 2.0)
+
+
+engines = {'elo': elo, 'glicko2': glicko2}
+
+
+def schedule(winners, losers):
+    '''
+    Splits games in playing order into batches in which no player
+    appears twice. A game goes into the batch after the last one of
+    either player, so every player's games keep their order and a
+    swiss round usually becomes one batch.
+
+    Args: winners - object of type list(integer), rows
+          losers - object of type list(integer), rows
+    Raises:
+    Returns:
+            object of type numpy.ndarray(integer), batch of each game
+    '''
+    last = {}
+    batches = []
+    for winner, loser in zip(winners, losers):
+        batch = max(last.get(winner, 0), last.get(loser, 0)) + 1
+        last[winner] = last[loser] = batch
+        batches.append(batch)
+    return numpy.array(batches, dtype=numpy.int64)
+
+
+def replay(engine, matches, start=None):
+    '''
+    Rates games from their starting ratings, one vectorized update per
+    batch of schedule(). Without start every player is new, which
+    recomputes a whole match history from scratch.
+
+    Args: engine - elo or glicko2 class instance
+          matches - object of type iterable((winner, loser[, draw])) in
+                    playing order, byes (a None loser) are skipped
+          start - object of type callable(ids) returning the ratings of
+                  the ids as a numpy.ndarray(n, 4), defaults to
+                  engine.initial_state
+    Raises:
+    Returns:
+            object of type tuple(numpy.ndarray(id), numpy.ndarray(n, 4))
+    '''
+    rated = [match for match in matches if match[1] is not None]
+    games = numpy.array([match[:2] for match in rated], dtype=numpy.int64)
+    scores = numpy.array([0.5 if len(match) > 2 and match[2] else 1.0
+                          for match in rated])
+    if not len(games):
+        return numpy.zeros(0, dtype=numpy.int64), engine.initial_state(0)
+    ids = numpy.unique(games)
+    rows = numpy.searchsorted(ids, games)
+    batches = schedule(rows[:, 0].tolist(), rows[:, 1].tolist())
+    order = numpy.argsort(batches, kind='mergesort')
+    bounds = numpy.searchsorted(batches[order],
+                                numpy.arange(1, batches.max() + 2))
+    if start is None:
+        state = engine.initial_state(len(ids))
+    else:
+        state = start(ids)
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        batch = order[first:last]
+        engine.update(state, rows[batch, 0], rows[batch, 1], scores[batch])
+    return ids, state
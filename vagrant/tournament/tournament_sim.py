@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+#
+# Monte Carlo simulation of swiss events with tournament.py
+#
+# Plays many independent events in a process pool, each on a private
+# memory backend with its own seeded random number generator, and
+# reports how well the standings after each round count select the
+# strongest players for each top cut size:
+#
+#   python tournament_sim.py --events 10000 --players 128 \
+#       --rounds 6,7,8 --cuts 8,16 --output sim.json
+#
+# Player strengths are normal with a deviation of --spread Elo points and
+# a match is won with the Elo expected score. Results do not depend on
+# the number of workers: event i always uses seed + i.
+
+import argparse
+import json
+import multiprocessing
+import random
+import sys
+import time
+import tournament
+
+
+def playEvent(task):
+    """
+    Plays one event of size players for max(rounds) rounds and returns
+    the measures of every (rounds, cut) pair as a list of
+    (rounds, cut, measures) rows.
+    """
+    index, size, rounds, cuts, spread, seed = task
+    rng = random.Random(seed + index)
+    store = tournament.memory(state=tournament.memory_state())
+    players = tournament.Players(dbapi=store)
+    game = tournament.Game(dbapi=store)
+    ids = players.registerPlayers(["Player %d" % i for i in range(size)])
+    strength = dict((uid, rng.gauss(0, spread)) for uid in ids)
+    strongest = sorted(ids, key=lambda uid: (-strength[uid], uid))
+    rows = []
+    for played in range(1, max(rounds) + 1):
+        results = []
+        for (id1, name1, id2, name2) in game.swissPairings():
+            if id2 is None:
+                results.append((id1, None))
+                continue
+            expected = 1.0 / (1.0 + 10.0 ** (
+                (strength[id2] - strength[id1]) / 400.0))
+            if rng.random() < expected:
+                results.append((id1, id2))
+            else:
+                results.append((id2, id1))
+        game.reportMatches(results)
+        if played in rounds:
+            standings = game.playerStandings(tiebreaks=True)
+            for cut in cuts:
+                rows.append((played, cut, measure(
+                    standings, strongest, played, cut)))
+    return rows
+
+
+def measure(standings, strongest, rounds, cut):
+    """
+    Measures of one top cut: the share of the cut strongest players
+    that made it, whether the strongest did, the wins needed and how
+    many players with those wins were left out on tiebreaks.
+    """
+    top = set(row[0] for row in standings[:cut])
+    line = standings[cut - 1][2]
+    made = len(top.intersection(strongest[:cut]))
+    return {
+        'cut_accuracy': made / float(cut),
+        'strongest_in_cut': 1.0 if strongest[0] in top else 0.0,
+        'undefeated': sum(1 for row in standings if row[2] == rounds),
+        'cut_wins': line,
+        'left_out_on_tiebreaks': sum(
+            1 for row in standings[cut:] if row[2] == line)}
+
+
+def simulate(events, size, rounds, cuts, spread=200.0, seed=2016,
+             workers=None):
+    """
+    Yields the rows of every event as it finishes, in no particular
+    order. Events are spread over workers processes, all cores by
+    default; with one worker they run in this process.
+    """
+    tasks = ((index, size, rounds, cuts, spread, seed)
+             for index in range(events))
+    workers = workers or multiprocessing.cpu_count()
+    if workers == 1:
+        for task in tasks:
+            yield playEvent(task)
+        return
+    processes = multiprocessing.Pool(workers)
+    try:
+        chunk = max(1, min(64, events // (workers * 8)))
+        for rows in processes.imap_unordered(playEvent, tasks, chunk):
+            yield rows
+        processes.close()
+    except BaseException:
+        processes.terminate()
+        raise
+    finally:
+        processes.join()
+
+
+class tally(object):
+    """Running means and extremes of the measures of each (rounds, cut)."""
+
+    def __init__(self):
+        self.events = 0
+        self.groups = {}
+
+    def add(self, rows):
+        self.events += 1
+        for rounds, cut, measures in rows:
+            group = self.groups.setdefault((rounds, cut), {})
+            for key, value in measures.items():
+                total, low, high = group.get(key, (0.0, value, value))
+                group[key] = (total + value, min(low, value),
+                              max(high, value))
+
+    def report(self):
+        """Returns the aggregates as a JSON friendly list."""
+        return [{'rounds': rounds, 'cut': cut,
+                 'mean': dict((key, total / self.events)
+                              for key, (total, low, high) in group.items()),
+                 'min': dict((key, low)
+                             for key, (total, low, high) in group.items()),
+                 'max': dict((key, high)
+                             for key, (total, low, high) in group.items())}
+                for (rounds, cut), group in sorted(self.groups.items())]
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(
+        description='Simulate swiss events with the tournament module.')
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--players', type=int, default=128)
+    parser.add_argument('--rounds', default='6,7,8',
+                        help='comma separated round counts to evaluate')
+    parser.add_argument('--cuts', default='8',
+                        help='comma separated top cut sizes')
+    parser.add_argument('--spread', type=float, default=200.0,
+                        help='deviation of player strength in Elo points')
+    parser.add_argument('--seed', type=int, default=2016)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='processes, all cores by default')
+    parser.add_argument('--output', default='sim_results.json')
+    args = parser.parse_args(argv)
+    rounds = [int(value) for value in args.rounds.split(',')]
+    cuts = [int(value) for value in args.cuts.split(',')]
+    if args.events < 1:
+        parser.error('--events must be at least 1')
+    if min(rounds) < 1:
+        parser.error('--rounds must be at least 1')
+    if min(cuts) < 1 or max(cuts) > args.players:
+        parser.error('--cuts must be between 1 and --players')
+    results = tally()
+    started = time.time()
+    for rows in simulate(args.events, args.players, rounds, cuts,
+                         args.spread, args.seed, args.workers):
+        results.add(rows)
+        if results.events % max(1, args.events // 10) == 0:
+            print "%6d/%d events, %7.1f events/s" % (
+                results.events, args.events,
+                results.events / max(time.time() - started, 1e-9))
+    report = {'events': args.events, 'players': args.players,
+              'spread': args.spread, 'seed': args.seed,
+              'seconds': time.time() - started, 'results': results.report()}
+    for row in report['results']:
+        print "%2d rounds top %3d: accuracy %5.3f strongest %5.3f " \
+            "cut at %4.2f wins, %5.2f left out on tiebreaks" % (
+                row['rounds'], row['cut'], row['mean']['cut_accuracy'],
+                row['mean']['strongest_in_cut'], row['mean']['cut_wins'],
+                row['mean']['left_out_on_tiebreaks'])
+    with open(args.output, 'w') as output:
+        json.dump(report, output, indent=2, sort_keys=True)
+    print "Results written to %s" % args.output
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
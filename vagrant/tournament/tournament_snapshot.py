@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+#
+# tournament_snapshot.py -- binary snapshots of tournament state
+#
+
+import array
+import collections
+import struct
+import sys
+import zlib
+
+
+class snapshot(object):
+
+    magic = b'TOURNMNT'
+    version = 3
+
+    def __init__(self, name, ids, names, wins, played, winners, losers,
+                 rounds=None, created=None, draws=None, winner_games=None,
+                 loser_games=None):
+        '''
+        Full state of one tournament in columns: the players with their
+        standings and the matches in playing order
+
+        Args: self
+              name - object of type string, the tournament's name
+              ids, wins, played - object of type iterable(integer), one
+                                  entry per player
+              names - object of type list(string)
+              winners, losers - object of type iterable(integer), one
+                                entry per match, a 0 loser is a bye
+              rounds - object of type iterable(integer)/None, numbered
+                       from the matches' order by default
+              created - object of type iterable(float)/None, seconds
+                        since the epoch, 0 if unknown
+              draws - object of type iterable(integer)/None, 1 for a
+                      drawn match, no draws by default
+              winner_games, loser_games - object of type
+                                          iterable(integer)/None, games
+                                          won in each match, -1 if
+                                          unknown
+        Raises:
+        Returns:
+            self.ids, self.wins, self.played, self.winners,
+            self.losers, self.rounds, self.draws, self.winner_games,
+            self.loser_games - object of type array(integer)
+            self.created - object of type array(float)
+            self.name - object of type string
+            self.names - object of type list(string)
+        '''
+        self.name = name
+        self.ids = array.array('i', ids)
+        self.names = list(names)
+        self.wins = array.array('i', wins)
+        self.played = array.array('i', played)
+        self.winners = array.array('i', winners)
+        self.losers = array.array('i', losers)
+        if rounds is None:
+            rounds = self.number_rounds()
+        self.rounds = array.array('i', rounds)
+        if created is None:
+            created = [0.0] * len(self.winners)
+        self.created = array.array('d', created)
+        if draws is None:
+            draws = [0] * len(self.winners)
+        self.draws = array.array('i', draws)
+        if winner_games is None:
+            winner_games = [-1] * len(self.winners)
+        self.winner_games = array.array('i', winner_games)
+        if loser_games is None:
+            loser_games = [-1] * len(self.winners)
+        self.loser_games = array.array('i', loser_games)
+
+    def number_rounds(self):
+        '''
+        Numbers the matches like the matches_round trigger: one more
+        than the most matches either player played before
+
+        Args: self
+        Raises:
+        Returns:
+                object of type list(integer)
+        '''
+        played = collections.defaultdict(int)
+        rounds = []
+        for winner, loser in zip(self.winners, self.losers):
+            if loser:
+                rounds.append(max(played[winner], played[loser]) + 1)
+                played[loser] += 1
+            else:
+                rounds.append(played[winner] + 1)
+            played[winner] += 1
+        return rounds
+
+    def columns(self):
+        '''
+        Returns the encoded columns, in file order
+
+        Args: self
+        Raises:
+        Returns:
+                object of type list(bytes)
+        '''
+        columns = []
+        for values in (self.ids, self.wins, self.played, self.winners,
+                       self.losers, self.rounds, self.created, self.draws,
+                       self.winner_games, self.loser_games):
+            if sys.byteorder == 'big':
+                values = array.array(values.typecode, values)
+                values.byteswap()
+            columns.append(values.tobytes() if hasattr(values, 'tobytes')
+                           else values.tostring())
+        columns.append(b'\0'.join(
+            name if isinstance(name, bytes) else name.encode('utf-8')
+            for name in self.names))
+        return columns
+
+    def write(self, stream):
+        '''
+        Writes the snapshot: a header with the counts and the name, then
+        every column as a zlib compressed little-endian block, integers
+        as int32 and times as float64
+
+        Args: self
+              stream - object of type binary file
+        Raises:
+        Returns: None
+        '''
+        name = self.name
+        if not isinstance(name, bytes):
+            name = name.encode('utf-8')
+        stream.write(struct.pack('<8sHIIH', self.magic, self.version,
+                                 len(self.ids), len(self.winners),
+                                 len(name)))
+        stream.write(name)
+        for column in self.columns():
+            column = zlib.compress(column, 1)
+            stream.write(struct.pack('<I', len(column)))
+            stream.write(column)
+
+
+def read_snapshot(stream):
+    '''
+    Reads a snapshot written by snapshot.write, or by an older version
+    that had no rounds and times (1) or no draws and games (2)
+
+    Args: stream - object of type binary file
+    Raises:
+            ValueError - if stream does not hold a whole snapshot
+    Returns:
+            snapshot class instance
+    '''
+    header = struct.Struct('<8sHIIH')
+    try:
+        magic, version, players, matches, length = header.unpack(
+            stream.read(header.size))
+        if magic != snapshot.magic or version not in (1, 2, 3):
+            raise ValueError('Not a tournament snapshot')
+        counts = [players, players, players, matches, matches]
+        typecodes = 'iiiii'
+        if version > 1:
+            counts += [matches, matches]
+            typecodes += 'id'
+        if version > 2:
+            counts += [matches, matches, matches]
+            typecodes += 'iii'
+        counts.append(None)
+        name = stream.read(length)
+        blocks = []
+        for column in counts:
+            size, = struct.unpack('<I', stream.read(4))
+            blocks.append(zlib.decompress(stream.read(size)))
+    except (struct.error, zlib.error):
+        raise ValueError('Truncated tournament snapshot')
+    columns = []
+    for count, column in zip(counts, blocks):
+        if count is None:
+            columns.append(column.split(b'\0') if players else [])
+            continue
+        values = array.array(typecodes[len(columns)])
+        if hasattr(values, 'frombytes'):
+            values.frombytes(column)
+        else:
+            values.fromstring(column)
+        if sys.byteorder == 'big':
+            values.byteswap()
+        if len(values) != count:
+            raise ValueError('Truncated tournament snapshot')
+        columns.append(values)
+    names = columns.pop()
+    if bytes is not str:
+        name = name.decode('utf-8')
+        names = [value.decode('utf-8') for value in names]
+    return snapshot(name, columns[0], names, *columns[1:])
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+#
+# tournament_store.py -- interface of the tournament.py backends
+#
+
+import abc
+
+
+# Base of abstract classes on python 2 and 3, like abc.ABC
+abstract = abc.ABCMeta('abstract', (object, ), {})
+
+
+class store(abstract):
+    '''
+    Storage backend interface behind Players, Game and Tournaments.
+    Every backend is scoped to self.tournament and reports failures by
+    logging them and returning None. A backend that misses one of the
+    abstract methods cannot be created.
+    '''
+
+    @abc.abstractmethod
+    def registerTournament(self, name):
+        '''Stores a new tournament and returns its id'''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def deleteTournament(self, tournament):
+        '''Removes a tournament with its players and matches'''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def listTournaments(self):
+        '''Returns a list of (id, name) tuples'''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def exportTournament(self, tournament):
+        '''Returns a snapshot of a tournament'''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def importTournament(self, data):
+        '''Stores a snapshot as a new tournament and returns its id'''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def deletePlayers(self):
+        '''Removes the players of the tournament'''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def countPlayers(self):
+        '''Returns the number of players of the tournament'''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def registerPlayer(self, name):
+        '''Stores a player'''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def registerPlayers(self, names):
+        '''Stores many players and returns their ids in input order'''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def deleteMatches(self):
+        '''Removes the matches of the tournament'''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def playerStandings(self, tiebreaks=False):
+        '''
+        Returns (id, name, wins, matches) tuples by wins, then id. With
+        tiebreaks, rows end with buchholz, sonneborn_berger and omw and
+        ties are broken by them in that order.
+        '''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iterStandings(self, batch=1000):
+        '''Yields the standings row by row, fetching batch rows at a time'''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def standingsPage(self, limit, after=None):
+        '''Returns the limit standings rows that rank below the row after'''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_pairings(self):
+        '''Returns the swiss pairings of the next round'''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def reportMatch(self, winner, loser=None, round=None):
+        '''
+        Stores a match, a None loser is a bye. Without a round the match
+        is numbered one after the most matches either player played.
+        '''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def reportMatches(self, uids, round=None):
+        '''
+        Stores a round of (winner, loser) matches or (player1, player2,
+        games1, games2) results atomically
+        '''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def pointStandings(self):
+        '''
+        Returns (id, name, points, wins, draws, matches, games_won,
+        games_played) tuples by points, then id
+        '''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def opponentHistory(self, player):
+        '''
+        Returns (round, opponent, won) tuples of a player by round, a
+        draw is not won by either player
+        '''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def havePlayed(self, player1, player2):
+        '''Tells whether two players already met'''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def roundResults(self, round):
+        '''Returns the (winner, loser) matches of a round'''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def playerRatings(self):
+        '''
+        Returns (id, name, rating, deviation, volatility, games) tuples
+        by rating, then id
+        '''
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def recomputeRatings(self):
+        '''Rates every match again from scratch, returns the players rated'''
+        raise NotImplementedError
+
+    def validate_round(self, uids):
+        '''
+        Checks that no player meets themselves or plays twice in a round
+        and turns every result into one match. The player who won more
+        games is the winner, equal games are a draw.
+
+        Args: self
+              uids - object of type list(list(winner, loser)), a None
+                     loser is a bye, or list(list(player1, player2,
+                     games1, games2)), None games for both players is
+                     a draw without game scores
+        Raises:
+        Returns:
+                object of type tuple(list((winner, loser, winner_games,
+                                           loser_games, draw)), set(id))
+                object of type tuple(None, None) if the round is invalid
+        '''
+        pairs = []
+        try:
+            for result in uids:
+                first, second = result[:2]
+                first = int(first)
+                second = None if second is None else int(second)
+                if len(result) == 2:
+                    pairs.append((first, second, None, None, False))
+                    continue
+                games1, games2 = result[2:]
+                if games1 is None and games2 is None:
+                    draw = True
+                else:
+                    games1, games2 = int(games1), int(games2)
+                    draw = games1 == games2
+                    if min(games1, games2) < 0:
+                        raise ValueError('Negative games %s' % (result, ))
+                    if games2 > games1:
+                        first, second = second, first
+                        games1, games2 = games2, games1
+                if first is None or (draw and second is None):
+                    raise ValueError('Result without opponent %s' % (
+                        result, ))
+                pairs.append((first, second, games1, games2, draw))
+        except (TypeError, ValueError) as e:
+            self.log.exception(e)
+            return None, None
+        seen = set()
+        for winner, loser, winner_games, loser_games, draw in pairs:
+            if winner == loser or winner in seen or loser in seen:
+                self.log.info('Invalid round, %s and %s rejected',
+                              winner, loser)
+                return None, None
+            seen.add(winner)
+            if loser is not None:
+                seen.add(loser)
+        return pairs, seen
+
+    def query(self, **kwargs):
+        '''
+        Compatibility entry point for the old keyword dispatcher, e.g.
+        query(count='yes') or query(report_match=[winner, loser]).
+        Players and Game call the backend methods directly.
+
+        Args: self
+              key arguments, a single one
+        Raises:
+                TypeError - if the keyword is not a known command
+        Returns:
+                the result of the matching backend method
+        '''
+        commands = {
+            'player': lambda value: self.registerPlayer(value),
+            'players': lambda value: self.registerPlayers(value),
+            'count': lambda value: self.countPlayers(),
+            'deletePlayers': lambda value: self.deletePlayers(),
+            'deleteMatches': lambda value: self.deleteMatches(),
+            'standings': lambda value: self.playerStandings(),
+            'report_match': lambda value: self.reportMatch(*value),
+            'report_matches': lambda value: self.reportMatches(value),
+            'pairings': lambda value: self.get_pairings()}
+        if len(kwargs) != 1 or list(kwargs)[0] not in commands:
+            raise TypeError('Unknown query %s' % sorted(kwargs))
+        key, value = list(kwargs.items())[0]
+        return commands[key](value)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+#
+# tournament_swiss.py -- swiss pairing engine of tournament.py
+#
+
+
+BYE = (None, None)
+
+
+class swiss(object):
+
+    def __init__(self, standings, history, repair=3):
+        '''
+        In-memory Swiss pairing engine
+
+        Args: self
+              standings - object of type list((id, name, wins, matches)),
+                          ordered by rank
+              history - object of type iterable((winner, loser)), a None
+                        loser marks a bye
+              repair - object of type integer, paired tables first
+                       reopened when the tail of the field is stuck,
+                       doubled until the tail can be paired
+        Raises:
+        Returns:
+            self.players - object of type list((id, name))
+            self.played - object of type set((id, id))
+            self.byes - object of type set(id)
+        '''
+        self.players = [(row[0], row[1]) for row in standings]
+        self.played = set()
+        self.byes = set()
+        for winner, loser in history:
+            if loser is None:
+                self.byes.add(winner)
+            else:
+                self.played.add((min(winner, loser), max(winner, loser)))
+        self.repair = repair
+
+    def rematch(self, first, second):
+        '''
+        Checks whether two players already met, or whether a player
+        paired with BYE already had a bye
+
+        Args: self
+              first - object of type tuple(id, name)
+              second - object of type tuple(id, name)
+        Raises:
+        Returns:
+                object of type boolean
+        '''
+        a, b = first[0], second[0]
+        if a is None or b is None:
+            return (b if a is None else a) in self.byes
+        return (min(a, b), max(a, b)) in self.played
+
+    def pick_bye(self, field):
+        '''
+        Returns the lowest ranked player who has not had a bye yet,
+        or the lowest ranked player if everybody had one
+
+        Args: self
+              field - object of type list((id, name))
+        Raises:
+        Returns:
+                object of type tuple(id, name)
+        '''
+        for player in reversed(field):
+            if player[0] not in self.byes:
+                return player
+        return field[-1]
+
+    def pair(self):
+        '''
+        Pairs every player with the closest ranked opponent they have
+        not met yet. Going down the ranking keeps score groups together
+        and floats odd players into the next group. When the bottom of
+        the field runs out of fresh opponents, the last tables are
+        reopened and paired by a maximum matching (see fix_tail).
+
+        Args: self
+        Raises:
+        Returns:
+                object of type list((id1, name1, id2, name2)), a bye is
+                appended as (id, name, None, None)
+        '''
+        field = list(self.players)
+        bye = None
+        if len(field) % 2:
+            bye = self.pick_bye(field)
+            field.remove(bye)
+        taken = [False] * len(field)
+        tables = []
+        for i in range(len(field)):
+            if taken[i]:
+                continue
+            taken[i] = True
+            partner = None
+            j = i + 1
+            while j < len(field):
+                if not taken[j] and not self.rematch(field[i], field[j]):
+                    partner = j
+                    break
+                j += 1
+            if partner is None:
+                rest = [i] + [j for j in range(i + 1, len(field))
+                              if not taken[j]]
+                return self.fix_tail(field, tables, rest, bye)
+            taken[partner] = True
+            tables.append((i, partner))
+        output = [field[i] + field[j] for i, j in tables]
+        if bye is not None:
+            output.append(bye + BYE)
+        return output
+
+    def fix_tail(self, field, tables, rest, bye):
+        '''
+        Reopens the last self.repair tables and pairs them together with
+        the stuck players by a maximum matching without rematches,
+        doubling the reopened tables until the matching is perfect. If
+        the whole field has none, the bye is reopened too. Only the
+        players the largest matching leaves over are paired by rank for
+        rematches, so a rematch is only made when every pairing of the
+        field needs one.
+
+        Args: self
+              field - object of type list((id, name)), without the bye
+              tables - object of type list((index, index))
+              rest - object of type list(index), unpaired players
+              bye - object of type tuple(id, name)/None
+        Raises:
+        Returns:
+                object of type list((id1, name1, id2, name2))
+        '''
+        reopen = min(self.repair, len(tables))
+        while True:
+            kept = tables[:len(tables) - reopen]
+            opened = tables[len(kept):]
+            indexes = sorted(rest + [i for table in opened for i in table])
+            solved = self.solve(field, indexes, opened)
+            if 2 * len(solved) == len(indexes) or reopen == len(tables):
+                break
+            reopen = min(2 * reopen, len(tables))
+        tables = kept + solved
+        if 2 * len(solved) < len(indexes) and bye is not None and \
+                len(self.byes) < len(self.players):
+            players = self.players + [BYE]
+            position = dict((player, i) for i, player in enumerate(players))
+            tables = self.solve(players, range(len(players)), [
+                (position[field[i]], position[field[j]]) for i, j in tables])
+            field, bye = players, None
+        paired = set(i for table in tables for i in table)
+        left = [i for i in range(len(field)) if i not in paired]
+        tables = sorted(tables + list(zip(left[0::2], left[1::2])))
+        output = [field[i] + field[j] for i, j in tables]
+        if bye is not None:
+            output.append(bye + BYE)
+        return output
+
+    def solve(self, field, indexes, tables):
+        '''
+        Pairs as many players as possible without rematches, with
+        Edmonds' blossom algorithm. Starts from the given tables and
+        tries opponents closest in rank first, so the pairing moves away
+        from the ranking only as far as it must.
+
+        Args: self
+              field - object of type list((id, name))
+              indexes - object of type list(index), sorted by rank
+              tables - object of type list((index, index)), pairs to
+                       start from
+        Raises:
+        Returns:
+                object of type list((index, index)), a maximum matching
+        '''
+        count = len(indexes)
+        local = dict((index, v) for v, index in enumerate(indexes))
+        adjacent = []
+        for v in range(count):
+            fresh = [w for w in range(count) if w != v and not self.rematch(
+                field[indexes[v]], field[indexes[w]])]
+            fresh.sort(key=lambda w: abs(w - v))
+            adjacent.append(fresh)
+        mate = [-1] * count
+        for i, j in tables:
+            if i in local and j in local and \
+                    not self.rematch(field[i], field[j]):
+                mate[local[i]], mate[local[j]] = local[j], local[i]
+        for root in range(count):
+            if mate[root] == -1:
+                self.augment(adjacent, mate, root)
+        return [(indexes[v], indexes[mate[v]]) for v in range(count)
+                if v < mate[v]]
+
+    def augment(self, adjacent, mate, root):
+        '''
+        Searches an alternating tree from an unpaired player for a path
+        to another one, shrinking odd cycles (blossoms) to their base,
+        and flips the pairs along it
+
+        Args: self
+              adjacent - object of type list(list(integer))
+              mate - object of type list(integer), -1 if unpaired,
+                     updated in place
+              root - object of type integer
+        Raises:
+        Returns:
+                object of type boolean, whether the matching grew
+        '''
+        count = len(adjacent)
+        used = [False] * count
+        parent = [-1] * count
+        base = list(range(count))
+
+        def ancestor(a, b):
+            seen = [False] * count
+            while True:
+                a = base[a]
+                seen[a] = True
+                if mate[a] == -1:
+                    break
+                a = parent[mate[a]]
+            while True:
+                b = base[b]
+                if seen[b]:
+                    return b
+                b = parent[mate[b]]
+
+        def mark(v, top, child, blossom):
+            while base[v] != top:
+                blossom[base[v]] = blossom[base[mate[v]]] = True
+                parent[v] = child
+                child = mate[v]
+                v = parent[mate[v]]
+
+        used[root] = True
+        queue = [root]
+        for v in queue:
+            for to in adjacent[v]:
+                if base[v] == base[to] or mate[v] == to:
+                    continue
+                if to == root or mate[to] != -1 and parent[mate[to]] != -1:
+                    top = ancestor(v, to)
+                    blossom = [False] * count
+                    mark(v, top, to, blossom)
+                    mark(to, top, v, blossom)
+                    for i in range(count):
+                        if blossom[base[i]]:
+                            base[i] = top
+                            if not used[i]:
+                                used[i] = True
+                                queue.append(i)
+                elif parent[to] == -1:
+                    parent[to] = v
+                    if mate[to] == -1:
+                        while to != -1:
+                            v = parent[to]
+                            after = mate[v]
+                            mate[to], mate[v] = v, to
+                            to = after
+                        return True
+                    used[mate[to]] = True
+                    queue.append(mate[to])
+        return False
@@ -6,6 +6,10 @@
 # If you do add any of the extra credit options, be sure to add/modify these test cases
 # as appropriate to account for your module's added functionality.
 
+import json
+import logging
+import os
+import tempfile
 import tournament
 
 players = tournament.Players()
@@ -150,10 +154,589 @@ def testPairings():
                 "After one match, players with one win should be paired.")
     print "10. After one match, players with one win are properly paired."
 
+def testSharedPool():
+    """
+    Test that Players and Game share one bounded connection pool
+    and that connections are returned after each operation.
+    """
+    if not isinstance(game.dbapi, tournament.db):
+        print "11. Skipped, the connection pool is part of the postgres backend."
+        return
+    if players.dbapi.pool is not game.dbapi.pool:
+        raise ValueError("Players and Game should share a single pool.")
+    pool = game.dbapi.pool
+    game.dbapi.cache.invalidate()
+    before = pool.stats()['checkouts']
+    players.countPlayers()
+    game.playerStandings()
+    stats = pool.stats()
+    if stats['checkouts'] != before + 2:
+        raise ValueError("Each operation should check out one connection.")
+    if stats['in_use'] != 0:
+        raise ValueError("Connections should be returned to the pool.")
+    if stats['size'] > stats['maxconn']:
+        raise ValueError("Pool should never exceed its maximum size.")
+    with pool.connection() as connection:
+        if pool.stats()['in_use'] != 1:
+            raise ValueError("Checked out connection should be in use.")
+    print "11. Players and Game share a bounded connection pool."
+
+def testBulkRegistration():
+    """
+    Test that a bulk registration returns ids in input order
+    and that every player shows up in the standings.
+    """
+    players.deleteMatches()
+    players.deletePlayers()
+    names = ["Player %d" % i for i in range(2500)]
+    ids = players.registerPlayers(names)
+    if ids is None or len(ids) != len(names):
+        raise ValueError("registerPlayers should return one id per name.")
+    if players.countPlayers() != len(names):
+        raise ValueError("All bulk registered players should be counted.")
+    registered = dict((row[0], row[1]) for row in game.playerStandings())
+    if [registered[i] for i in ids] != names:
+        raise ValueError("registerPlayers should return ids in input order.")
+    if players.registerPlayers([]) != []:
+        raise ValueError("Registering no players should return no ids.")
+    print "12. Bulk registration returns ids in input order."
+
+def testReportRound():
+    """
+    Test that a round is reported atomically and that an invalid
+    round leaves no matches behind.
+    """
+    players.deleteMatches()
+    players.deletePlayers()
+    [id1, id2, id3, id4] = players.registerPlayers(
+        ["Ajani Goldmane", "Liliana Vess", "Nissa Revane", "Sorin Markov"])
+    if game.reportMatches([(id1, id2), (id3, id3)]) is not None:
+        raise ValueError("A player cannot play against themselves.")
+    if game.reportMatches([(id1, id2), (id1, id3)]) is not None:
+        raise ValueError("A player can play only once per round.")
+    if game.reportMatches([(id1, id2), (id3, id4 + 1000)]) is not None:
+        raise ValueError("Unknown players should reject the round.")
+    for (i, n, w, m) in game.playerStandings():
+        if m != 0:
+            raise ValueError("A rejected round should not store any match.")
+    if game.reportMatches([(id1, id2), (id3, id4)]) != 'OK':
+        raise ValueError("A valid round should be stored.")
+    for (i, n, w, m) in game.playerStandings():
+        if m != 1:
+            raise ValueError("Each player should have one match recorded.")
+        if (i in (id1, id3)) != (w == 1):
+            raise ValueError("Each round winner should have one win.")
+    print "13. Rounds are reported atomically."
+
+def testStandingsCache():
+    """
+    Test that repeated reads are served from the cache and that
+    every write invalidates it.
+    """
+    if not isinstance(game.dbapi, tournament.db):
+        print "14. Skipped, the standings cache is part of the postgres backend."
+        return
+    players.deleteMatches()
+    players.deletePlayers()
+    [id1, id2] = players.registerPlayers(["Gideon Jura", "Chandra Nalaar"])
+    cache = game.dbapi.cache
+    game.playerStandings()
+    hits = cache.stats()['hits']
+    standings = game.playerStandings()
+    if cache.stats()['hits'] != hits + 1:
+        raise ValueError("Repeated standings should be served from cache.")
+    standings.pop()
+    if len(game.playerStandings()) != 2:
+        raise ValueError("Callers should not be able to alter the cache.")
+    game.reportMatch(id1, id2)
+    standings = game.playerStandings()
+    if [row[2] for row in standings] != [1, 0]:
+        raise ValueError("Reporting a match should invalidate the cache.")
+    players.registerPlayer("Karn")
+    if players.countPlayers() != 3 or len(game.playerStandings()) != 3:
+        raise ValueError("Registering should invalidate the cache.")
+    print "14. Standings are cached and invalidated on write."
+
+def testNoRematches():
+    """
+    Test that pairings avoid players who already met.
+    """
+    players.deleteMatches()
+    players.deletePlayers()
+    [id1, id2, id3, id4] = players.registerPlayers(
+        ["Elspeth Tirel", "Garruk Wildspeaker", "Tezzeret", "Venser"])
+    game.reportMatches([(id1, id2), (id3, id4)])
+    game.reportMatches([(id1, id3), (id2, id4)])
+    pairings = game.swissPairings()
+    actual_pairs = set(frozenset([row[0], row[2]]) for row in pairings)
+    if actual_pairs != set([frozenset([id1, id4]), frozenset([id2, id3])]):
+        raise ValueError("Players should not be paired for a rematch.")
+    print "15. Pairings avoid rematches."
+
+def testByes():
+    """
+    Test that an odd player out gets a bye, and never twice in a row.
+    """
+    players.deleteMatches()
+    players.deletePlayers()
+    ids = players.registerPlayers(["Ral Zarek", "Kiora", "Xenagos"])
+    pairings = game.swissPairings()
+    if len(pairings) != 2 or pairings[-1][2] is not None:
+        raise ValueError("With three players one of them gets a bye.")
+    (bye, name, none1, none2) = pairings[-1]
+    if bye != ids[-1]:
+        raise ValueError("The lowest ranked player should get the bye.")
+    (pid1, pname1, pid2, pname2) = pairings[0]
+    game.reportMatches([(pid1, pid2), (bye, None)])
+    for (i, n, w, m) in game.playerStandings():
+        if m != 1:
+            raise ValueError("A bye should count as a played match.")
+    pairings = game.swissPairings()
+    if pairings[-1][0] == bye:
+        raise ValueError("A player should not get a second bye.")
+    print "16. Odd players out get a bye."
+
+def testTournaments():
+    """
+    Test that tournaments are isolated from each other.
+    """
+    tournaments = tournament.Tournaments()
+    other = tournaments.registerTournament("Pro Tour")
+    if other is None or other == 1:
+        raise ValueError("registerTournament should return a new id.")
+    other_players = tournament.Players(tournament=other)
+    other_game = tournament.Game(tournament=other)
+    players.deleteMatches()
+    players.deletePlayers()
+    [id1, id2] = players.registerPlayers(["Sarkhan Vol", "Nahiri"])
+    [id3, id4, id5] = other_players.registerPlayers(
+        ["Ugin", "Kaya", "Vraska"])
+    other_game.reportMatch(id3, id4)
+    if players.countPlayers() != 2 or other_players.countPlayers() != 3:
+        raise ValueError("Each tournament should count its own players.")
+    if set(row[0] for row in game.playerStandings()) != set([id1, id2]):
+        raise ValueError("Standings should only list the tournament's players.")
+    if other_game.reportMatches([(id5, id1)]) is not None:
+        raise ValueError("Players of another tournament cannot be paired.")
+    players.deleteMatches()
+    players.deletePlayers()
+    if other_players.countPlayers() != 3:
+        raise ValueError("Deleting players should not touch other tournaments.")
+    if [row[2] for row in other_game.playerStandings()] != [1, 0, 0]:
+        raise ValueError("Deleting matches should not touch other tournaments.")
+    tournaments.deleteTournament(other)
+    if other in [row[0] for row in tournaments.listTournaments()]:
+        raise ValueError("deleteTournament should remove the tournament.")
+    if other_game.reportMatches([(id3, id4)]) is not None:
+        raise ValueError("A deleted tournament should take no reports.")
+
+    class partial(tournament.store):
+        def countPlayers(self):
+            return 0
+    try:
+        partial()
+    except TypeError:
+        pass
+    else:
+        raise ValueError("An incomplete backend should not be created.")
+    print "17. Tournaments are isolated from each other."
+
+
+def testPreparedStatements():
+    """
+    Test that statements are prepared once per pooled connection
+    and that the old keyword dispatcher still answers.
+    """
+    if not isinstance(game.dbapi, tournament.db):
+        print "18. Skipped, prepared statements are part of the postgres backend."
+        return
+    players.deleteMatches()
+    players.deletePlayers()
+    dbapi = game.dbapi
+    dbapi.cache.invalidate()
+    with dbapi.pool.connection() as connection:
+        cursor = connection.cursor()
+        dbapi.execute(cursor, 'counter', (dbapi.tournament, ))
+        dbapi.execute(cursor, 'counter', (dbapi.tournament, ))
+        cursor.execute("SELECT count(*) FROM pg_prepared_statements "
+                       "WHERE name = 'tournament_counter';")
+        if cursor.fetchone()[0] != 1:
+            raise ValueError("A statement should be prepared only once.")
+        if 'counter' not in dbapi.pool.prepared(connection):
+            raise ValueError("The pool should remember prepared statements.")
+    if dbapi.query(player="Karn") != 'OK' or dbapi.query(count='yes') != 1:
+        raise ValueError("query() should dispatch to the backend methods.")
+    try:
+        dbapi.query(count='yes', standings='yes')
+    except TypeError:
+        pass
+    else:
+        raise ValueError("query() should reject more than one command.")
+    players.deletePlayers()
+    print "18. Statements are prepared once per connection."
+
+def testStandingsStreaming():
+    """
+    Test that streamed and paginated standings match playerStandings().
+    """
+    players.deleteMatches()
+    players.deletePlayers()
+    ids = players.registerPlayers(["Player %d" % i for i in range(25)])
+    game.reportMatches(list(zip(ids[0::2], ids[1::2])))
+    game.reportMatches(list(zip(ids[0::4], ids[2::4])))
+    standings = game.playerStandings()
+    if list(game.iterStandings(batch=4)) != standings:
+        raise ValueError("iterStandings should yield the standings in order.")
+    pages, page = [], game.standingsPage(7)
+    while page:
+        pages.extend(page)
+        page = game.standingsPage(7, after=page[-1])
+    if pages != standings:
+        raise ValueError("Standings pages should add up to the standings.")
+    if game.standingsPage(3, after=standings[10]) != standings[11:14]:
+        raise ValueError("A page should start right after the given row.")
+    if isinstance(game.dbapi, tournament.db):
+        if game.dbapi.pool.stats()['in_use'] != 0:
+            raise ValueError("Streaming should return its connection.")
+
+        def broken(connection, name, params, batch):
+            yield standings[0]
+            raise tournament.psycopg2.OperationalError("connection lost")
+        game.dbapi.stream = broken
+        try:
+            list(game.iterStandings())
+        except tournament.psycopg2.OperationalError:
+            pass
+        else:
+            raise ValueError("A failed stream should not end quietly.")
+        finally:
+            del game.dbapi.stream
+    players.deleteMatches()
+    players.deletePlayers()
+    print "19. Standings can be streamed and paginated."
+
+def testTiebreaks():
+    """
+    Test Buchholz, Sonneborn-Berger and opponent match-win % columns.
+    """
+    players.deleteMatches()
+    players.deletePlayers()
+    [e, d, c, b, a] = players.registerPlayers(["E", "D", "C", "B", "A"])
+    game.reportMatches([(a, b), (c, d), (e, None)])
+    game.reportMatches([(a, c), (e, d), (b, None)])
+    if [row[0] for row in game.playerStandings()] != [e, a, c, b, d]:
+        raise ValueError("Plain standings should break ties by id.")
+    standings = game.playerStandings(tiebreaks=True)
+    if [row[0] for row in standings] != [a, e, b, c, d]:
+        raise ValueError("Ties should be broken by the tiebreak columns.")
+    expected = [(6, 6, 0.5), (0, 0, 1 / 3.0), (6, 0, 1.0),
+                (6, 0, 2 / 3.0), (9, 0, 0.75)]
+    for row, (buchholz, berger, omw) in zip(standings, expected):
+        if len(row) != 7:
+            raise ValueError("Each tiebreak row should have seven columns.")
+        if row[4] != buchholz or row[5] != berger or abs(row[6] - omw) > 1e-9:
+            raise ValueError("Tiebreaks of %s are wrong: %s" % (row[1], row))
+    game.reportMatch(d, b)
+    rows = dict((row[0], row) for row in game.playerStandings(tiebreaks=True))
+    if rows[d][4] != 12 or rows[a][5] != 6:
+        raise ValueError("Tiebreaks should follow reported matches.")
+    game.reportResult(a, e, 1, 1)
+    standings = game.playerStandings(tiebreaks=True)
+    if [row[0] for row in standings[:2]] != [a, e]:
+        raise ValueError("Draws should count in the tiebreaks.")
+    if standings[0][4:6] != (13, 9.5) or standings[1][4:6] != (10, 6.5):
+        raise ValueError("A draw should add half the opponent's points.")
+    if abs(standings[0][6] - 29 / 54.0) > 1e-9:
+        raise ValueError("Match-win ratios should count drawn points.")
+    players.deleteMatches()
+    players.deletePlayers()
+    print "20. Tiebreaks order players with equal points."
+
+def testLogging():
+    """
+    Test that log records are queued, written as JSON lines on flush,
+    gated by level and dropped rather than blocking when the queue is full.
+    """
+    handle, filename = tempfile.mkstemp(suffix='.log')
+    os.close(handle)
+    handler = tournament.logqueue(filename, structured=True, capacity=50,
+                                  interval=60)
+    log = logging.getLogger('tournament.test')
+    log.addHandler(handler)
+    log.propagate = False
+    log.setLevel(logging.INFO)
+    for i in range(100):
+        log.info("Match %s stored", i)
+        log.debug("Never formatted %s", i)
+    handler.flush()
+    with open(filename) as written:
+        lines = [json.loads(line) for line in written]
+    log.removeHandler(handler)
+    handler.close()
+    os.remove(filename)
+    if [line['message'] for line in lines] != [
+            "Match %d stored" % i for i in range(50)]:
+        raise ValueError("Queued records should be written in order.")
+    if handler.dropped != 50:
+        raise ValueError("Records beyond the capacity should be dropped.")
+    print "21. Logging is queued, level gated and structured."
+
+def testMetrics():
+    """
+    Test that db operations are timed, counted and exported, and that
+    sampled calls are profiled.
+    """
+    if not isinstance(game.dbapi, tournament.db):
+        print "22. Skipped, metrics instrument the postgres backend."
+        return
+    registry = tournament.shared_metrics()
+    players.deleteMatches()
+    players.deletePlayers()
+    calls = registry.value('tournament_operation_seconds',
+                           operation='registerPlayers')
+    rows = registry.value('tournament_query_rows_total',
+                          statement='insert_names')
+    def errors():
+        return sum(value for (name, labels), value
+                   in registry.counters.items()
+                   if name == 'tournament_errors_total')
+    before = errors()
+    players.registerPlayers(["Jace", "Liliana", "Gideon"])
+    if registry.value('tournament_operation_seconds',
+                      operation='registerPlayers') != calls + 1:
+        raise ValueError("Each operation should be timed once.")
+    if registry.value('tournament_query_rows_total',
+                      statement='insert_names') != rows + 3:
+        raise ValueError("Rows written by a statement should be counted.")
+    game.dbapi.reportMatch(-1, -2)
+    if errors() != before + 1:
+        raise ValueError("Swallowed errors should be counted.")
+    text = registry.exposition()
+    for line in ('# TYPE tournament_operation_seconds histogram',
+                 'tournament_operation_seconds_bucket{'
+                 'operation="registerPlayers",le="+Inf"}',
+                 'tournament_pool_checkouts '):
+        if line not in text:
+            raise ValueError("Exposition should contain %s" % line)
+    directory = tempfile.mkdtemp()
+    registry.profile_rate, registry.profile_dir = 1.0, directory
+    try:
+        players.countPlayers()
+    finally:
+        registry.profile_rate, registry.profile_dir = 0.0, None
+    profiles = os.listdir(directory)
+    for name in profiles:
+        os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
+    if len(profiles) != 1 or not profiles[0].startswith('countPlayers-'):
+        raise ValueError("A sampled call should leave one profile.")
+    players.deletePlayers()
+    print "22. Operations are timed, counted and exported."
+
+def testRatings():
+    """
+    Test Elo and Glicko-2 ratings, incrementally and replayed.
+    """
+    if tournament.numpy is None:
+        print "23. Skipped, the rating engines need numpy."
+        return
+    players.deleteMatches()
+    players.deletePlayers()
+    rated = tournament.Game(tournament.backend(rating=tournament.elo()))
+    [a, b, c, d] = players.registerPlayers(["A", "B", "C", "D"])
+    rated.reportMatches([(a, b), (c, d)])
+    rows = dict((row[0], row) for row in rated.playerRatings())
+    if [round(rows[uid][2]) for uid in (a, b, c, d)] != [1516, 1484] * 2:
+        raise ValueError("Equal ratings should move by k/2.")
+    rated.reportMatch(a, c)
+    rated.reportMatch(b, d)
+    rated.reportBye(a)
+    ratings = rated.playerRatings()
+    if [row[0] for row in ratings] != [a, b, c, d]:
+        raise ValueError("Ratings should be ordered by rating, then id.")
+    if [round(row[2]) for row in ratings] != [1532, 1500, 1500, 1468]:
+        raise ValueError("Elo ratings are wrong: %s" % ratings)
+    if ratings[0][5] != 2:
+        raise ValueError("Byes should not be rated.")
+    if rated.recomputeRatings() != 4:
+        raise ValueError("Replay should rate the four players.")
+    for row, replayed in zip(ratings, rated.playerRatings()):
+        if row[0] != replayed[0] or abs(row[2] - replayed[2]) > 1e-6:
+            raise ValueError("Replay should match the reported ratings.")
+    glicko = tournament.Game(
+        tournament.backend(rating=tournament.glicko2()))
+    glicko.recomputeRatings()
+    glicko.reportMatch(d, a)
+    ids, state = tournament.replay(tournament.glicko2(), [
+        (a, b), (c, d), (a, c), (b, d), (a, None), (d, a)])
+    expected = dict(zip(ids.tolist(), state.tolist()))
+    for row in glicko.playerRatings():
+        for column in range(3):
+            if abs(row[2 + column] - expected[row[0]][column]) > 1e-6:
+                raise ValueError("Glicko-2 ratings are wrong: %s" % (row, ))
+        if not row[3] < 350:
+            raise ValueError("Rated games should lower the deviation.")
+    players.deleteMatches()
+    if set(row[2] for row in rated.playerRatings()) != set([1500]):
+        raise ValueError("Deleting matches should reset the ratings.")
+    players.deletePlayers()
+    print "23. Elo and Glicko-2 ratings follow reported matches."
+
+def testSimulation():
+    """
+    Test that simulated events are reproducible with any worker count.
+    """
+    import tournament_sim
+    runs = [sorted(tournament_sim.simulate(6, 16, [3, 4], [4], seed=7,
+                                           workers=workers))
+            for workers in (1, 2)]
+    if runs[0] != runs[1]:
+        raise ValueError("Results should not depend on the workers.")
+    if len(runs[0]) != 6 or len(runs[0][0]) != 2:
+        raise ValueError("Each event should measure every round count.")
+    for rows in runs[0]:
+        for rounds, cut, measures in rows:
+            if not 0 <= measures['cut_accuracy'] <= 1:
+                raise ValueError("Cut accuracy should be a share.")
+            if measures['cut_wins'] > rounds:
+                raise ValueError("The cut cannot need more wins than rounds.")
+    print "24. Simulated events are reproducible in a process pool."
+
+def testSnapshots():
+    """
+    Test that an exported tournament imports with the same standings.
+    """
+    players.deleteMatches()
+    players.deletePlayers()
+    tournaments = tournament.Tournaments()
+    ids = players.registerPlayers(["Ajani", "Tab\tby", "Nissa", "Chandra",
+                                   "Sorin"])
+    game.reportMatches([(ids[0], ids[1]), (ids[2], ids[3]), (ids[4], None)])
+    game.reportMatches([(ids[4], ids[0]), (ids[1], ids[2]), (ids[3], None)])
+    path = tempfile.mktemp()
+    try:
+        if tournaments.exportTournament(1, path) != 'OK':
+            raise ValueError("Export should succeed.")
+        clone = tournaments.importTournament(path, name="What if")
+    finally:
+        os.remove(path)
+    if (clone, "What if") not in tournaments.listTournaments():
+        raise ValueError("Import should create a new tournament.")
+    copy = tournament.Game(tournament=clone)
+
+    def unnumbered(rows):
+        return [row[1:] for row in rows]
+    if unnumbered(copy.playerStandings(True)) != \
+            unnumbered(game.playerStandings(True)):
+        raise ValueError("Standings and history should survive a reload.")
+    if set(row[0] for row in copy.playerStandings()) & set(ids):
+        raise ValueError("Imported players should get new ids.")
+    if len(copy.roundResults(2)) != 3:
+        raise ValueError("Rounds should survive a reload.")
+    copy.reportMatch(copy.playerStandings()[0][0],
+                     copy.playerStandings()[1][0])
+    if game.playerStandings()[0][3] != 2:
+        raise ValueError("The clone should not change the original.")
+    tournaments.deleteTournament(clone)
+    players.deleteMatches()
+    players.deletePlayers()
+    print "25. Tournaments can be exported and imported."
+
+def testHistory():
+    """
+    Test round numbering and the opponent history lookups.
+    """
+    players.deleteMatches()
+    players.deletePlayers()
+    [a, b, c, d, e] = players.registerPlayers(["A", "B", "C", "D", "E"])
+    game.reportMatches([(a, b), (c, d), (e, None)])
+    game.reportMatch(a, c)
+    game.reportMatch(d, e)
+    game.reportBye(b)
+    game.reportMatch(b, e, round=7)
+    if game.opponentHistory(a) != [(1, b, True), (2, c, True)]:
+        raise ValueError("History should list opponents by round.")
+    if game.opponentHistory(e) != [(1, None, True), (2, d, False),
+                                   (7, b, False)]:
+        raise ValueError("Byes and explicit rounds should be kept.")
+    if not game.havePlayed(b, a) or game.havePlayed(a, d):
+        raise ValueError("havePlayed should find matches either way.")
+    if set(game.roundResults(1)) != set([(a, b), (c, d), (e, None)]):
+        raise ValueError("A reported round should share its number.")
+    if set(game.roundResults(2)) != set([(a, c), (d, e), (b, None)]):
+        raise ValueError("Rounds should follow the players' matches.")
+    players.deleteMatches()
+    if game.opponentHistory(a) != [] or game.roundResults(1) != []:
+        raise ValueError("Deleting matches should clear the history.")
+    players.deletePlayers()
+    print "26. Matches are numbered by round and indexed by player."
+
+def testDraws():
+    """
+    Test draws, game scores and match points.
+    """
+    players.deleteMatches()
+    players.deletePlayers()
+    tournaments = tournament.Tournaments()
+    [a, b, c, d, e] = players.registerPlayers(["A", "B", "C", "D", "E"])
+    game.reportMatches([(b, a, 1, 2), (c, d, 1, 1), (e, None)])
+    expected = [(a, "A", 3, 1, 0, 1, 2, 3), (e, "E", 3, 1, 0, 1, 0, 0),
+                (c, "C", 1, 0, 1, 1, 1, 2), (d, "D", 1, 0, 1, 1, 1, 2),
+                (b, "B", 0, 0, 0, 1, 1, 3)]
+    if game.pointStandings() != expected:
+        raise ValueError("A round should add up points and games.")
+    if [row[0] for row in game.playerStandings()] != [a, e, c, d, b]:
+        raise ValueError("Standings should be ordered by points.")
+    if game.opponentHistory(c) != [(1, d, False)] or \
+            game.opponentHistory(d) != [(1, c, False)]:
+        raise ValueError("A draw should be won by neither player.")
+    if game.reportMatches([(a, c, -1, 0)]) is not None or \
+            game.reportMatches([(a, None, None, None)]) is not None:
+        raise ValueError("Negative games and drawn byes should fail.")
+    game.reportResult(d, b, 0, 2)
+    game.reportResult(a, e, None, None)
+    if (b, d) not in game.roundResults(2):
+        raise ValueError("The player with more games should win.")
+    if [row[2] for row in game.pointStandings()] != [4, 4, 3, 1, 1]:
+        raise ValueError("Single results should add up points too.")
+    path = tempfile.mktemp()
+    try:
+        tournaments.exportTournament(1, path)
+        clone = tournaments.importTournament(path)
+    finally:
+        os.remove(path)
+    copy = tournament.Game(tournament=clone)
+    if [row[1:] for row in copy.pointStandings()] != \
+            [row[1:] for row in game.pointStandings()]:
+        raise ValueError("Draws and games should survive a reload.")
+    tournaments.deleteTournament(clone)
+    players.deleteMatches()
+    if set(row[2] for row in game.pointStandings()) != set([0]):
+        raise ValueError("Deleting matches should reset the points.")
+    players.deletePlayers()
+    print "27. Draws and game scores add up to match points."
+
 
 if __name__ == '__main__':
     testCount()
     testStandingsBeforeMatches()
     testReportMatches()
     testPairings()
+    testSharedPool()
+    testBulkRegistration()
+    testReportRound()
+    testStandingsCache()
+    testNoRematches()
+    testByes()
+    testTournaments()
+    testPreparedStatements()
+    testStandingsStreaming()
+    testTiebreaks()
+    testLogging()
+    testMetrics()
+    testRatings()
+    testSimulation()
+    testSnapshots()
+    testHistory()
+    testDraws()
     print "Success!  All tests pass!"